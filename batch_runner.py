@@ -0,0 +1,192 @@
+"""
+Batch conversation simulator for Sky Credit Voice Assistant
+Runs many independent MainAgent/TestingAgent pairs concurrently over a file of scenarios,
+writes per-conversation transcripts and results as JSONL and prints an aggregate table.
+
+Usage:
+    python batch_runner.py test_scenarios.jsonl --workers 8 --rate 4 --output logs/batch [--evaluate]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+from src.main_agent import AGENT_MODES, REACT_MODE, MainAgent
+from testing_agent import ConversationEvaluator, TestingAgent
+from run_test import configure_lm, simulate_conversation
+from logger_config import get_logger
+
+logger = get_logger("batch_runner")
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls evenly at `rate` per second (0 disables it)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def load_scenarios(path: str) -> List[dict]:
+    """Read scenarios from JSONL, one object per line with at least name and scenario_context"""
+    scenarios = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                scenarios.append(json.loads(line))
+    return scenarios
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_scenario(scenario: dict, limiter: RateLimiter, mode: str = REACT_MODE) -> dict:
+    """Run one scenario with its own agent pair and return its result record"""
+    name = scenario["name"]
+    main_agent = MainAgent(mode=mode)
+    testing_agent = TestingAgent(scenario_context=scenario["scenario_context"])
+    started = time.perf_counter()
+    try:
+        conversation = simulate_conversation(
+            main_agent,
+            testing_agent,
+            max_turns=scenario.get("max_turns", 10),
+            initial_message=scenario.get("initial_message"),
+            before_turn=limiter.acquire,
+        )
+        error = None
+    except Exception as e:
+        logger.error("Scenario %s failed: %s", name, e)
+        conversation = {"transcript": [], "turn_latencies": [], "ended_by_customer": False}
+        error = str(e)
+    finally:
+        main_agent.close()
+
+    expected_reference = scenario.get("expected_reference")
+    verified_reference = main_agent.state.verified_customer_ref
+    passed = error is None and (expected_reference is None or verified_reference == expected_reference)
+
+    return {
+        "name": name,
+        "passed": passed,
+        "error": error,
+        "expected_reference": expected_reference,
+        "verified_reference": verified_reference,
+        "turns": len(conversation["turn_latencies"]),
+        "ended_by_customer": conversation["ended_by_customer"],
+        "turn_latencies": conversation["turn_latencies"],
+        "wall_time": time.perf_counter() - started,
+        "transcript": conversation["transcript"],
+    }
+
+def run_batch(
+    scenarios: List[dict],
+    workers: int = 4,
+    rate: float = 0.0,
+    output_dir: str = "logs/batch",
+    evaluator: Optional[ConversationEvaluator] = None,
+    mode: str = REACT_MODE,
+) -> List[dict]:
+    """Run all scenarios concurrently, streaming results to JSONL as they finish.
+
+    With an evaluator, every transcript is scored against its expected outcomes once the
+    batch is done and the scores are written to evaluations.jsonl.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    limiter = RateLimiter(rate)
+    results = []
+    transcripts = {}
+
+    with open(os.path.join(output_dir, "transcripts.jsonl"), "w") as transcripts_file, \
+            open(os.path.join(output_dir, "results.jsonl"), "w") as results_file, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_scenario, scenario, limiter, mode) for scenario in scenarios]
+        for future in as_completed(futures):
+            result = future.result()
+            transcript = result.pop("transcript")
+            transcripts[result["name"]] = transcript
+            transcripts_file.write(json.dumps({"name": result["name"], "transcript": transcript}) + "\n")
+            results_file.write(json.dumps(result) + "\n")
+            transcripts_file.flush()
+            results_file.flush()
+            logger.info("Scenario %s finished: %s", result['name'], 'pass' if result['passed'] else 'fail')
+            results.append(result)
+
+    if evaluator is not None:
+        evaluations = evaluator.evaluate_many(
+            [transcripts[result["name"]] for result in results],
+            [result["expected_reference"] for result in results],
+            max_workers=workers,
+        )
+        with open(os.path.join(output_dir, "evaluations.jsonl"), "w") as f:
+            for result, evaluation in zip(results, evaluations):
+                result["outcome_score"] = evaluation["score"]
+                f.write(json.dumps({"name": result["name"], **evaluation}) + "\n")
+
+    return results
+
+def print_summary(results: List[dict], wall_time: Optional[float] = None):
+    """Print a pass/fail and latency table for a finished batch"""
+    print(f"{'Scenario':<32} {'Result':<6} {'Turns':>5} {'p50 (s)':>8} {'p95 (s)':>8} {'Wall (s)':>9}")
+    print("-" * 72)
+    for result in sorted(results, key=lambda r: r["name"]):
+        latencies = result["turn_latencies"]
+        print(
+            f"{result['name'][:32]:<32} {'PASS' if result['passed'] else 'FAIL':<6} {result['turns']:>5} "
+            f"{percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f} {result['wall_time']:>9.1f}"
+        )
+
+    all_latencies = [latency for result in results for latency in result["turn_latencies"]]
+    passed = sum(1 for result in results if result["passed"])
+    print("-" * 72)
+    print(f"Passed: {passed}/{len(results)}")
+    if all_latencies:
+        print(
+            f"Turn latency: mean {statistics.mean(all_latencies):.2f}s, p50 {percentile(all_latencies, 50):.2f}s, "
+            f"p95 {percentile(all_latencies, 95):.2f}s, p99 {percentile(all_latencies, 99):.2f}s"
+        )
+    scores = [result["outcome_score"] for result in results if "outcome_score" in result]
+    if scores:
+        print(f"Expected outcomes: mean score {statistics.mean(scores):.0%}, min {min(scores):.0%}")
+    if wall_time is not None:
+        print(f"Batch wall time: {wall_time:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run simulated conversations for a file of scenarios")
+    parser.add_argument("scenarios", help="JSONL file of scenarios")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent agent/tester pairs")
+    parser.add_argument("--rate", type=float, default=0.0, help="Max assistant turns per second across workers (0 = unlimited)")
+    parser.add_argument("--output", default="logs/batch", help="Directory for transcripts.jsonl and results.jsonl")
+    parser.add_argument("--mode", choices=AGENT_MODES, default=REACT_MODE, help="Agent mode: ReAct on every turn, or a single direct call per turn")
+    parser.add_argument("--evaluate", action="store_true", help="Score transcripts against the expected outcomes")
+    parser.add_argument("--eval-cache", default="logs/evaluation_cache.jsonl", help="Evaluation cache keyed by transcript hash")
+    args = parser.parse_args()
+
+    configure_lm()
+    scenarios = load_scenarios(args.scenarios)
+    logger.info("Running %d scenarios with %d workers", len(scenarios), args.workers)
+
+    started = time.perf_counter()
+    evaluator = ConversationEvaluator(cache_path=args.eval_cache) if args.evaluate else None
+    results = run_batch(scenarios, workers=args.workers, rate=args.rate, output_dir=args.output, evaluator=evaluator, mode=args.mode)
+    print_summary(results, time.perf_counter() - started)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""
+Offline benchmark suite for Sky Credit Voice Assistant
+Run `python -m benchmarks run` to measure the parts of a turn we control with the stub LM,
+and `python -m benchmarks compare <baseline.json> <current.json>` to check for regressions.
+"""
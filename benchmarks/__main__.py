@@ -0,0 +1,57 @@
+"""
+Usage:
+    python -m benchmarks run [--quick] [--only lookup,fuzzy,prompt,turn,full_call,modes] [--output PATH]
+    python -m benchmarks compare BASELINE CURRENT [--threshold 0.15]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from .harness import compare, load_results, primary_metric, save_results
+
+def run(args) -> int:
+    from .suite import run_suite
+
+    results = run_suite(quick=args.quick, only=args.only.split(",") if args.only else None)
+    output = args.output or os.path.join("benchmarks", "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    save_results(output, results)
+    for name, result in results.items():
+        metric = primary_metric(result)
+        print(f"{name:<40} {metric:<22} {result[metric]:>14.2f}")
+    print(f"\nSaved {len(results)} results to {output}")
+    return 0
+
+def compare_runs(args) -> int:
+    rows = compare(load_results(args.baseline), load_results(args.current), threshold=args.threshold)
+    regressions = 0
+    for name, metric, before, after, change, regressed in rows:
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<40} {metric:<22} {before:>12.2f} -> {after:>12.2f} {change:>+8.1%} {flag}")
+    print(f"\n{len(rows)} benchmarks compared, {regressions} slower than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the suite and save a JSON result file")
+    run_parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer iterations")
+    run_parser.add_argument("--only", help="Comma separated subset: lookup, prompt, turn, full_call")
+    run_parser.add_argument("--output", help="Result file (default benchmarks/results/<timestamp>.json)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files, exit 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown (default 0.15)")
+    compare_parser.set_defaults(handler=compare_runs)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
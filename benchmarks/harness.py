@@ -0,0 +1,71 @@
+"""
+Timing helpers and result files for the benchmark suite
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict
+
+import dspy
+
+def measure(fn: Callable[[], object], repeat: int = 5, number: int = 1000, warmup: int = 1) -> Dict[str, float]:
+    """Time `fn` in `repeat` rounds of `number` calls, reporting per-call figures in microseconds.
+
+    The best round is the headline figure, as the least disturbed by other work on the machine.
+    """
+    for _ in range(warmup):
+        fn()
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - started) / number * 1e6)
+    best = min(rounds)
+    return {
+        "us_per_call": best,
+        "median_us": statistics.median(rounds),
+        "ops_per_sec": 1e6 / best if best else float("inf"),
+        "calls": repeat * number,
+    }
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": sys.version.split()[0],
+        "dspy": getattr(dspy, "__version__", "unknown"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def save_results(path: str, results: Dict[str, dict]) -> None:
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+
+def load_results(path: str) -> Dict[str, dict]:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+# The figure compared for a benchmark is the first of these it reports; all are lower-is-better
+PRIMARY_METRICS = ("us_per_call", "overhead_us_per_turn", "wall_s_per_call", "wall_s_per_turn", "p95_turn_s")
+
+def primary_metric(result: dict):
+    for metric in PRIMARY_METRICS:
+        if metric in result:
+            return metric
+    return None
+
+def compare(baseline: Dict[str, dict], current: Dict[str, dict], threshold: float = 0.15) -> list:
+    """Rows of (name, metric, baseline, current, change, regressed) for benchmarks in both runs"""
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        metric = primary_metric(current[name])
+        if metric is None or metric not in baseline[name]:
+            continue
+        before, after = baseline[name][metric], current[name][metric]
+        change = (after - before) / before if before else 0.0
+        rows.append((name, metric, before, after, change, change > threshold))
+    return rows
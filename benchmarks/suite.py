@@ -0,0 +1,219 @@
+"""
+Benchmarks for the parts of a turn that do not depend on the LM provider
+Every benchmark runs offline against stub_lm.StubLM and returns {name: result}.
+"""
+
+import itertools
+import os
+import random
+import tempfile
+import time
+from typing import Dict, Iterator, List
+
+import dspy
+
+from stub_lm import StubLM
+from src.customer_store import ColumnarCustomerStore, InMemoryCustomerStore, SQLiteCustomerStore, build_columnar_store
+from src.db import Customer, lookup_customer, set_customer_store
+from src.fuzzy_match import match_customer
+from src.history_policy import RollingHistoryPolicy
+from src.main_agent import DIRECT_MODE, REACT_MODE, ConversationState, MainAgent
+
+from .harness import measure
+
+SAMPLE_TURN = {
+    "customer_input": "I'd like to split the arrears over my next few payments.",
+    "response": "Certainly, I can help with that. Let me go through the options with you.",
+}
+
+# A verified balance enquiry: four fast path turns, a lookup, then the balance scenario
+SCRIPTED_CALL = [
+    "Hi, I'd like to check my balance please",
+    "My reference is XT59591",
+    "Paul Walshe",
+    "It's the 3rd of March 1985",
+    "What is my balance?",
+    "No, that's all, thanks",
+]
+
+def synthetic_customers(count: int) -> Iterator[Customer]:
+    """Distinct customers with references like AA00042 and mobiles like +61400000042"""
+    for i in range(count):
+        block = i // 100_000
+        reference = f"{chr(65 + block // 26 % 26)}{chr(65 + block % 26)}{i % 100_000:05d}"
+        yield Customer(
+            firstName=f"First{i}", lastName=f"Last{i}", emailAddress=f"customer{i}@example.com",
+            mobileNumber=f"+614{i:08d}", clientReferenceNumber=reference, accountBalance=1000.0,
+            arrearsBalance=100.0, minimumAmountDue=50.0, nextPaymentDate="2025-09-17",
+            accountStatus="Arrears", daysPastDue=10,
+        )
+
+def bench_lookup(sizes: List[int], number: int = 2000, repeat: int = 5) -> Dict[str, dict]:
+    """lookup_customer throughput by reference and by mobile for each backend and book size"""
+    results = {}
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            customers = list(synthetic_customers(size))
+            sample = [customers[rng.randrange(size)] for _ in range(1000)]
+            sqlite_store = SQLiteCustomerStore(os.path.join(tmp, f"customers_{size}.db"))
+            sqlite_store.add_many(customers)
+            columnar_path = os.path.join(tmp, f"customers_{size}.col")
+            build_columnar_store((customer.model_dump() for customer in customers), columnar_path)
+            backends = (
+                ("memory", InMemoryCustomerStore(customers)),
+                ("sqlite", sqlite_store),
+                ("columnar", ColumnarCustomerStore(columnar_path)),
+            )
+            for backend, store in backends:
+                set_customer_store(store)
+                for key in ("reference", "mobile"):
+                    queries = itertools.cycle([
+                        (c.clientReferenceNumber if key == "reference" else "0" + c.mobileNumber[3:], c.firstName, c.lastName)
+                        for c in sample
+                    ])
+                    result = measure(lambda: lookup_customer(*next(queries)), repeat=repeat, number=number)
+                    results[f"lookup_{backend}_{key}_{size}"] = {**result, "db_size": size}
+    set_customer_store(None)
+    return results
+
+def bench_fuzzy_lookup(sizes: List[int], number: int = 500, repeat: int = 5) -> Dict[str, dict]:
+    """match_customer recovering a reference misheard in one digit, for each backend and book size"""
+    results = {}
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            customers = list(synthetic_customers(size))
+            sample = [customers[rng.randrange(size)] for _ in range(1000)]
+            sqlite_store = SQLiteCustomerStore(os.path.join(tmp, f"customers_{size}.db"))
+            sqlite_store.add_many(customers)
+            columnar_path = os.path.join(tmp, f"customers_{size}.col")
+            build_columnar_store((customer.model_dump() for customer in customers), columnar_path)
+            backends = (
+                ("memory", InMemoryCustomerStore(customers)),
+                ("sqlite", sqlite_store),
+                ("columnar", ColumnarCustomerStore(columnar_path)),
+            )
+            del customers
+            # The last digit misheard, e.g. AA00042 as AA00043, and the first name misspelled
+            queries = [
+                (c.clientReferenceNumber[:-1] + str((int(c.clientReferenceNumber[-1]) + 1) % 10), c.firstName + "e", c.lastName)
+                for c in sample
+            ]
+            for backend, store in backends:
+                set_customer_store(store)
+                cycle = itertools.cycle(queries)
+                result = measure(lambda: match_customer(*next(cycle)), repeat=repeat, number=number)
+                results[f"fuzzy_{backend}_{size}"] = {**result, "db_size": size}
+    set_customer_store(None)
+    return results
+
+def bench_prompt_format(turn_counts: List[int], number: int = 200, repeat: int = 5) -> Dict[str, dict]:
+    """Cost of rendering the SkyCreditVoiceAssistant ReAct prompt as the history grows,
+    with the raw history and with the rolling history policy (no LM summaries)"""
+    results = {}
+    agent = MainAgent(fast_verification=False, orchestrate_scenarios=False, prefetch=False)
+    predictor = agent.agent.react
+    adapter = dspy.ChatAdapter()
+    policy = RollingHistoryPolicy(summarize_with_lm=False)
+    for turns in turn_counts:
+        messages = [dict(SAMPLE_TURN) for _ in range(turns)]
+        for variant in ("raw", "policy"):
+            def render():
+                if variant == "raw":
+                    history = dspy.History(messages=messages)
+                else:
+                    history = policy.build(ConversationState(history=dspy.History(messages=list(messages))))
+                inputs = {"customer_input": "Yes, please split it.", "history": history, "trajectory": ""}
+                return adapter.format(predictor.signature, demos=predictor.demos, inputs=inputs)
+            prompt_chars = sum(len(message["content"]) for message in render())
+            result = measure(render, repeat=repeat, number=number)
+            results[f"prompt_format_{variant}_{turns}_turns"] = {**result, "history_turns": turns, "prompt_chars": prompt_chars}
+    return results
+
+def bench_turn_overhead(turns: int = 200, history_turns: int = 6, repeat: int = 3) -> Dict[str, dict]:
+    """Time MainAgent.process_input spends outside the LM, for a ReAct turn and a fast path turn.
+    The best of `repeat` rounds is reported."""
+    lm = StubLM()
+
+    def best_round(agent: MainAgent, customer_input: str, make_state) -> tuple:
+        best, calls = float("inf"), 0
+        for _ in range(repeat):
+            lm.calls, lm.busy_time = 0, 0.0
+            started = time.perf_counter()
+            for _ in range(turns):
+                agent.process_input(customer_input, state=make_state())
+            best = min(best, (time.perf_counter() - started - lm.busy_time) / turns * 1e6)
+            calls = lm.calls
+        return best, calls / turns
+
+    with dspy.context(lm=lm):
+        with MainAgent(fast_verification=False, orchestrate_scenarios=False) as react_agent:
+            react_us, react_calls = best_round(
+                react_agent, "Can you tell me what I owe?",
+                lambda: ConversationState(history=dspy.History(messages=[dict(SAMPLE_TURN) for _ in range(history_turns)])),
+            )
+        with MainAgent() as fast_agent:
+            fast_us, fast_calls = best_round(fast_agent, "Hi, I'd like to check my balance please", ConversationState)
+    return {
+        "turn_overhead_react": {"overhead_us_per_turn": react_us, "lm_calls_per_turn": react_calls, "history_turns": history_turns},
+        "turn_overhead_fast_path": {"overhead_us_per_turn": fast_us, "lm_calls_per_turn": fast_calls},
+    }
+
+def bench_full_call(calls: int = 5, lm_latency: float = 0.05) -> Dict[str, dict]:
+    """Wall time of a scripted verified call with a fixed simulated LM latency"""
+    lm = StubLM(latency=lm_latency)
+    with dspy.context(lm=lm), MainAgent() as agent:
+        started = time.perf_counter()
+        for _ in range(calls):
+            state = ConversationState()
+            for utterance in SCRIPTED_CALL:
+                agent.process_input(utterance, state=state)
+        elapsed = time.perf_counter() - started
+    return {
+        "full_call_scripted": {
+            "wall_s_per_call": elapsed / calls,
+            "lm_calls_per_call": lm.calls / calls,
+            "lm_time_share": lm.busy_time / elapsed,
+            "lm_latency_s": lm_latency,
+            "turns_per_call": len(SCRIPTED_CALL),
+            "verified": state.verified_customer_ref is not None,
+        }
+    }
+
+def bench_agent_modes(calls: int = 3, lm_latency: float = 0.05) -> Dict[str, dict]:
+    """LM calls and wall time per turn of the scripted call in ReAct and direct-answer mode,
+    with every turn going to the agent (no verification fast path or scenario modules)"""
+    results = {}
+    for mode in (REACT_MODE, DIRECT_MODE):
+        lm = StubLM(latency=lm_latency)
+        with dspy.context(lm=lm), MainAgent(fast_verification=False, orchestrate_scenarios=False, mode=mode) as agent:
+            started = time.perf_counter()
+            for _ in range(calls):
+                state = ConversationState()
+                for utterance in SCRIPTED_CALL:
+                    agent.process_input(utterance, state=state)
+            elapsed = time.perf_counter() - started
+        turns = calls * len(SCRIPTED_CALL)
+        results[f"agent_mode_{mode}"] = {
+            "wall_s_per_turn": elapsed / turns,
+            "lm_calls_per_turn": lm.calls / turns,
+            "lm_latency_s": lm_latency,
+        }
+    return results
+
+def run_suite(quick: bool = False, only: List[str] = None) -> Dict[str, dict]:
+    benches = {
+        "lookup": lambda: bench_lookup([1_000, 10_000] if quick else [1_000, 10_000, 100_000], number=500 if quick else 2000),
+        "fuzzy": lambda: bench_fuzzy_lookup([10_000] if quick else [10_000, 1_000_000], number=200 if quick else 500),
+        "prompt": lambda: bench_prompt_format([0, 5, 20] if quick else [0, 5, 10, 20, 40], number=50 if quick else 200),
+        "turn": lambda: bench_turn_overhead(turns=50 if quick else 200),
+        "full_call": lambda: bench_full_call(calls=2 if quick else 5),
+        "modes": lambda: bench_agent_modes(calls=1 if quick else 3),
+    }
+    results = {}
+    for name, bench in benches.items():
+        if only and name not in only:
+            continue
+        results.update(bench())
+    return results
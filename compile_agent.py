@@ -0,0 +1,241 @@
+"""
+Compile the MainAgent ReAct program against simulated calls
+Runs TestingAgent conversations over a file of scenarios with the uncompiled program, keeps
+the ReAct turns of calls that ConversationEvaluator scored well as training examples, and
+bootstraps few-shot demos from them with dspy.BootstrapFewShot, once per demo count.
+
+Every candidate, and the uncompiled baseline, is then scored on whole conversations: outcome
+score, minus a penalty for prompt tokens and extra ReAct iterations per model turn. Demos cost
+prompt tokens on every call, so they only win when they save iterations or raise the score.
+Candidates that pass fewer scenarios than the baseline are never chosen. Score them on
+separate --dev scenarios: without, they are scored on the scenarios their demos came from,
+which favours them. The winner is saved as a DSPy program state file that MainAgent loads
+with program_path or SKY_AGENT_PROGRAM. The baseline is always the uncompiled program,
+whatever SKY_AGENT_PROGRAM is set to.
+
+Usage:
+    python compile_agent.py train_scenarios.jsonl --dev test_scenarios.jsonl --demos 1,2,4 --output programs/main_agent.json
+    SKY_AGENT_PROGRAM=programs/main_agent.json python batch_runner.py test_scenarios.jsonl --evaluate
+"""
+
+import argparse
+import os
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+from batch_runner import load_scenarios
+from benchmarks.harness import save_results
+from logger_config import get_logger
+from run_test import configure_lm, simulate_conversation
+from src.main_agent import MainAgent
+from src.metrics import MetricsCollector, TurnMetrics
+from testing_agent import ConversationEvaluator, TestingAgent
+
+logger = get_logger("compile_agent")
+
+LOOKUP_TOOL = "lookup_customer"
+
+def tool_names(prediction: dspy.Prediction) -> List[str]:
+    """Tools a ReAct prediction called, in order, including the final `finish`"""
+    trajectory = getattr(prediction, "trajectory", None) or {}
+    return [value for key, value in trajectory.items() if key.startswith("tool_name_")]
+
+class ReActRecorder(BaseCallback):
+    """Records the calls of one ReAct program as training examples labelled with its answer"""
+
+    def __init__(self, program: dspy.Module):
+        self.program = program
+        self.examples: List[dspy.Example] = []
+        self._pending: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def on_module_start(self, call_id, instance, inputs):
+        if instance is self.program:
+            # Module.__call__ takes **kwargs, which is how MainAgent passes the turn's inputs
+            with self._lock:
+                self._pending[call_id] = dict(inputs.get("kwargs", inputs))
+
+    def on_module_end(self, call_id, outputs, exception=None):
+        with self._lock:
+            inputs = self._pending.pop(call_id, None)
+        if inputs is None or exception is not None or outputs is None:
+            return
+        tools = tool_names(outputs)
+        self.examples.append(dspy.Example(
+            customer_input=inputs["customer_input"],
+            history=inputs["history"],
+            response=outputs.response,
+            iterations=len(tools),
+            used_lookup=LOOKUP_TOOL in tools,
+        ).with_inputs("customer_input", "history"))
+
+def turn_metric(example: dspy.Example, prediction: dspy.Prediction, trace=None):
+    """A turn agrees with its reference when it makes the same lookup decision; while
+    bootstrapping it must also take no more ReAct iterations than the reference did"""
+    tools = tool_names(prediction)
+    agrees = bool(prediction.response) and (LOOKUP_TOOL in tools) == example.used_lookup
+    if trace is not None:
+        return agrees and len(tools) <= example.iterations
+    return float(agrees) * min(1.0, example.iterations / max(len(tools), 1))
+
+def run_call(program: dspy.Module, scenario: dict, evaluator: ConversationEvaluator) -> dict:
+    """One simulated call answered by `program`: its outcome, turn metrics and ReAct examples"""
+    metrics = MetricsCollector()
+    turns: List[TurnMetrics] = []
+    metrics.add_hook(turns.append)
+    agent = MainAgent(metrics=metrics)
+    agent.agent = program
+    recorder = ReActRecorder(program)
+    testing_agent = TestingAgent(scenario_context=scenario["scenario_context"])
+    try:
+        with dspy.context(callbacks=[*dspy.settings.callbacks, recorder]):
+            conversation = simulate_conversation(
+                agent, testing_agent, max_turns=scenario.get("max_turns", 10), initial_message=scenario.get("initial_message"),
+            )
+    except Exception as e:
+        logger.error("Scenario %s failed: %s", scenario['name'], e)
+        return {"name": scenario["name"], "passed": False, "score": 0.0, "turns": turns, "examples": []}
+    finally:
+        agent.close()
+
+    expected_reference = scenario.get("expected_reference")
+    evaluation = evaluator.evaluate_conversation(conversation["transcript"], expected_reference)
+    return {
+        "name": scenario["name"],
+        "passed": expected_reference is None or agent.state.verified_customer_ref == expected_reference,
+        "score": evaluation["score"],
+        "turns": turns,
+        "examples": recorder.examples,
+    }
+
+def run_calls(program: dspy.Module, scenarios: List[dict], evaluator: ConversationEvaluator,
+              workers: int = 4, repeats: int = 1) -> List[dict]:
+    """Every scenario `repeats` times, concurrently; the program holds no per-call state"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda scenario: run_call(program, scenario, evaluator), scenarios * repeats))
+
+def summarize(calls: List[dict], token_weight: float, iteration_weight: float) -> dict:
+    """Pass rate, outcome score and per-turn LM cost of a set of calls, with the objective
+    candidates are ranked by"""
+    turns = [turn for call in calls for turn in call["turns"]]
+    model_turns = [turn for turn in turns if turn.path == "react"]
+    summary = {
+        "calls": len(calls),
+        "pass_rate": sum(call["passed"] for call in calls) / len(calls) if calls else 0.0,
+        "outcome_score": statistics.mean(call["score"] for call in calls) if calls else 0.0,
+        "model_turns": len(model_turns),
+        "prompt_tokens_per_turn": statistics.mean(turn.prompt_tokens for turn in model_turns) if model_turns else 0.0,
+        "iterations_per_turn": statistics.mean(turn.react_iterations for turn in model_turns) if model_turns else 0.0,
+        "lm_calls_per_turn": statistics.mean(turn.lm_call_count for turn in turns) if turns else 0.0,
+    }
+    # Every ReAct turn takes at least one iteration, to finish
+    summary["objective"] = (
+        summary["outcome_score"]
+        - token_weight * summary["prompt_tokens_per_turn"] / 1000
+        - iteration_weight * max(summary["iterations_per_turn"] - 1, 0.0)
+    )
+    return summary
+
+def training_examples(calls: List[dict], min_score: float) -> List[dspy.Example]:
+    """ReAct turns of passed calls scoring at least `min_score`, one per distinct customer input,
+    cheapest turns first so the demos bootstrapped are short and finish early"""
+    examples = {}
+    for call in calls:
+        if call["passed"] and call["score"] >= min_score:
+            for example in call["examples"]:
+                examples.setdefault(example.customer_input.strip().lower(), example)
+    return sorted(examples.values(), key=lambda example: (example.iterations, len(example.customer_input)))
+
+def without_history(program: dspy.Module) -> dspy.Module:
+    """Drop the call history from bootstrapped demos: rendered in full on every prompt, it
+    would cost more tokens than the demos save"""
+    for predictor in program.predictors():
+        predictor.demos = [demo.without("history") if "history" in demo else demo for demo in predictor.demos]
+    return program
+
+def compile_program(baseline: dspy.Module, trainset: List[dspy.Example], max_demos: int) -> dspy.Module:
+    optimizer = dspy.BootstrapFewShot(metric=turn_metric, max_bootstrapped_demos=max_demos, max_labeled_demos=0, max_rounds=1)
+    return without_history(optimizer.compile(baseline, trainset=trainset))
+
+def compile_agent(scenarios: List[dict], demo_counts: List[int], evaluator: ConversationEvaluator,
+                  dev_scenarios: Optional[List[dict]] = None, min_score: float = 0.8, token_weight: float = 0.05,
+                  iteration_weight: float = 0.1, workers: int = 4, repeats: int = 1):
+    """(best program, its candidate name, {candidate name: summary}). The baseline run supplies the training
+    examples, and is scored on the dev scenarios too when they differ."""
+    baseline = MainAgent(program_path="", prefetch=False).agent
+    train_calls = run_calls(baseline, scenarios, evaluator, workers, repeats)
+    if not dev_scenarios:
+        logger.warning("No dev scenarios: candidates are scored on the scenarios their demos were bootstrapped from, "
+                       "which favours them over the baseline")
+    dev_scenarios = dev_scenarios or scenarios
+    dev_calls = train_calls if dev_scenarios is scenarios else run_calls(baseline, dev_scenarios, evaluator, workers, repeats)
+    trainset = training_examples(train_calls, min_score)
+    logger.info("Collected %d ReAct turns from %d calls scoring at least %.0f%%", len(trainset), len(train_calls), min_score * 100)
+
+    summaries = {"baseline": summarize(dev_calls, token_weight, iteration_weight)}
+    print_row("baseline", summaries["baseline"])
+    best_name, best = "baseline", baseline
+    if not trainset:
+        logger.warning("No calls scored at least %.0f%%, keeping the uncompiled program", min_score * 100)
+        return best, best_name, summaries
+
+    for count in demo_counts:
+        name = f"demos_{count}"
+        program = compile_program(baseline, trainset, count)
+        summaries[name] = summarize(run_calls(program, dev_scenarios, evaluator, workers, repeats), token_weight, iteration_weight)
+        print_row(name, summaries[name])
+        if summaries[name]["pass_rate"] < summaries["baseline"]["pass_rate"]:
+            continue
+        if summaries[name]["objective"] > summaries[best_name]["objective"]:
+            best_name, best = name, program
+    return best, best_name, summaries
+
+def print_header():
+    print(f"{'Candidate':<12} {'Pass':>6} {'Score':>6} {'Prompt tok':>10} {'Iter':>5} {'LM calls':>8} {'Objective':>9}")
+    print("-" * 62)
+
+def print_row(name: str, summary: dict):
+    print(
+        f"{name:<12} {summary['pass_rate']:>6.0%} {summary['outcome_score']:>6.0%} {summary['prompt_tokens_per_turn']:>10.0f} "
+        f"{summary['iterations_per_turn']:>5.2f} {summary['lm_calls_per_turn']:>8.2f} {summary['objective']:>9.3f}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the MainAgent ReAct program against simulated calls")
+    parser.add_argument("scenarios", help="JSONL scenarios to collect training turns from")
+    parser.add_argument("--dev", help="JSONL scenarios to score candidates on (default: the training scenarios, which favours the candidates)")
+    parser.add_argument("--demos", default="1,2,4", help="Comma separated numbers of bootstrapped demos to try")
+    parser.add_argument("--min-score", type=float, default=0.8, help="Outcome score a call needs for its turns to become examples")
+    parser.add_argument("--token-weight", type=float, default=0.05, help="Objective penalty per 1000 prompt tokens per model turn")
+    parser.add_argument("--iteration-weight", type=float, default=0.1, help="Objective penalty per extra ReAct iteration per model turn")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent simulated calls")
+    parser.add_argument("--repeats", type=int, default=1, help="Times each scenario is run per candidate")
+    parser.add_argument("--eval-cache", default="logs/evaluation_cache.jsonl", help="Evaluation cache keyed by transcript hash")
+    parser.add_argument("--output", default="programs/main_agent.json", help="Compiled program state, loaded with SKY_AGENT_PROGRAM")
+    args = parser.parse_args()
+
+    configure_lm()
+    scenarios = load_scenarios(args.scenarios)
+    dev_scenarios = load_scenarios(args.dev) if args.dev else None
+    evaluator = ConversationEvaluator(cache_path=args.eval_cache)
+
+    print_header()
+    program, name, summaries = compile_agent(
+        scenarios, [int(count) for count in args.demos.split(",")], evaluator, dev_scenarios,
+        args.min_score, args.token_weight, args.iteration_weight, args.workers, args.repeats,
+    )
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    program.save(args.output)
+    report = os.path.splitext(args.output)[0] + ".report.json"
+    save_results(report, {f"compile_{candidate}": summary for candidate, summary in summaries.items()})
+    print(f"\nSelected {name}; program saved to {args.output}, candidate scores to {report}")
+    if not args.dev and name != "baseline":
+        print("Warning: scored on the training scenarios; re-run with --dev to check the selection on unseen calls")
+
+if __name__ == "__main__":
+    main()
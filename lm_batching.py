@@ -0,0 +1,201 @@
+"""
+Batched LM dispatch for a self-hosted inference server
+With many live calls, every turn sends its LM requests on its own, so a server that runs
+requests in batches sees them trickle in and starts batches that are mostly empty. BatchingLM
+holds requests from all sessions until `max_batch` are pending or the oldest has waited
+`max_wait` seconds, then sends the group to the endpoint at once so it lands in one server
+batch. Each caller, sync or async, gets its own completion back.
+
+The window trades queueing latency for fewer, fuller batches. stats() reports batch sizes and
+how long requests waited to be dispatched; the load test reports both per level:
+
+    python load_test.py --levels 8,32 --server-batch-size 16 --batch-size 16 --batch-window 0.05
+
+Run `python lm_batching.py` to sweep windows against a local stub server
+(stub_lm.StubLMServer) that serves requests in batches.
+"""
+
+import asyncio
+import queue
+import statistics
+import threading
+import time
+from concurrent import futures
+from typing import List, Optional
+
+import dspy
+from logger_config import get_logger
+
+logger = get_logger("lm_batching")
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class _Request:
+    """One pending LM request and the future its caller waits on"""
+
+    def __init__(self, kwargs: dict):
+        self.kwargs = kwargs
+        self.future: futures.Future = futures.Future()
+        self.queued_at = time.perf_counter()
+
+class BatchingLM(dspy.BaseLM):
+    """dspy LM grouping concurrent requests into batches for `lm`'s endpoint"""
+
+    def __init__(self, lm: dspy.BaseLM, max_batch: int = 8, max_wait: float = 0.02, max_threads: int = 64):
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be at least 1, got {max_batch}")
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False, **lm.kwargs)
+        self.lm = lm
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._lock = threading.Lock()
+        # One thread per request in flight: the endpoint batches, so requests must not wait on each other
+        self._pool = futures.ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="lm-batch")
+        self._dispatcher: Optional[threading.Thread] = None
+        self._closed = False
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.batch_sizes: List[int] = []
+            self.queue_waits: List[float] = []
+
+    def _submit(self, prompt, messages, kwargs) -> futures.Future:
+        request = _Request(dict(prompt=prompt, messages=messages, **kwargs))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchingLM is closed")
+            self.requests += 1
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch, name="lm-batch-dispatcher", daemon=True)
+                self._dispatcher.start()
+            # Queued under the lock, so no request lands behind close()'s stop marker
+            self._queue.put(request)
+        return request.future
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        return self._submit(prompt, messages, kwargs).result()
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        # Cancelling the awaiting turn (a barge-in) cancels the future, so a request still
+        # queued is left out of its batch; one already sent completes unread
+        return await asyncio.wrap_future(self._submit(prompt, messages, kwargs))
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        """Block for the next request, then gather more until the batch is full or the first
+        request's window has passed. None once the LM is closed."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first.queued_at + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _dispatch(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            dispatched = time.perf_counter()
+            with self._lock:
+                self.batch_sizes.append(len(batch))
+                self.queue_waits.extend(dispatched - request.queued_at for request in batch)
+            logger.debug("Dispatching a batch of %d LM requests", len(batch))
+            for request in batch:
+                try:
+                    self._pool.submit(self._send, request)
+                except RuntimeError as e:
+                    # The request is already marked running, so its caller waits for this
+                    request.future.set_exception(e)
+
+    def _send(self, request: _Request) -> None:
+        try:
+            request.future.set_result(self.lm.forward(**request.kwargs))
+        except BaseException as e:
+            request.future.set_exception(e)
+
+    def close(self) -> None:
+        """Stop the dispatcher once the requests already queued are sent. Requests in flight
+        still complete; new ones raise RuntimeError."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+            dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.join()
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes, waits = list(self.batch_sizes), list(self.queue_waits)
+        return {
+            "requests": self.requests,
+            "batches": len(sizes),
+            "mean_batch_size": statistics.mean(sizes) if sizes else 0.0,
+            "max_batch_size": max(sizes, default=0),
+            "p50_batch_queue_s": percentile(waits, 50),
+            "p95_batch_queue_s": percentile(waits, 95),
+        }
+
+if __name__ == "__main__":
+    import random
+
+    from stub_lm import StubLMServer
+
+    async def run(lm: dspy.BaseLM, rate: float, duration: float, seed: int = 0) -> tuple:
+        """Open-loop Poisson arrivals at `rate` per second for `duration` seconds"""
+        rng = random.Random(seed)
+        latencies = []
+
+        async def one(i: int):
+            started = time.perf_counter()
+            await lm.acall(messages=[{"role": "user", "content": f"Request {i}"}])
+            latencies.append(time.perf_counter() - started)
+
+        tasks = []
+        started = time.perf_counter()
+        while time.perf_counter() - started < duration:
+            tasks.append(asyncio.ensure_future(one(len(tasks))))
+            await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+        return latencies, time.perf_counter() - started
+
+    def report(label: str, server: StubLMServer, latencies: List[float], elapsed: float, lm: dspy.BaseLM):
+        queue_p95 = lm.stats()["p95_batch_queue_s"] if isinstance(lm, BatchingLM) else 0.0
+        print(f"{label:<16} {len(latencies) / elapsed:>7.1f} {percentile(latencies, 50):>8.3f} {percentile(latencies, 95):>8.3f} "
+              f"{queue_p95:>10.3f} {statistics.mean(server.batch_sizes):>7.1f} {server.busy_time / len(latencies):>12.4f}")
+
+    # The engine's own queue already groups requests arriving while a batch runs, so only
+    # windows longer than a batch make batches fuller, and only when the engine is often idle
+    duration = 8.0
+    with StubLMServer(latency="fixed:0.3", batch_size=16, batch_cost=0.05, seed=1) as server:
+        client = dspy.LM("openai/stub", api_base=server.url, api_key="stub", cache=False, num_retries=0)
+        for rate in (5.0, 15.0):
+            print(f"\n{rate:.0f} requests/s against a server running batches of up to 16 (0.3s, +5% per request)")
+            print(f"{'Window':<16} {'Req/s':>7} {'p50 (s)':>8} {'p95 (s)':>8} {'Queue p95':>10} {'Batch':>7} {'Server s/req':>12}")
+            print("-" * 74)
+            server.reset_stats()
+            report("unbatched", server, *asyncio.run(run(client, rate, duration)), client)
+            for window in (0.02, 0.1, 0.3):
+                lm = BatchingLM(client, max_batch=16, max_wait=window, max_threads=128)
+                server.reset_stats()
+                report(f"{window * 1000:.0f}ms window", server, *asyncio.run(run(lm, rate, duration)), lm)
+                lm.close()
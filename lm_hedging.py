@@ -0,0 +1,372 @@
+"""
+Hedged LM requests across several backends
+HedgedLM sends each request to its first healthy backend. If no answer has arrived by that
+backend's recent p95 latency, a duplicate request goes to the next backend and the first
+valid completion wins; the other attempts are cancelled. An attempt that fails, times out or
+returns an empty completion moves on to the next backend at once. Every backend has a circuit
+breaker that stops sending it requests after repeated failures and lets one probe through
+once its cool-down has passed.
+
+Usage:
+    lm = HedgedLM([
+        LMBackend(dspy.LM("openrouter/qwen/qwen3-30b-a3b-instruct-2507", ...), timeout=8.0),
+        LMBackend(dspy.LM("openrouter/mistralai/mistral-small-3.2-24b-instruct", ...), timeout=8.0),
+    ])
+    dspy.configure(lm=lm)
+
+Run `python lm_hedging.py` to compare tail latency with and without hedging against local
+stub servers (stub_lm.StubLMServer) that inject latency and errors.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from typing import Dict, List, Optional
+
+import dspy
+from logger_config import get_logger
+
+logger = get_logger("lm_hedging")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Below this many observed latencies a backend is hedged after the default delay
+MIN_LATENCY_SAMPLES = 20
+
+class LMUnavailable(RuntimeError):
+    """Raised when no backend produced a valid completion"""
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures. After `reset_timeout` seconds one
+    probe request is let through; its success closes the circuit, its failure reopens it."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """Count a failure, returning True when it opened the circuit"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == OPEN or (self.state == CLOSED and self.failures < self.failure_threshold):
+                return False
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            return True
+
+    def release(self) -> None:
+        """An attempt was cancelled without an outcome, so a pending probe may be retried"""
+        with self._lock:
+            self._probing = False
+
+class LMBackend:
+    """One backend of a HedgedLM with its timeout, recent latencies and circuit breaker"""
+
+    def __init__(self, lm: dspy.BaseLM, timeout: float = 10.0, name: Optional[str] = None,
+                 breaker: Optional[CircuitBreaker] = None, window: int = 200):
+        self.lm = lm
+        self.timeout = timeout
+        self.name = name or lm.model
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests, "failures": self.failures, "wins": self.wins,
+            "p95_s": self.p95(), "circuit": self.breaker.state,
+        }
+
+def valid_completion(response) -> bool:
+    """True when a chat completion carries text or tool calls"""
+    choices = response.get("choices") if isinstance(response, dict) else getattr(response, "choices", None)
+    if choices is None:
+        # Not a chat completion (e.g. the responses API); nothing to check
+        return True
+    if not choices:
+        return False
+    choice = choices[0]
+    message = choice.get("message") if isinstance(choice, dict) else getattr(choice, "message", None)
+    if message is None:
+        return False
+    if isinstance(message, dict):
+        return bool(message.get("content") or message.get("tool_calls"))
+    return bool(getattr(message, "content", None) or getattr(message, "tool_calls", None))
+
+class _Race:
+    """Attempts of one hedged request: in flight, backends not yet tried, and errors so far"""
+
+    def __init__(self, lm: "HedgedLM"):
+        self.lm = lm
+        self.queue = list(lm.backends)
+        self.pending: Dict[object, tuple] = {}
+        self.errors: List[str] = []
+        self.last_launch = 0.0
+        self.hedged = False
+
+    def next_backend(self) -> Optional[LMBackend]:
+        """The next backend whose circuit lets an attempt through, or None when none is left.
+        A half-open circuit lets a single probe through, so it is only asked when launching."""
+        while self.queue:
+            backend = self.queue.pop(0)
+            if not backend.breaker.allow():
+                continue
+            backend.requests += 1
+            if self.pending:
+                self.hedged = True
+                self.lm._count("hedges")
+            elif self.errors:
+                self.lm._count("failovers")
+            return backend
+        return None
+
+    def check_started(self) -> None:
+        if not self.pending:
+            raise LMUnavailable("Every LM backend's circuit is open")
+
+    def launched(self, handle, backend: LMBackend) -> None:
+        self.last_launch = time.perf_counter()
+        self.pending[handle] = (backend, self.last_launch)
+
+    def wait_time(self) -> Optional[float]:
+        """Seconds until the next hedge is due or an attempt times out"""
+        deadlines = [started + backend.timeout for backend, started in self.pending.values()]
+        if self.queue:
+            newest = max(self.pending.values(), key=lambda attempt: attempt[1])[0]
+            deadlines.append(self.last_launch + self.lm.hedge_delay(newest))
+        return max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+
+    def should_launch(self) -> bool:
+        if not self.queue:
+            return False
+        if not self.pending:
+            return True
+        newest = max(self.pending.values(), key=lambda attempt: attempt[1])[0]
+        return time.perf_counter() - self.last_launch >= self.lm.hedge_delay(newest)
+
+    def finished(self, handle, response=None, error: Optional[BaseException] = None):
+        """The response if this attempt won, otherwise None after recording the failure"""
+        backend, started = self.pending.pop(handle)
+        if error is None and not valid_completion(response):
+            error = ValueError("empty completion")
+        if error is not None:
+            self._failed(backend, error)
+            return None
+        backend.latencies.append(time.perf_counter() - started)
+        backend.breaker.record_success()
+        backend.wins += 1
+        if self.hedged:
+            self.lm._count("hedged_requests")
+        return response
+
+    def expired(self) -> list:
+        """Attempts past their backend's timeout, recorded as failures and returned for cancelling"""
+        now = time.perf_counter()
+        handles = [handle for handle, (backend, started) in self.pending.items() if now - started >= backend.timeout]
+        for handle in handles:
+            backend, _ = self.pending.pop(handle)
+            self._failed(backend, TimeoutError(f"no answer in {backend.timeout:.1f}s"))
+        return handles
+
+    def abandon(self) -> list:
+        """Attempts still running after the race was decided, returned for cancelling"""
+        now = time.perf_counter()
+        for backend, started in self.pending.values():
+            # A lower bound of the attempt's latency, so cancelled slow attempts still raise the p95
+            backend.latencies.append(now - started)
+            backend.breaker.release()
+        handles = list(self.pending)
+        self.pending.clear()
+        return handles
+
+    def unavailable(self) -> LMUnavailable:
+        return LMUnavailable("No LM backend produced a completion: " + "; ".join(self.errors))
+
+    def _failed(self, backend: LMBackend, error: BaseException) -> None:
+        backend.failures += 1
+        self.errors.append(f"{backend.name}: {error!r}")
+        logger.warning("LM backend %s failed: %r", backend.name, error)
+        if backend.breaker.record_failure():
+            logger.warning("Circuit opened for LM backend %s after %d failures", backend.name, backend.breaker.failures)
+
+class HedgedLM(dspy.BaseLM):
+    """dspy LM racing hedged requests across backends, in order of preference"""
+
+    def __init__(self, backends: List[LMBackend], hedge_delay: float = 2.0, max_threads: int = 64):
+        if not backends:
+            raise ValueError("HedgedLM needs at least one backend")
+        primary = backends[0].lm
+        super().__init__(model=primary.model, model_type=primary.model_type, cache=False, **primary.kwargs)
+        self.backends = backends
+        self.default_hedge_delay = hedge_delay
+        self.requests = 0
+        self.hedges = 0
+        self.hedged_requests = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+        # Sync callers block on futures; an abandoned attempt finishes in the background
+        self._pool = futures.ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="lm-hedge")
+
+    def hedge_delay(self, backend: LMBackend) -> float:
+        """How long an attempt on `backend` runs before a hedge is sent: its p95 latency"""
+        p95 = backend.p95()
+        return p95 if p95 is not None else self.default_hedge_delay
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        self._count("requests")
+        race = _Race(self)
+
+        def launch():
+            backend = race.next_backend()
+            if backend is not None:
+                race.launched(self._pool.submit(backend.lm.forward, prompt=prompt, messages=messages, **kwargs), backend)
+
+        launch()
+        race.check_started()
+        try:
+            while race.pending:
+                done, _ = futures.wait(race.pending, timeout=race.wait_time(), return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    error = future.exception()
+                    response = race.finished(future, None if error else future.result(), error)
+                    if response is not None:
+                        return response
+                for future in race.expired():
+                    future.cancel()
+                while race.should_launch():
+                    launch()
+            raise race.unavailable()
+        finally:
+            for future in race.abandon():
+                future.cancel()
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        self._count("requests")
+        race = _Race(self)
+
+        def launch():
+            backend = race.next_backend()
+            if backend is not None:
+                race.launched(asyncio.ensure_future(backend.lm.aforward(prompt=prompt, messages=messages, **kwargs)), backend)
+
+        launch()
+        race.check_started()
+        try:
+            while race.pending:
+                done, _ = await asyncio.wait(race.pending, timeout=race.wait_time(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    response = race.finished(task, None if error else task.result(), error)
+                    if response is not None:
+                        return response
+                for task in race.expired():
+                    task.cancel()
+                while race.should_launch():
+                    launch()
+            raise race.unavailable()
+        finally:
+            for task in race.abandon():
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedged_requests": self.hedged_requests,
+            "failovers": self.failovers,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
+
+if __name__ == "__main__":
+    import statistics
+
+    from stub_lm import StubLMServer
+
+    def percentile(values: List[float], pct: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * (len(ordered) - 1)))]
+
+    async def run(lm: dspy.BaseLM, requests: int, concurrency: int) -> tuple:
+        latencies, errors = [], 0
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one(i: int):
+            nonlocal errors
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    await lm.acall(messages=[{"role": "user", "content": f"Request {i}"}])
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors += 1
+
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return latencies, errors
+
+    def report(label: str, latencies: List[float], errors: int):
+        print(f"{label:<34} p50 {percentile(latencies, 50):.3f}s  p95 {percentile(latencies, 95):.3f}s  "
+              f"p99 {percentile(latencies, 99):.3f}s  mean {statistics.mean(latencies):.3f}s  errors {errors}")
+
+    def client(server: StubLMServer) -> dspy.LM:
+        return dspy.LM("openai/stub", api_base=server.url, api_key="stub", cache=False, num_retries=0)
+
+    requests, concurrency = 400, 16
+    # Independent heavy-tailed backends, the primary also failing 2% of requests
+    with StubLMServer(latency="lognormal:0.2:0.6", error_rate=0.02, seed=1) as primary, \
+            StubLMServer(latency="lognormal:0.2:0.6", seed=2) as secondary:
+        report("Primary only", *asyncio.run(run(client(primary), requests, concurrency)))
+        hedged = HedgedLM([
+            LMBackend(client(primary), timeout=5.0, name="primary"),
+            LMBackend(client(secondary), timeout=5.0, name="secondary"),
+        ], hedge_delay=0.5)
+        report("Hedged at primary p95", *asyncio.run(run(hedged, requests, concurrency)))
+        print(hedged.stats())
+
+    # A primary that is down: the circuit opens and requests go straight to the secondary
+    with StubLMServer(latency="fixed:0.05", error_rate=1.0) as primary, StubLMServer(latency="fixed:0.2") as secondary:
+        hedged = HedgedLM([
+            LMBackend(client(primary), timeout=5.0, name="primary"),
+            LMBackend(client(secondary), timeout=5.0, name="secondary"),
+        ], hedge_delay=0.5)
+        report("Hedged, primary down", *asyncio.run(run(hedged, 100, concurrency)))
+        print(hedged.stats())
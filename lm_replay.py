@@ -0,0 +1,115 @@
+"""
+Record/replay LM layer for offline, deterministic test runs
+Wraps any dspy LM. In record mode completions are stored on disk keyed by a hash of the
+model and the rendered request; in replay mode they are served from disk with no network
+access and a miss raises LMCacheMiss.
+
+Usage:
+    lm = RecordReplayLM(dspy.LM(...), "logs/lm_cache.sqlite", mode="replay")
+    dspy.configure(lm=lm)
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Optional
+
+import dspy
+from logger_config import get_logger
+
+logger = get_logger("lm_replay")
+
+MODES = ("record", "replay")
+
+class LMCacheMiss(RuntimeError):
+    """Raised in replay mode when a request was never recorded"""
+
+class CompletionStore:
+    """SQLite store of provider responses keyed by request hash"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, model TEXT, response TEXT)"
+        )
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, model: str, response: dict) -> None:
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response) VALUES (?, ?, ?)",
+                (key, model, json.dumps(response)),
+            )
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+def request_key(model: str, prompt, messages, kwargs: dict) -> str:
+    """Stable hash of everything that determines a completion"""
+    options = {k: v for k, v in kwargs.items() if not k.startswith("api_") and k not in ("cache", "num_retries")}
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "messages": messages, "options": options},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _response_to_dict(response) -> dict:
+    if isinstance(response, dict):
+        return response
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    return json.loads(json.dumps(response, default=lambda o: getattr(o, "__dict__", str(o))))
+
+class RecordReplayLM(dspy.BaseLM):
+    """dspy LM that records completions of a wrapped LM or replays them from disk"""
+
+    def __init__(self, lm: dspy.BaseLM, path: str, mode: str = "replay"):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False, **lm.kwargs)
+        self.lm = lm
+        self.mode = mode
+        self.store = CompletionStore(path)
+        self.hits = 0
+        self.misses = 0
+        logger.info("RecordReplayLM in %s mode over %s (%d recorded completions)", mode, path, len(self.store))
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        key = request_key(self.model, prompt, messages, {**self.kwargs, **kwargs})
+        cached = self.store.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self._check_miss(key)
+        response = _response_to_dict(self.lm.forward(prompt=prompt, messages=messages, **kwargs))
+        self.store.put(key, self.model, response)
+        return response
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        key = request_key(self.model, prompt, messages, {**self.kwargs, **kwargs})
+        cached = self.store.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self._check_miss(key)
+        response = _response_to_dict(await self.lm.aforward(prompt=prompt, messages=messages, **kwargs))
+        self.store.put(key, self.model, response)
+        return response
+
+    def _check_miss(self, key: str):
+        self.misses += 1
+        if self.mode == "replay":
+            raise LMCacheMiss(
+                f"No recorded completion for {self.model} (key {key[:12]}); re-run with LM_CACHE_MODE=record"
+            )
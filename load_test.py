@@ -0,0 +1,248 @@
+"""
+Closed-loop load test for Sky Credit Voice Assistant
+Simulated callers share one SessionManager, each holding one call at a time: a caller sends a
+turn, waits for the answer and a think time, and starts a new call when its call ends. The
+number of callers is ramped level by level, and each level reports throughput, turn latency
+percentiles and the time turns waited for an LM slot, as a capacity curve.
+
+By default the agent talks to a local stub LM server (stub_lm.StubLMServer) through the real
+dspy.LM client, with a configurable latency distribution, error rate and concurrency limit.
+Callers follow the scripted benchmark call, or are driven by TestingAgent with --scenarios.
+
+--batch-size groups LM requests from all sessions with lm_batching.BatchingLM before they are
+sent, and --server-batch-size makes the stub serve requests in batches like a self-hosted
+inference server; each level then also reports batch sizes and batch queueing time.
+
+Usage:
+    python load_test.py --levels 1,4,16,64 --duration 20 --latency lognormal:0.4:0.5 --error-rate 0.01
+    python load_test.py --lm-url http://localhost:8000/v1 --model openai/qwen3 --levels 8,16
+    python load_test.py --levels 8,32 --latency fixed:0.3 --server-batch-size 16 --batch-size 16 --batch-window 0.05
+    python -m benchmarks compare logs/load/baseline.json logs/load/capacity.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import time
+from typing import List, Optional
+
+import dspy
+
+from batch_runner import load_scenarios, percentile
+from benchmarks.harness import save_results
+from benchmarks.suite import SCRIPTED_CALL
+from lm_batching import BatchingLM
+from logger_config import get_logger
+from src.main_agent import AGENT_MODES, REACT_MODE, MainAgent
+from src.session_manager import SessionManager
+from stub_lm import StubLMServer
+from testing_agent import TestingAgent
+
+logger = get_logger("load_test")
+
+class LevelStats:
+    """Turn and call outcomes of one concurrency level"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.queue_waits: List[float] = []
+        self.turn_errors = 0
+        self.calls_completed = 0
+        self.calls_failed = 0
+
+    def summary(self, callers: int, elapsed: float, server: Optional[StubLMServer] = None,
+                batcher: Optional[BatchingLM] = None) -> dict:
+        turns = len(self.latencies)
+        result = {
+            "callers": callers,
+            "elapsed_s": elapsed,
+            "turns": turns,
+            "turns_per_s": turns / elapsed if elapsed else 0.0,
+            "calls_per_s": self.calls_completed / elapsed if elapsed else 0.0,
+            "calls_completed": self.calls_completed,
+            "calls_failed": self.calls_failed,
+            "turn_error_rate": self.turn_errors / (turns + self.turn_errors) if turns + self.turn_errors else 0.0,
+            "mean_turn_s": statistics.mean(self.latencies) if self.latencies else 0.0,
+            "p50_turn_s": percentile(self.latencies, 50),
+            "p95_turn_s": percentile(self.latencies, 95),
+            "p99_turn_s": percentile(self.latencies, 99),
+            "p50_lm_queue_s": percentile(self.queue_waits, 50),
+            "p95_lm_queue_s": percentile(self.queue_waits, 95),
+            "p99_lm_queue_s": percentile(self.queue_waits, 99),
+        }
+        if server is not None:
+            result.update(
+                lm_requests=server.requests,
+                lm_errors=server.errors,
+                p95_server_queue_s=percentile(server.queue_waits, 95),
+                server_s_per_request=server.busy_time / server.requests if server.requests else 0.0,
+            )
+            if server.batch_sizes:
+                result["mean_server_batch"] = statistics.mean(server.batch_sizes)
+        if batcher is not None:
+            batching = batcher.stats()
+            result.update(
+                mean_batch_size=batching["mean_batch_size"],
+                p50_batch_queue_s=batching["p50_batch_queue_s"],
+                p95_batch_queue_s=batching["p95_batch_queue_s"],
+            )
+        return result
+
+async def _turn(manager: SessionManager, session_id: str, text: str, stats: LevelStats) -> Optional[str]:
+    started = time.perf_counter()
+    try:
+        response = await manager.process_input(session_id, text)
+    except Exception as e:
+        logger.warning("Turn failed in session %s: %s", session_id, e)
+        stats.turn_errors += 1
+        return None
+    stats.latencies.append(time.perf_counter() - started)
+    stats.queue_waits.append(manager.sessions[session_id].last_lm_queue_wait or 0.0)
+    return response
+
+async def scripted_caller(manager: SessionManager, session_ids, deadline: float, stats: LevelStats,
+                          think_time: float, script: List[str] = SCRIPTED_CALL):
+    """Repeat the scripted call until the deadline; a failed turn abandons the call"""
+    while time.perf_counter() < deadline:
+        session_id = next(session_ids)
+        completed = True
+        for utterance in script:
+            if time.perf_counter() >= deadline:
+                completed = False
+                break
+            if await _turn(manager, session_id, utterance, stats) is None:
+                stats.calls_failed += 1
+                completed = False
+                break
+            await asyncio.sleep(think_time)
+        stats.calls_completed += completed
+        manager.end_session(session_id)
+
+async def tester_caller(manager: SessionManager, session_ids, deadline: float, stats: LevelStats,
+                        think_time: float, scenarios: List[dict], rng: random.Random):
+    """Hold TestingAgent conversations on random scenarios until the deadline"""
+    while time.perf_counter() < deadline:
+        scenario = rng.choice(scenarios)
+        tester = TestingAgent(scenario_context=scenario["scenario_context"])
+        session_id = next(session_ids)
+        message = scenario.get("initial_message") or tester.get_initial_message()
+        completed = False
+        for _ in range(scenario.get("max_turns", 10) + 1):
+            if time.perf_counter() >= deadline:
+                break
+            response = await _turn(manager, session_id, message, stats)
+            if response is None:
+                stats.calls_failed += 1
+                break
+            await asyncio.sleep(think_time)
+            # The customer side is not measured; its LM calls run off the event loop
+            message = await asyncio.to_thread(tester.generate_response, response)
+            if message is None or tester.is_conversation_ended():
+                completed = True
+                break
+        else:
+            # Reaching max_turns ends the call like in batch_runner
+            completed = True
+        stats.calls_completed += completed
+        manager.end_session(session_id)
+
+async def run_level(agent: MainAgent, callers: int, duration: float, think_time: float, max_inflight_lm: int,
+                    scenarios: Optional[List[dict]] = None, server: Optional[StubLMServer] = None, seed: int = 0,
+                    batcher: Optional[BatchingLM] = None) -> dict:
+    """Run `callers` closed-loop callers for `duration` seconds and summarize the level"""
+    manager = SessionManager(agent, max_inflight_lm=max_inflight_lm)
+    stats = LevelStats()
+    session_ids = (f"load-{callers}-{i}" for i in itertools.count())
+    if server is not None:
+        server.reset_stats()
+    if batcher is not None:
+        batcher.reset_stats()
+    started = time.perf_counter()
+    deadline = started + duration
+    rng = random.Random(seed)
+    if scenarios:
+        tasks = [tester_caller(manager, session_ids, deadline, stats, think_time, scenarios, rng) for _ in range(callers)]
+    else:
+        tasks = [scripted_caller(manager, session_ids, deadline, stats, think_time) for _ in range(callers)]
+    await asyncio.gather(*tasks)
+    # Turns in flight at the deadline are allowed to finish and count towards the level
+    return stats.summary(callers, time.perf_counter() - started, server, batcher)
+
+def run_load_test(levels: List[int], duration: float, lm: dspy.BaseLM, think_time: float = 0.0, max_inflight_lm: int = 64,
+                  mode: str = REACT_MODE, scenarios: Optional[List[dict]] = None, server: Optional[StubLMServer] = None) -> dict:
+    """Capacity curve as {"load_<callers>_callers": level summary}, in the benchmark result format"""
+    results = {}
+    batcher = lm if isinstance(lm, BatchingLM) else None
+    with dspy.context(lm=lm), MainAgent(mode=mode) as agent:
+        for callers in levels:
+            logger.info("Load level: %d callers for %.0fs", callers, duration)
+            summary = asyncio.run(run_level(agent, callers, duration, think_time, max_inflight_lm, scenarios, server, batcher=batcher))
+            results[f"load_{callers:04d}_callers"] = summary
+            print_level(summary)
+    return results
+
+def print_header(batching: bool = False):
+    columns = f"{'Callers':>7} {'Turns/s':>8} {'Calls/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} {'Queue p95':>10} {'Errors':>7}"
+    if batching:
+        columns += f" {'Batch':>6} {'Batch wait p95':>15}"
+    print(columns)
+    print("-" * len(columns))
+
+def print_level(summary: dict):
+    row = (
+        f"{summary['callers']:>7} {summary['turns_per_s']:>8.2f} {summary['calls_per_s']:>8.2f} "
+        f"{summary['p50_turn_s']:>8.2f} {summary['p95_turn_s']:>8.2f} {summary['p99_turn_s']:>8.2f} "
+        f"{summary['p95_lm_queue_s']:>10.3f} {summary['turn_error_rate']:>7.1%}"
+    )
+    if "mean_batch_size" in summary:
+        row += f" {summary['mean_batch_size']:>6.1f} {summary['p95_batch_queue_s']:>15.3f}"
+    print(row)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp simulated callers against MainAgent and report a capacity curve")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Comma separated numbers of concurrent callers")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds a caller waits between turns")
+    parser.add_argument("--max-inflight-lm", type=int, default=64, help="SessionManager LM slots")
+    parser.add_argument("--mode", choices=AGENT_MODES, default=REACT_MODE, help="Agent mode")
+    parser.add_argument("--scenarios", help="JSONL scenarios for TestingAgent-driven callers (default: scripted calls)")
+    parser.add_argument("--lm-url", help="OpenAI-compatible endpoint to test against instead of the stub server")
+    parser.add_argument("--model", default="openai/stub", help="Model name passed to dspy.LM")
+    parser.add_argument("--latency", default="lognormal:0.3:0.4", help="Stub latency: fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests failing with HTTP 503")
+    parser.add_argument("--server-concurrency", type=int, default=None, help="Requests the stub serves at once (default unlimited)")
+    parser.add_argument("--server-batch-size", type=int, default=None, help="Stub serves requests in batches of up to this many")
+    parser.add_argument("--batch-cost", type=float, default=0.1, help="Stub batch latency increase per request beyond the first")
+    parser.add_argument("--batch-size", type=int, default=None, help="Group LM requests into batches of up to this many (default off)")
+    parser.add_argument("--batch-window", type=float, default=0.02, help="Seconds a request waits for its batch to fill")
+    parser.add_argument("--output", default="logs/load/capacity.json", help="Capacity curve JSON")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",")]
+    scenarios = load_scenarios(args.scenarios) if args.scenarios else None
+    server = None
+    if args.lm_url is None:
+        server = StubLMServer(latency=args.latency, error_rate=args.error_rate, max_concurrency=args.server_concurrency,
+                              batch_size=args.server_batch_size, batch_cost=args.batch_cost).start()
+    # No client retries, so provider errors show up as failed turns
+    lm = dspy.LM(args.model, api_base=args.lm_url or server.url, api_key=os.getenv("LM_API_KEY", "stub"), cache=False, num_retries=0)
+    if args.batch_size:
+        lm = BatchingLM(lm, max_batch=args.batch_size, max_wait=args.batch_window, max_threads=max(64, args.max_inflight_lm))
+
+    print_header(batching=args.batch_size is not None)
+    try:
+        results = run_load_test(levels, args.duration, lm, args.think_time, args.max_inflight_lm, args.mode, scenarios, server)
+    finally:
+        if isinstance(lm, BatchingLM):
+            lm.close()
+        if server is not None:
+            server.stop()
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    save_results(args.output, results)
+    print(f"\nCapacity curve saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
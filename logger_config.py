@@ -1,32 +1,230 @@
 import os
+import copy
+import json
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 log_dir = "logs"
 
-def get_logger(name: str = "app", log_file: str = "logs/app.log") -> logging.Logger:
-    os.makedirs(log_dir, exist_ok=True)
-    logger = logging.getLogger(name)
-    if logger.handlers:
-        return logger
+# LOG_MODE=queue (default) hands records to a background listener that owns the
+# handlers; LOG_MODE=sync attaches the handlers directly as before.
+LOG_MODE = os.getenv("LOG_MODE", "queue")
+# LOG_FORMAT=json writes one structured record per line, text keeps the classic format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Messages longer than this are truncated by the listener; Truncated arguments are cut on the caller
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "2000"))
+# Fraction of DEBUG records kept (large payloads such as whole predictions log at DEBUG)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
 
-    logger.setLevel(logging.DEBUG)
+_session_id = contextvars.ContextVar("log_session_id", default=None)
+_turn = contextvars.ContextVar("log_turn", default=None)
+
+# Handlers are shared by every logger writing to the same file, and in queue mode so is the
+# listener, so a file only ever has one writer per process
+_handlers: Dict[str, List[logging.Handler]] = {}
+_listeners: Dict[str, QueueListener] = {}
+_queues: Dict[str, queue.SimpleQueue] = {}
+
+@contextmanager
+def log_context(session_id: Optional[str] = None, turn: Optional[int] = None):
+    """Attach session id and turn number to every record logged in this context"""
+    session_token = _session_id.set(session_id)
+    turn_token = _turn.set(turn)
+    try:
+        yield
+    finally:
+        _session_id.reset(session_token)
+        _turn.reset(turn_token)
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the log context and applies DEBUG sampling.
+
+    Runs on the calling thread, so it only reads two contextvars and draws a random number.
+    """
+
+    def __init__(self, debug_sample_rate: float = 1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno == logging.DEBUG and self.debug_sample_rate < 1.0 and random.random() >= self.debug_sample_rate:
+            return False
+        record.session_id = _session_id.get()
+        record.turn = _turn.get()
+        return True
+
+class Truncated:
+    """A %s argument rendered only if its record is logged, cut to `limit` characters so a
+    large value (e.g. a whole Prediction) is not carried whole to the listener"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = LOG_MAX_PAYLOAD):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}... [truncated {len(text) - self.limit} chars]"
+        return text
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that merges the message arguments on the calling thread, once the record
+    has passed its filters (so sampled-out DEBUG records are never rendered), and leaves
+    formatting and truncation to the listener thread of its file. Wrap a large argument in
+    Truncated to bound the work done on the caller."""
+
+    def __init__(self, log_file: str):
+        super().__init__(_queues[log_file])
+        self.log_file = log_file
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Looked up on every record: a forked worker replaces the queue
+        _queues[self.log_file].put_nowait(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the args now, as the stock implementation does: the caller may change them
+        # once the call returns. Only the formatter's work is left to the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with truncation of large messages"""
+
+    def __init__(self, max_payload: int = LOG_MAX_PAYLOAD):
+        super().__init__()
+        self.max_payload = max_payload
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if len(message) > self.max_payload:
+            message = f"{message[:self.max_payload]}... [truncated {len(message) - self.max_payload} chars]"
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": message,
+            "session_id": getattr(record, "session_id", None),
+            "turn": getattr(record, "turn", None),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TruncatingFormatter(logging.Formatter):
+    """Classic text format with truncation of large messages"""
+
+    def __init__(self, max_payload: int = LOG_MAX_PAYLOAD, **kwargs):
+        super().__init__(**kwargs)
+        self.max_payload = max_payload
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        if len(record.message) > self.max_payload:
+            record.message = f"{record.message[:self.max_payload]}... [truncated {len(record.message) - self.max_payload} chars]"
+        return super().formatMessage(record)
+
+def _build_handlers(log_file: str) -> List[logging.Handler]:
+    """The handlers writing to `log_file`, built on first use"""
+    if log_file in _handlers:
+        return _handlers[log_file]
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TruncatingFormatter(
+            fmt="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
 
     handler = RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=3)
-    formatter = logging.Formatter(
-        fmt="%(asctime)s %(levelname)s [%(name)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
 
     # Also log warnings+ to console
     console = logging.StreamHandler()
     console.setLevel(logging.WARNING)
     console.setFormatter(formatter)
-    logger.addHandler(console)
+    _handlers[log_file] = [handler, console]
+    return _handlers[log_file]
+
+def _queue_handler(log_file: str) -> QueueHandler:
+    """Start the background listener of `log_file` on first use and return a handler feeding it"""
+    if log_file not in _listeners:
+        if not _listeners:
+            atexit.register(stop_logging)
+        _queues[log_file] = queue.SimpleQueue()
+        _listeners[log_file] = QueueListener(_queues[log_file], *_build_handlers(log_file), respect_handler_level=True)
+        _listeners[log_file].start()
+    return LazyQueueHandler(log_file)
+
+def process_log_file(log_file: str, pid: int) -> str:
+    """The file a forked process writes instead of `log_file`, e.g. logs/app.1234.log"""
+    root, ext = os.path.splitext(log_file)
+    return f"{root}.{pid}{ext}"
+
+def _reopen_files_in_child():
+    """Rotating handlers inherited over fork would rename the parent's file under it, so a forked
+    worker writes its own file. The listener threads do not survive fork, and records still
+    queued belong to the parent, so each file also gets a new queue and listener."""
+    for log_file, handlers in _handlers.items():
+        for handler in handlers:
+            if isinstance(handler, RotatingFileHandler):
+                if handler.stream is not None:
+                    handler.stream.close()
+                handler.baseFilename = os.path.abspath(process_log_file(log_file, os.getpid()))
+                handler.stream = handler._open()
+    for log_file, listener in list(_listeners.items()):
+        _queues[log_file] = queue.SimpleQueue()
+        _listeners[log_file] = QueueListener(_queues[log_file], *listener.handlers, respect_handler_level=True)
+        _listeners[log_file].start()
+
+os.register_at_fork(after_in_child=_reopen_files_in_child)
+
+def stop_logging():
+    """Flush queued records and stop the background listeners"""
+    while _listeners:
+        _listeners.popitem()[1].stop()
+
+def get_logger(name: str = "app", log_file: str = "logs/app.log") -> logging.Logger:
+    """The named logger, writing to `log_file` and warnings to the console. A logger keeps the
+    file it was first created with; loggers sharing a file share its handlers."""
+    os.makedirs(log_dir, exist_ok=True)
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+
+    logger.setLevel(logging.DEBUG)
+
+    if LOG_MODE == "queue":
+        handler = _queue_handler(log_file)
+        handler.addFilter(ContextFilter(LOG_DEBUG_SAMPLE_RATE))
+        logger.addHandler(handler)
+    else:
+        # The handlers are shared, so the filter goes on the logger
+        logger.addFilter(ContextFilter(LOG_DEBUG_SAMPLE_RATE))
+        for handler in _build_handlers(log_file):
+            logger.addHandler(handler)
 
     logger.propagate = False
     return logger
 
+def measure_log_overhead(calls: int = 10_000, payload_chars: int = 5_000) -> float:
+    """Average microseconds spent on the calling thread per logger.info call with a large payload"""
+    logger = get_logger("log_overhead")
+    payload = {"response": "x" * payload_chars}
+    started = time.perf_counter()
+    for i in range(calls):
+        logger.info("Generated Result: %s (call %d)", payload, i)
+    return (time.perf_counter() - started) / calls * 1e6
 
+if __name__ == "__main__":
+    # Compare with: LOG_MODE=sync python logger_config.py
+    print(f"{LOG_MODE} mode: {measure_log_overhead():.1f}us per log call on the calling thread")
@@ -3,51 +3,121 @@ Simple test runner for Sky Credit Voice Assistant DSPy Pipeline
 """
 
 import dspy
+import time
+from typing import Callable, Optional
 from src.main_agent import MainAgent
+from src.metrics import JsonlExporter, MetricsCollector
+from src.transcripts import TranscriptStore
 from testing_agent import TestingAgent
 from logger_config import get_logger
+from lm_replay import RecordReplayLM
+from lm_hedging import HedgedLM, LMBackend
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
 logger = get_logger("test_runner")
 
-def run_conversation_test():
-    """Run a simple conversation test between AI agents"""
-    
-    logger.info("Starting DSPy conversation test")
-    
-    # Configure DSPy
+def configure_lm():
+    """Configure DSPy with the OpenRouter model used by all test runners.
+
+    Set LM_CACHE_MODE=record to store every completion in LM_CACHE_PATH, or
+    LM_CACHE_MODE=replay to serve them from disk without network access.
+    LM_HEDGE_MODELS is a comma separated list of further OpenRouter models to hedge
+    slow requests to and fail over to, with LM_TIMEOUT seconds per attempt.
+    """
     lm = dspy.LM("openrouter/qwen/qwen3-30b-a3b-instruct-2507", api_base="https://openrouter.ai/api/v1", api_key=os.getenv("OPENROUTER_API_KEY"))
+    hedge_models = [model.strip() for model in os.getenv("LM_HEDGE_MODELS", "").split(",") if model.strip()]
+    if hedge_models:
+        timeout = float(os.getenv("LM_TIMEOUT", "15"))
+        lm = HedgedLM([LMBackend(lm, timeout=timeout)] + [
+            LMBackend(dspy.LM(f"openrouter/{model}", api_base="https://openrouter.ai/api/v1", api_key=os.getenv("OPENROUTER_API_KEY")), timeout=timeout)
+            for model in hedge_models
+        ])
+    cache_mode = os.getenv("LM_CACHE_MODE")
+    if cache_mode:
+        os.makedirs("logs", exist_ok=True)
+        lm = RecordReplayLM(lm, os.getenv("LM_CACHE_PATH", "logs/lm_cache.sqlite"), mode=cache_mode)
     dspy.configure(lm=lm)
+    return lm
 
-    # Initialize agents
-    main_agent = MainAgent()
-    testing_agent = TestingAgent()
+def simulate_conversation(
+    main_agent: MainAgent,
+    testing_agent: TestingAgent,
+    max_turns: int = 10,
+    initial_message: Optional[str] = None,
+    echo: bool = False,
+    before_turn: Optional[Callable[[], None]] = None,
+) -> dict:
+    """Drive one conversation between the testing agent and the main agent.
 
-    print("🤖 Sky Credit Voice Assistant Test")
-    print("=" * 40)
+    Returns the transcript and per-turn latency of the main agent. `before_turn`
+    is called before every main agent turn, e.g. to apply a rate limit.
+    """
+    transcript = []
+    turn_latencies = []
+
+    def say(speaker: str, message: str):
+        transcript.append(f"{speaker}: {message}")
+        if echo:
+            print(f"{speaker}: {message}")
+
+    def assistant_turn(message: str) -> str:
+        if before_turn:
+            before_turn()
+        started = time.perf_counter()
+        response = main_agent.process_input(message)
+        turn_latencies.append(time.perf_counter() - started)
+        return response
 
     # Start conversation
-    customer_message = testing_agent.get_initial_message()
-    print(f"Customer: {customer_message}")
-    
-    assistant_response = main_agent.process_input(customer_message)
-    print(f"Assistant: {assistant_response}")
+    customer_message = initial_message or testing_agent.get_initial_message()
+    say("Customer", customer_message)
+
+    assistant_response = assistant_turn(customer_message)
+    say("Assistant", assistant_response)
 
     # Continue conversation
-    max_turns = 10
     for turn in range(max_turns):
         customer_message = testing_agent.generate_response(assistant_response)
         
         if customer_message is None:
-            print("Customer: [Call ended]")
-            logger.info(f"Conversation ended after {turn + 1} turns")
+            if echo:
+                print("Customer: [Call ended]")
+            logger.info("Conversation ended after %d turns", turn + 1)
             break
 
-        print(f"Customer: {customer_message}")
-        assistant_response = main_agent.process_input(customer_message)
-        print(f"Assistant: {assistant_response}")
+        say("Customer", customer_message)
+        assistant_response = assistant_turn(customer_message)
+        say("Assistant", assistant_response)
+
+    return {
+        "transcript": transcript,
+        "turn_latencies": turn_latencies,
+        "ended_by_customer": testing_agent.is_conversation_ended(),
+    }
+
+def run_conversation_test():
+    """Run a simple conversation test between AI agents"""
+    
+    logger.info("Starting DSPy conversation test")
+    
+    # Configure DSPy
+    configure_lm()
+
+    # Initialize agents, recording per-turn metrics to logs/turn_metrics.jsonl
+    metrics = MetricsCollector()
+    metrics.add_hook(JsonlExporter("logs/turn_metrics.jsonl"))
+    transcripts = TranscriptStore("logs/transcripts")
+    main_agent = MainAgent(metrics=metrics, transcripts=transcripts)
+    main_agent.state.session_id = time.strftime("test-%Y%m%d-%H%M%S")
+    testing_agent = TestingAgent()
+
+    print("🤖 Sky Credit Voice Assistant Test")
+    print("=" * 40)
+
+    with main_agent:
+        simulate_conversation(main_agent, testing_agent, echo=True)
 
     # Show results
     print("\n" + "=" * 40)
@@ -56,15 +126,13 @@ def run_conversation_test():
     print(f"Total Messages: {len(main_agent.state.history.messages)}")
     
     # Check if customer was found
-    customer_found = any("Customer found:" in str(msg) for msg in main_agent.state.history.messages)
+    customer_found = main_agent.state.verified_customer_ref is not None
     print(f"Customer Lookup: {'✅ Success' if customer_found else '❌ Failed'}")
     
     logger.info("Test completed successfully")
+    transcripts.close(main_agent.state.session_id)
     print("✅ Test completed - Check logs/app.log for detailed logs")
-
-    # dumpt the inspect history of main agent to a txt file
-    with open("logs/history.txt", "w") as f:
-        f.write(main_agent.get_history())
+    print(f"📝 Transcript with every LM call: {transcripts.path(main_agent.state.session_id)}")
 
 if __name__ == "__main__":
     run_conversation_test()
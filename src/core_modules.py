@@ -1,6 +1,7 @@
 import dspy
-from typing import Dict, Optional
-from .db import lookup_customer
+from typing import Dict, Literal, Optional
+from .db import LOOKUP_MATCH_POLICY, lookup_customer, verify_names
+from .prefetch import prefetched_candidates
 
 def lookup_customer_tool(reference_or_mobile: str, first_name: str, last_name: str) -> str:
     """
@@ -14,10 +15,14 @@ def lookup_customer_tool(reference_or_mobile: str, first_name: str, last_name: s
     Returns:
         String with customer information or error message
     """
-    customer = lookup_customer(reference_or_mobile, first_name, last_name)
+    # A record prefetched when the caller first said their reference only needs the name check
+    candidates = prefetched_candidates(reference_or_mobile)
+    customer = verify_names(candidates, first_name, last_name) if candidates is not None else None
+    if customer is None:
+        customer = lookup_customer(reference_or_mobile, first_name, last_name, match_policy=LOOKUP_MATCH_POLICY)
     
     if customer:
-        return f"Customer found: {customer.firstName} {customer.lastName}. Account Balance: ${customer.accountBalance}, Next Payment: ${customer.minimumAmountDue} due {customer.nextPaymentDate}, Arrears: ${customer.arrearsBalance}, Days Past Due: {customer.daysPastDue}"
+        return f"Customer found: {customer.firstName} {customer.lastName} (reference {customer.clientReferenceNumber}). Account Balance: ${customer.accountBalance}, Next Payment: ${customer.minimumAmountDue} due {customer.nextPaymentDate}, Arrears: ${customer.arrearsBalance}, Days Past Due: {customer.daysPastDue}"
     else:
         return "Customer not found with provided details"
 
@@ -55,3 +60,26 @@ class SkyCreditVoiceAssistant(dspy.Signature):
     
     response: str = dspy.OutputField(desc="Assistant response following Sky Credit protocols")
 
+# Single-call variant of the assistant: one LM call either answers the turn directly or
+# gives the lookup_customer arguments; the tool then runs without the ReAct loop
+DirectAnswerSignature = SkyCreditVoiceAssistant.prepend(
+    "action",
+    dspy.OutputField(desc="'lookup_customer' only when every verification detail has been collected and the account must be looked up now, otherwise 'respond'"),
+    type_=Literal["respond", "lookup_customer"],
+)
+for position, (name, desc) in enumerate((
+    ("reference_or_mobile", "Customer reference number or mobile number"),
+    ("first_name", "Customer's first name"),
+    ("last_name", "Customer's last name"),
+), start=1):
+    DirectAnswerSignature = DirectAnswerSignature.insert(
+        position, name, dspy.OutputField(desc=f"{desc} for lookup_customer, empty unless action is 'lookup_customer'"), type_=str,
+    )
+del position, name, desc
+
+# Answer of a direct-mode turn once lookup_customer has run
+DirectLookupAnswerSignature = SkyCreditVoiceAssistant.append(
+    "lookup_result",
+    dspy.InputField(desc="What lookup_customer returned for the details the customer gave"),
+    type_=str,
+)
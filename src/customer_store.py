@@ -0,0 +1,293 @@
+"""
+Customer stores for Sky Credit Voice Assistant
+Pluggable backends indexed by normalized reference number and E.164 mobile number,
+plus bulk CSV loaders for the SQLite and columnar backends.
+"""
+
+import array
+import bisect
+import csv
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional
+
+from .db import Customer, normalize_mobile, normalize_reference
+
+CUSTOMER_FIELDS = list(Customer.model_fields)
+SQL_TYPES = {float: "REAL", int: "INTEGER", str: "TEXT"}
+COLUMNAR_MAGIC = b"SKYCOL01"
+COLUMNAR_SUFFIX = ".col"
+# Packed array typecode per field; string fields hold ids into the string table
+COLUMN_TYPES = {field: {float: "d", int: "q", str: "I"}[info.annotation] for field, info in Customer.model_fields.items()}
+
+class CustomerStore(ABC):
+    """Interface for customer lookups. Keys passed in are already normalized."""
+
+    @abstractmethod
+    def get_by_reference(self, reference: str) -> Optional[Customer]:
+        ...
+
+    @abstractmethod
+    def find_by_mobile(self, mobile: str) -> List[Customer]:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+class InMemoryCustomerStore(CustomerStore):
+    """Dict-backed store for small books and tests"""
+
+    def __init__(self, customers: Iterable[Customer]):
+        self.by_reference: Dict[str, Customer] = {}
+        self.by_mobile: Dict[str, List[Customer]] = {}
+        for customer in customers:
+            self.add(customer)
+
+    def add(self, customer: Customer) -> None:
+        self.by_reference[normalize_reference(customer.clientReferenceNumber)] = customer
+        mobile = normalize_mobile(customer.mobileNumber)
+        if mobile:
+            self.by_mobile.setdefault(mobile, []).append(customer)
+
+    def get_by_reference(self, reference: str) -> Optional[Customer]:
+        return self.by_reference.get(reference)
+
+    def find_by_mobile(self, mobile: str) -> List[Customer]:
+        return self.by_mobile.get(mobile, [])
+
+    def __len__(self) -> int:
+        return len(self.by_reference)
+
+# A forked child inherits the forking thread's thread-local connection, and sharing an
+# open SQLite connection across processes corrupts it, so children start without one
+_sqlite_stores: "weakref.WeakSet[SQLiteCustomerStore]" = weakref.WeakSet()
+
+def _reset_sqlite_connections() -> None:
+    for store in list(_sqlite_stores):
+        store._local = threading.local()
+
+os.register_at_fork(after_in_child=_reset_sqlite_connections)
+
+class SQLiteCustomerStore(CustomerStore):
+    """Disk-backed store with B-tree indexes on reference number and E.164 mobile"""
+
+    SCHEMA = f"""
+        CREATE TABLE IF NOT EXISTS customers (
+            reference TEXT PRIMARY KEY,
+            mobile_e164 TEXT,
+            {", ".join(f"{field} {SQL_TYPES[info.annotation]}" for field, info in Customer.model_fields.items())}
+        ) WITHOUT ROWID
+    """
+    MOBILE_INDEX = "CREATE INDEX IF NOT EXISTS idx_customers_mobile ON customers (mobile_e164)"
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite3 connections are not shareable across threads, so each thread gets its own
+        self._local = threading.local()
+        _sqlite_stores.add(self)
+        conn = self._connection()
+        conn.execute(self.SCHEMA)
+        conn.execute(self.MOBILE_INDEX)
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _select(self, where: str, key: str) -> List[Customer]:
+        rows = self._connection().execute(
+            f"SELECT {', '.join(CUSTOMER_FIELDS)} FROM customers WHERE {where} = ?", (key,)
+        ).fetchall()
+        return [Customer(**dict(zip(CUSTOMER_FIELDS, row))) for row in rows]
+
+    def get_by_reference(self, reference: str) -> Optional[Customer]:
+        rows = self._select("reference", reference)
+        return rows[0] if rows else None
+
+    def find_by_mobile(self, mobile: str) -> List[Customer]:
+        return self._select("mobile_e164", mobile)
+
+    def add_many(self, customers: Iterable[Customer]) -> int:
+        """Insert or replace validated Customer records"""
+        return self._insert(customer.model_dump() for customer in customers)
+
+    def _insert(self, records: Iterable[dict], batch_size: int = 50_000) -> int:
+        conn = self._connection()
+        sql = (
+            f"INSERT OR REPLACE INTO customers (reference, mobile_e164, {', '.join(CUSTOMER_FIELDS)}) "
+            f"VALUES ({', '.join('?' * (len(CUSTOMER_FIELDS) + 2))})"
+        )
+        count = 0
+        batch = []
+        for record in records:
+            batch.append((
+                normalize_reference(record["clientReferenceNumber"]),
+                normalize_mobile(record["mobileNumber"]),
+                *(record[field] for field in CUSTOMER_FIELDS),
+            ))
+            if len(batch) >= batch_size:
+                conn.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+            count += len(batch)
+        conn.commit()
+        return count
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+class ColumnarCustomerStore(CustomerStore):
+    """Read-only store over a prebuilt columnar file, memory-mapped so opening it is O(1).
+
+    Numeric fields are packed arrays, string fields are ids into one interned string table,
+    and the reference and mobile indexes are key-sorted row lists searched with bisect.
+    No per-customer Python objects exist until a lookup materializes its result.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = struct.unpack_from("<8sQ", self._mm, 0)
+        if magic != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is not a columnar customer file")
+        header = json.loads(self._mm[16:16 + header_size])
+        self._count = header["rows"]
+        data_start = _align(16 + header_size)
+        view = memoryview(self._mm)
+        self._sections = {
+            name: view[data_start + offset:data_start + offset + length].cast(typecode)
+            for name, (offset, length, typecode) in header["sections"].items()
+        }
+        self._string_offsets = self._sections["strings.offsets"]
+        self._string_data_start = data_start + header["sections"]["strings.data"][0]
+
+    def _string(self, string_id: int) -> str:
+        start = self._string_data_start + self._string_offsets[string_id]
+        end = self._string_data_start + self._string_offsets[string_id + 1]
+        return self._mm[start:end].decode()
+
+    def _materialize(self, row: int) -> Customer:
+        values = {}
+        for field in CUSTOMER_FIELDS:
+            value = self._sections[field][row]
+            values[field] = self._string(value) if COLUMN_TYPES[field] == "I" else value
+        # Values were type-checked when the file was built
+        return Customer.model_construct(**values)
+
+    def _rows(self, index: str, key: str) -> List[int]:
+        keys = self._sections[f"index.{index}.keys"]
+        lo = bisect.bisect_left(keys, key, key=self._string)
+        hi = bisect.bisect_right(keys, key, lo=lo, key=self._string)
+        return list(self._sections[f"index.{index}.rows"][lo:hi])
+
+    def get_by_reference(self, reference: str) -> Optional[Customer]:
+        rows = self._rows("reference", reference)
+        return self._materialize(rows[0]) if rows else None
+
+    def find_by_mobile(self, mobile: str) -> List[Customer]:
+        return [self._materialize(row) for row in self._rows("mobile", mobile)]
+
+    def __len__(self) -> int:
+        return self._count
+
+def build_columnar_store(records: Iterable[dict], path: str) -> int:
+    """Write type-cast customer records to a columnar file for ColumnarCustomerStore"""
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+
+    def intern(value: str) -> int:
+        string_id = string_ids.get(value)
+        if string_id is None:
+            string_id = string_ids[value] = len(strings)
+            strings.append(value)
+        return string_id
+
+    columns = {field: array.array(typecode) for field, typecode in COLUMN_TYPES.items()}
+    reference_keys: List[str] = []
+    mobile_keys: List[Optional[str]] = []
+    for record in records:
+        for field, typecode in COLUMN_TYPES.items():
+            columns[field].append(intern(record[field]) if typecode == "I" else record[field])
+        reference_keys.append(normalize_reference(record["clientReferenceNumber"]))
+        mobile_keys.append(normalize_mobile(record["mobileNumber"]))
+
+    sections = {name: column for name, column in columns.items()}
+    for index, keys in (("reference", reference_keys), ("mobile", mobile_keys)):
+        rows = sorted((row for row, key in enumerate(keys) if key), key=keys.__getitem__)
+        sections[f"index.{index}.keys"] = array.array("I", (intern(keys[row]) for row in rows))
+        sections[f"index.{index}.rows"] = array.array("I", rows)
+
+    encoded = [value.encode() for value in strings]
+    offsets = array.array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections["strings.offsets"] = offsets
+    sections["strings.data"] = b"".join(encoded)
+
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        length = len(data) * (data.itemsize if isinstance(data, array.array) else 1)
+        layout[name] = (offset, length, data.typecode if isinstance(data, array.array) else "B")
+        offset = _align(offset + length)
+    header = json.dumps({"rows": len(reference_keys), "sections": layout}).encode()
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<8sQ", COLUMNAR_MAGIC, len(header)))
+        f.write(header)
+        f.write(b"\0" * (_align(16 + len(header)) - 16 - len(header)))
+        for data in sections.values():
+            f.write(data)
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+    return len(reference_keys)
+
+def _csv_records(csv_path: str) -> Iterable[dict]:
+    casts = {field: info.annotation for field, info in Customer.model_fields.items()}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield {field: casts[field](row[field]) for field in CUSTOMER_FIELDS}
+
+def load_customers_csv(csv_path: str, db_path: str, batch_size: int = 50_000) -> int:
+    """Bulk load a CSV with Customer field names as headers into a SQLite store.
+
+    Rows are type-cast rather than validated one by one, and the mobile index is
+    rebuilt after the load, which keeps multi-million row imports fast.
+    """
+    store = SQLiteCustomerStore(db_path)
+    conn = store._connection()
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("DROP INDEX IF EXISTS idx_customers_mobile")
+
+    count = store._insert(_csv_records(csv_path), batch_size=batch_size)
+    conn.execute(store.MOBILE_INDEX)
+    conn.execute("ANALYZE")
+    conn.commit()
+    return count
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m src.customer_store <customers.csv> <customers.db | customers.col>")
+        sys.exit(1)
+    if sys.argv[2].endswith(COLUMNAR_SUFFIX):
+        loaded = build_columnar_store(_csv_records(sys.argv[1]), sys.argv[2])
+    else:
+        loaded = load_customers_csv(sys.argv[1], sys.argv[2])
+    print(f"Loaded {loaded} customers into {sys.argv[2]}")
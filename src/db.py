@@ -1,9 +1,12 @@
 """
 Database functionality for Sky Credit Voice Assistant
 Contains customer database and lookup functions using Pydantic models.
+Lookups go through a pluggable customer store (see customer_store.py).
 """
 
-from typing import Dict, Optional
+import os
+import re
+from typing import Dict, Iterable, Iterator, Optional
 from pydantic import BaseModel
 
 class Customer(BaseModel):
@@ -34,41 +37,98 @@ CUSTOMER_DATABASE = {
     "LF36852": Customer(firstName="Jane", lastName="Clark", emailAddress="vliu@gmail.com", mobileNumber="+6140389305", clientReferenceNumber="LF36852", accountBalance=1055.38, arrearsBalance=369.38, minimumAmountDue=105.54, nextPaymentDate="2025-09-28", accountStatus="Arrears", daysPastDue=124)
 }
 
-# Mobile number to reference mapping for quick lookup
-MOBILE_TO_REFERENCE = {
-    "+61402017491": "XT59591",
-    "+61403893026": "PO18973", 
-    "+61498043748": "HA79343",
-    "+61402643302": "SD89885",
-    "+61487914945": "KE75413",
-    "+6140389301": "ZZ99466",
-    "+6140389302": "KQ59118",
-    "+6140389303": "UD62179",
-    "+6140389304": "IF42330",
-    "+6140389305": "LF36852"
-}
+DEFAULT_COUNTRY_CODE = "61"
 
-def lookup_customer(reference_or_mobile: str, first_name: str, last_name: str) -> Optional[Customer]:
-    """Look up customer in the database using Pydantic models"""
-    # Clean input
-    reference_or_mobile = reference_or_mobile.strip().upper()
-    first_name = first_name.strip().lower()
-    last_name = last_name.strip().lower()
+STRICT_MATCH = "strict"
+FUZZY_MATCH = "fuzzy"
+# Policy of the agent's lookup tool; strict unless explicitly relaxed
+LOOKUP_MATCH_POLICY = os.getenv("SKY_MATCH_POLICY", STRICT_MATCH)
+
+# Active customer store, created on first lookup
+_customer_store = None
+
+def normalize_reference(reference: str) -> str:
+    """Normalize a client reference number to its stored form"""
+    return re.sub(r"[\s\-]", "", reference).upper()
+
+def normalize_mobile(mobile: str, country_code: str = DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """Normalize a mobile number to E.164, or None if it has no digits"""
+    digits = re.sub(r"\D", "", mobile)
+    if not digits:
+        return None
+    if mobile.strip().startswith("+"):
+        return f"+{digits}"
+    if digits.startswith("00"):
+        return f"+{digits[2:]}"
+    if digits.startswith("0"):
+        return f"+{country_code}{digits[1:]}"
+    if digits.startswith(country_code):
+        return f"+{digits}"
+    return f"+{country_code}{digits}"
+
+def get_customer_store():
+    """Get the active customer store: SKY_CUSTOMER_DB (a .col columnar file or a SQLite database)
+    or the in-memory sample book"""
+    global _customer_store
+    if _customer_store is None:
+        from .customer_store import COLUMNAR_SUFFIX, ColumnarCustomerStore, InMemoryCustomerStore, SQLiteCustomerStore
+        db_path = os.getenv("SKY_CUSTOMER_DB")
+        if db_path and db_path.endswith(COLUMNAR_SUFFIX):
+            _customer_store = ColumnarCustomerStore(db_path)
+        elif db_path:
+            _customer_store = SQLiteCustomerStore(db_path)
+        else:
+            _customer_store = InMemoryCustomerStore(CUSTOMER_DATABASE.values())
+    return _customer_store
+
+def set_customer_store(store) -> None:
+    """Replace the active customer store"""
+    global _customer_store
+    _customer_store = store
+
+def _names_match(customer: Customer, first_name: str, last_name: str) -> bool:
+    return customer.firstName.lower() == first_name and customer.lastName.lower() == last_name
+
+def lookup_candidates(reference_or_mobile: str) -> Iterator[Customer]:
+    """Customers matching a reference number or mobile, before any name check.
+    Lazy, so the mobile index is only queried when the reference match is not used."""
+    store = get_customer_store()
     
     # First try direct reference lookup (most efficient)
-    if reference_or_mobile in CUSTOMER_DATABASE:
-        customer = CUSTOMER_DATABASE[reference_or_mobile]
-        if (customer.firstName.lower() == first_name and 
-            customer.lastName.lower() == last_name):
-            return customer
-    
-    # Try mobile number lookup
-    cleaned_mobile = reference_or_mobile.replace("+", "").replace(" ", "").replace("-", "")
-    for mobile, ref in MOBILE_TO_REFERENCE.items():
-        if mobile.replace("+", "").replace(" ", "") == cleaned_mobile:
-            customer = CUSTOMER_DATABASE[ref]
-            if (customer.firstName.lower() == first_name and 
-                customer.lastName.lower() == last_name):
-                return customer
+    customer = store.get_by_reference(normalize_reference(reference_or_mobile))
+    if customer:
+        yield customer
     
-    return None
\ No newline at end of file
+    # Then the mobile number through the E.164 index
+    mobile = normalize_mobile(reference_or_mobile)
+    if mobile:
+        yield from store.find_by_mobile(mobile)
+
+def verify_names(candidates: Iterable[Customer], first_name: str, last_name: str) -> Optional[Customer]:
+    """The first candidate whose name matches"""
+    first_name = first_name.strip().lower()
+    last_name = last_name.strip().lower()
+    for customer in candidates:
+        if _names_match(customer, first_name, last_name):
+            return customer
+    return None
+
+def lookup_customer(
+    reference_or_mobile: str,
+    first_name: str,
+    last_name: str,
+    match_policy: str = STRICT_MATCH,
+) -> Optional[Customer]:
+    """Look up customer in the active store by reference number or mobile, verifying the name.
+
+    The strict policy requires the exact reference or mobile and exact names. The fuzzy policy
+    also accepts spoken references and ASR name variants above FUZZY_MIN_CONFIDENCE.
+    """
+    customer = verify_names(lookup_candidates(reference_or_mobile), first_name, last_name)
+    if customer is not None or match_policy == STRICT_MATCH:
+        return customer
+    if match_policy != FUZZY_MATCH:
+        raise ValueError(f"match_policy must be {STRICT_MATCH!r} or {FUZZY_MATCH!r}, got {match_policy!r}")
+    from .fuzzy_match import FUZZY_MIN_CONFIDENCE, match_customer
+    match = match_customer(reference_or_mobile, first_name, last_name)
+    return match.customer if match and match.confidence >= FUZZY_MIN_CONFIDENCE else None
@@ -0,0 +1,172 @@
+"""
+ASR-tolerant customer matching for Sky Credit Voice Assistant
+Speech-to-text turns "Madisson" into "Madison" and reads references out as
+"x-ray tango five nine five nine one". This module normalizes spoken references, scores
+names with Soundex keys and character trigrams, and recovers a misheard reference character
+by looking up its 95 one-character neighbours in the store's reference index, so recovery
+costs the same at a million customers as at a thousand. Matches carry a confidence score.
+
+Strict matching stays the default for authorization; callers opt in with
+lookup_customer(..., match_policy="fuzzy").
+"""
+
+import re
+import string
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from .db import Customer, get_customer_store, lookup_candidates
+
+# Below this confidence a fuzzy match is not returned
+FUZZY_MIN_CONFIDENCE = 0.8
+# A name part scoring below this rules the candidate out
+NAME_PART_FLOOR = 0.6
+# Confidence factor for a reference recovered from a single misheard character
+REFERENCE_RECOVERY_FACTOR = 0.9
+
+NUMBER_WORDS = {
+    "zero": "0", "oh": "0", "o": "0", "nought": "0", "one": "1", "two": "2", "three": "3", "four": "4",
+    "five": "5", "six": "6", "seven": "7", "eight": "8", "nine": "9",
+}
+NATO_WORDS = {
+    "alpha": "A", "alfa": "A", "bravo": "B", "charlie": "C", "delta": "D", "echo": "E", "foxtrot": "F",
+    "golf": "G", "hotel": "H", "india": "I", "juliet": "J", "juliett": "J", "kilo": "K", "lima": "L",
+    "mike": "M", "november": "N", "oscar": "O", "papa": "P", "quebec": "Q", "romeo": "R", "sierra": "S",
+    "tango": "T", "uniform": "U", "victor": "V", "whiskey": "W", "whisky": "W", "xray": "X", "x-ray": "X",
+    "yankee": "Y", "zulu": "Z",
+}
+REPEAT_WORDS = {"double": 2, "triple": 3}
+# One-letter English words, read as letters only when spelled out, e.g. "A for alpha"
+WORD_LETTERS = {"a", "i"}
+# Contractions stay one token, so the "m" of "I'm" is never read as a letter
+SPOKEN_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?(?:-[a-z]+)?|\d+")
+SPOKEN_REFERENCE = re.compile(r"[A-Z]{2}\d{5}(?!\d)")
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"), **dict.fromkeys("dt", "3"),
+    "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+@dataclass
+class MatchResult:
+    customer: Customer
+    confidence: float
+    method: str
+
+def parse_spoken_reference(text: str) -> Optional[tuple]:
+    """Find a reference read out in words, e.g. "x-ray tango five nine five nine one" or
+    "X for x-ray, T, double five...". Returns (value, span) like the verification parsers."""
+    symbols: List[Tuple[str, int, int]] = []
+    repeat = 1
+    skip_next = False
+    tokens = list(SPOKEN_TOKEN.finditer(text.lower().replace("\u2019", "'")))
+    for i, match in enumerate(tokens):
+        token = match.group()
+        if skip_next:
+            # "X for x-ray": the word after "for" only spells the letter already given
+            skip_next = False
+            continue
+        if token == "for" and symbols and symbols[-1][0].isalpha():
+            skip_next = True
+            continue
+        if token in REPEAT_WORDS:
+            repeat = REPEAT_WORDS[token]
+            continue
+        if token.isdigit():
+            value = token
+        elif token in NUMBER_WORDS and (token not in ("o", "oh") or (symbols and symbols[-1][0].isdigit())):
+            value = NUMBER_WORDS[token]
+        elif token in NATO_WORDS:
+            value = NATO_WORDS[token]
+        elif len(token) == 1 and (token not in WORD_LETTERS or (i + 1 < len(tokens) and tokens[i + 1].group() == "for")):
+            value = token.upper()
+        else:
+            repeat = 1
+            symbols.append(("|", match.start(), match.end()))
+            continue
+        for char in value * repeat:
+            symbols.append((char, match.start(), match.end()))
+        repeat = 1
+
+    joined = "".join(symbol[0] for symbol in symbols)
+    found = SPOKEN_REFERENCE.search(joined)
+    if not found:
+        return None
+    return found.group(), (symbols[found.start()][1], symbols[found.end() - 1][2])
+
+def soundex(name: str) -> str:
+    """American Soundex code, e.g. Madisson and Madison are both M325"""
+    letters = [char for char in name.lower() if char.isalpha()]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code, vowels do
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+def trigrams(name: str) -> set:
+    padded = f"  {name.lower().strip()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def name_similarity(heard: str, stored: str) -> float:
+    """1.0 for an exact match, otherwise trigram Dice similarity boosted by a Soundex agreement"""
+    heard, stored = heard.strip().lower(), stored.strip().lower()
+    if heard == stored:
+        return 1.0
+    a, b = trigrams(heard), trigrams(stored)
+    dice = 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+    if soundex(heard) == soundex(stored):
+        return 0.5 + 0.5 * dice
+    return 0.8 * dice
+
+def identity_confidence(first_name: str, last_name: str, customer_first: str, customer_last: str) -> float:
+    first = name_similarity(first_name, customer_first)
+    last = name_similarity(last_name, customer_last)
+    if min(first, last) < NAME_PART_FLOOR:
+        return 0.0
+    return (first + last) / 2
+
+def reference_neighbours(reference: str) -> Iterator[str]:
+    """Every reference one misheard character away, letters for letters and digits for digits:
+    2 x 25 + 5 x 9 = 95 keys for a reference like XT59591"""
+    for i, char in enumerate(reference):
+        alphabet = string.ascii_uppercase if char.isalpha() else string.digits
+        for replacement in alphabet:
+            if replacement != char:
+                yield reference[:i] + replacement + reference[i + 1:]
+
+def match_customer(reference_or_mobile: str, first_name: str, last_name: str) -> Optional[MatchResult]:
+    """Best match for what the caller said, with a confidence between 0 and 1"""
+    spoken = parse_spoken_reference(reference_or_mobile)
+    key = spoken[0] if spoken else reference_or_mobile
+
+    best = None
+    for customer in lookup_candidates(key):
+        confidence = identity_confidence(first_name, last_name, customer.firstName, customer.lastName)
+        if confidence and (best is None or confidence > best.confidence):
+            best = MatchResult(customer, confidence, "exact" if confidence == 1.0 else "fuzzy_name")
+    if best is not None:
+        return best
+
+    # The reference itself may be misheard: look up every reference one character away from
+    # what was heard in the store's reference index, and keep the customer whose name matches
+    heard = spoken[0] if spoken else re.sub(r"[\s\-]", "", reference_or_mobile).upper()
+    if not SPOKEN_REFERENCE.fullmatch(heard):
+        return None
+    store = get_customer_store()
+    for reference in reference_neighbours(heard):
+        customer = store.get_by_reference(reference)
+        if customer is None:
+            continue
+        confidence = identity_confidence(first_name, last_name, customer.firstName, customer.lastName) * REFERENCE_RECOVERY_FACTOR
+        if confidence and (best is None or confidence > best.confidence):
+            best = MatchResult(customer, confidence, "reference_recovered")
+    return best
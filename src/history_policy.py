@@ -0,0 +1,117 @@
+"""
+History policy for Sky Credit Voice Assistant
+Keeps the last turns verbatim, folds older turns into a running summary and pins verified
+facts, so the history sent into every ReAct step stays under a token ceiling.
+"""
+
+import dspy
+from typing import List
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger_config import get_logger
+logger = get_logger("history_policy")
+
+class HistorySummarySignature(dspy.Signature):
+    """Update the running summary of a Sky Credit Group customer call with turns that are leaving the verbatim window.
+    Keep what the assistant needs later: what the customer asked for, details they provided, options offered and actions agreed.
+    Be brief and factual."""
+    previous_summary: str = dspy.InputField(desc="Summary of the call so far, may be empty")
+    new_turns: str = dspy.InputField(desc="Turns to fold into the summary")
+
+    summary: str = dspy.OutputField(desc="Updated summary of the whole call so far")
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting"""
+    return len(text) // 4 + 1
+
+def format_turns(turns: List[dict]) -> str:
+    return "\n".join(f"Customer: {turn['customer_input']}\nAssistant: {turn['response']}" for turn in turns)
+
+class RollingHistoryPolicy:
+    """Builds the dspy.History passed to the agent from the full ConversationState"""
+
+    def __init__(self, keep_last: int = 6, max_tokens: int = 1500, summarize_with_lm: bool = True):
+        self.keep_last = keep_last
+        self.max_tokens = max_tokens
+        self.summarize_with_lm = summarize_with_lm
+        self.summarizer = dspy.Predict(HistorySummarySignature)
+
+    def build(self, state) -> dspy.History:
+        """Fold evicted turns into the summary and return the history for the next prompt"""
+        while (turns := self._turns_to_fold(state)):
+            state.summary = self._summarize(state.summary, turns)
+            state.summarized_turns += len(turns)
+        return self._render(state)
+
+    async def abuild(self, state) -> dspy.History:
+        """Async variant of build for the session manager"""
+        while (turns := self._turns_to_fold(state)):
+            state.summary = await self._asummarize(state.summary, turns)
+            state.summarized_turns += len(turns)
+        return self._render(state)
+
+    def _turns_to_fold(self, state) -> List[dict]:
+        """Turns that fell out of the verbatim window, plus more while over the token ceiling"""
+        messages = state.history.messages
+        start = state.summarized_turns
+        end = max(start, len(messages) - self.keep_last)
+
+        # Always leave the latest turn verbatim, even when over budget
+        while end < len(messages) - 1 and self._tokens(state, messages[end:]) > self.max_tokens:
+            end += 1
+        return messages[start:end]
+
+    def _tokens(self, state, verbatim: List[dict]) -> int:
+        fixed = estimate_tokens(state.summary) + sum(estimate_tokens(fact) for fact in state.pinned_facts.values())
+        return fixed + estimate_tokens(format_turns(verbatim))
+
+    def _summarize(self, previous_summary: str, turns: List[dict]) -> str:
+        if not self.summarize_with_lm:
+            return self._append_summary(previous_summary, turns)
+        try:
+            result = self.summarizer(previous_summary=previous_summary, new_turns=format_turns(turns))
+            return self._clamp(result.summary)
+        except Exception as e:
+            logger.error("Summary update failed, falling back to extractive summary: %s", e)
+            return self._append_summary(previous_summary, turns)
+
+    async def _asummarize(self, previous_summary: str, turns: List[dict]) -> str:
+        if not self.summarize_with_lm:
+            return self._append_summary(previous_summary, turns)
+        try:
+            result = await self.summarizer.acall(previous_summary=previous_summary, new_turns=format_turns(turns))
+            return self._clamp(result.summary)
+        except Exception as e:
+            logger.error("Summary update failed, falling back to extractive summary: %s", e)
+            return self._append_summary(previous_summary, turns)
+
+    def _append_summary(self, previous_summary: str, turns: List[dict]) -> str:
+        """Extractive fallback: keep the new turns, trimming the oldest lines to the budget"""
+        lines = previous_summary.splitlines() if previous_summary else []
+        lines.extend(format_turns(turns).splitlines())
+        budget = self.max_tokens // 2
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > budget:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def _clamp(self, summary: str) -> str:
+        """Keep an LM summary within half the budget, dropping its oldest text"""
+        max_chars = (self.max_tokens // 2) * 4
+        return summary if len(summary) <= max_chars else summary[-max_chars:]
+
+    def _render(self, state) -> dspy.History:
+        # Context goes in customer_input: the ReAct step renders only input fields of past turns
+        messages = []
+        if state.pinned_facts:
+            messages.append({
+                "customer_input": "[Call context, not spoken by the customer] " + "\n".join(state.pinned_facts.values()),
+                "response": "Noted."
+            })
+        if state.summary:
+            messages.append({
+                "customer_input": f"[Call context, not spoken by the customer] Summary of the call so far: {state.summary}",
+                "response": "Noted."
+            })
+        messages.extend(state.history.messages[state.summarized_turns:])
+        return dspy.History(messages=messages)
@@ -1,74 +1,437 @@
+import copy
 import dspy
-from typing import Optional
-from dataclasses import dataclass
+import re
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+from dataclasses import dataclass, field, fields
+from contextlib import ExitStack
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from logger_config import get_logger
+from logger_config import Truncated, get_logger, log_context
 logger = get_logger("main_agent")
 
-from .core_modules import SkyCreditVoiceAssistant, lookup_customer_tool
+from .core_modules import DirectAnswerSignature, DirectLookupAnswerSignature, SkyCreditVoiceAssistant, lookup_customer_tool
+from .streaming import SentenceChunker
+from .history_policy import RollingHistoryPolicy
+from .metrics import MetricsCollector, current_turn
+from .transcripts import TranscriptStore, format_entries
+from .verification import VerificationSlots, VerificationStage, verification_summary
+from .orchestrator import ScenarioOrchestrator, ScenarioState
+from .prefetch import CustomerPrefetcher
+from .response_cache import ResponseCache
+
+REACT_MODE = "react"
+# One LM call per turn, plus one more to answer with the customer record when that call
+# chooses the lookup tool; the ReAct loop never runs
+DIRECT_MODE = "direct"
+LOOKUP_ARGS = ("reference_or_mobile", "first_name", "last_name")
+AGENT_MODES = (REACT_MODE, DIRECT_MODE)
 
 @dataclass
 class ConversationState:
     history: Optional[dspy.History] = None
+    session_id: Optional[str] = None
+    summary: str = ""
+    summarized_turns: int = 0
+    pinned_facts: Dict[str, str] = field(default_factory=dict)
+    verified_customer_ref: Optional[str] = None
+    verification: VerificationSlots = field(default_factory=VerificationSlots)
+    scenario: ScenarioState = field(default_factory=ScenarioState)
+    last_time_to_first_chunk: Optional[float] = None
+    # Seconds the last turn waited for an LM slot in SessionManager
+    last_lm_queue_wait: Optional[float] = None
+    # Keeps the prefetches of calls without a session id apart; not part of the stored session
+    call_id: str = field(default_factory=lambda: uuid.uuid4().hex)
     
     def __post_init__(self):
         if self.history is None:
             self.history = dspy.History(messages=[])
+    
+    def to_dict(self) -> dict:
+        """JSON-serializable session. Per-turn timings are not part of it, and slot and
+        scenario fields still at their defaults are left out to keep stored sessions small."""
+        return {
+            "session_id": self.session_id,
+            "history": list(self.history.messages),
+            "summary": self.summary,
+            "summarized_turns": self.summarized_turns,
+            "pinned_facts": dict(self.pinned_facts),
+            "verified_customer_ref": self.verified_customer_ref,
+            "verification": _changed_fields(self.verification),
+            "scenario": _changed_fields(self.scenario),
+        }
+    
+    def restore(self, data: dict) -> None:
+        """Roll back in place to an earlier to_dict() snapshot, keeping the per-turn timings"""
+        restored = ConversationState.from_dict(data)
+        for name in data:
+            setattr(self, name, getattr(restored, name))
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConversationState":
+        return cls(
+            history=dspy.History(messages=list(data.get("history", []))),
+            session_id=data.get("session_id"),
+            summary=data.get("summary", ""),
+            summarized_turns=data.get("summarized_turns", 0),
+            pinned_facts=dict(data.get("pinned_facts", {})),
+            verified_customer_ref=data.get("verified_customer_ref"),
+            verification=VerificationSlots(**data.get("verification", {})),
+            scenario=ScenarioState(**data.get("scenario", {})),
+        )
+
+def _prefetch_session(state: ConversationState) -> str:
+    return state.session_id or state.call_id
+
+def _changed_fields(instance) -> dict:
+    """Fields of a dataclass instance that differ from a default-constructed one"""
+    default = type(instance)()
+    return {
+        f.name: copy.copy(getattr(instance, f.name))
+        for f in fields(instance)
+        if getattr(instance, f.name) != getattr(default, f.name)
+    }
 
 class MainAgent:
     """Main Agent Class"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        history_policy: Optional[RollingHistoryPolicy] = None,
+        metrics: Optional[MetricsCollector] = None,
+        fast_verification: bool = True,
+        orchestrate_scenarios: bool = True,
+        transcripts: Optional[TranscriptStore] = None,
+        prefetch: bool = True,
+        mode: str = REACT_MODE,
+        response_cache: Optional[ResponseCache] = None,
+        program_path: Optional[str] = None,
+    ):
+        if mode not in AGENT_MODES:
+            raise ValueError(f"mode must be one of {AGENT_MODES}, got {mode!r}")
         self.lookup_tool = dspy.Tool(lookup_customer_tool, name="lookup_customer", desc="Look up customer account information")
         
         self.agent = dspy.ReAct(
             SkyCreditVoiceAssistant,
             tools=[self.lookup_tool]
         )
+        # Demos and instructions tuned by compile_agent.py replace the defaults. An empty
+        # program_path keeps the uncompiled program even when SKY_AGENT_PROGRAM is set.
+        if program_path is None:
+            program_path = os.getenv("SKY_AGENT_PROGRAM")
+        if program_path:
+            self.agent.load(program_path)
+            logger.info("Loaded compiled ReAct program from %s", program_path)
+        self.mode = mode
+        self.direct = dspy.Predict(DirectAnswerSignature) if mode == DIRECT_MODE else None
+        self.direct_answer = dspy.Predict(DirectLookupAnswerSignature) if mode == DIRECT_MODE else None
         
+        self.history_policy = history_policy or RollingHistoryPolicy()
+        self.metrics = metrics
+        # Per-session record of turns and LM calls, appended to logs/transcripts
+        self.transcripts = transcripts
+        # Rule-based verification turns answered without an LM call
+        self.verification = VerificationStage() if fast_verification else None
+        # Verified turns inside a scenario go to its small step-based module
+        self.orchestrator = ScenarioOrchestrator() if orchestrate_scenarios else None
+        # Background fetch of the customer record as soon as a reference or mobile is heard
+        self.prefetcher = CustomerPrefetcher() if prefetch else None
+        # Model replies to protocol-fixed states, replayed without an LM call
+        self.response_cache = response_cache
         self.state = ConversationState()
-        logger.info("MainAgent initialized with DSPy ReAct")
+        logger.info("MainAgent initialized with DSPy ReAct (%s mode)", mode)
     
-    def process_input(self, customer_input: str):
+    def process_input(self, customer_input: str, state: Optional[ConversationState] = None):
         """Process customer input"""
-        logger.info(f"Processing input: {customer_input}")
+        state = state or self.state
+        logger.info("Processing input: %s", customer_input)
         
-        # Generate response from the agent
-        result = self.agent(
-            customer_input=customer_input,
-            history=self.state.history
-        )
+        self._prefetch(state, customer_input)
+        with self._measure(state):
+            scripted = self._verification_reply(state, customer_input)
+            if scripted is not None:
+                return scripted
+            
+            if self.orchestrator is not None:
+                reply = self.orchestrator.respond(state, customer_input)
+                if reply is not None:
+                    self._append_turn(state, customer_input, reply, source="scenario")
+                    return reply
+            
+            cache_key = self.response_cache.key(state, customer_input) if self.response_cache is not None else None
+            cached = self._cached_reply(state, customer_input, cache_key)
+            if cached is not None:
+                return cached
+            
+            # Generate response from the agent
+            history = self.history_policy.build(state)
+            if self.direct is not None:
+                prediction = self.direct(customer_input=customer_input, history=history)
+                result = self._direct_result(prediction)
+                if result is None:
+                    trajectory = self._direct_lookup(prediction, self.lookup_tool(**self._lookup_args(prediction)))
+                    answer = self.direct_answer(customer_input=customer_input, history=history, lookup_result=trajectory["observation_0"])
+                    result = dspy.Prediction(response=answer.response, trajectory=trajectory)
+                return self._record_turn(state, customer_input, result, source="direct", cache_key=cache_key)
+
+            result = self.agent(customer_input=customer_input, history=history)
+            return self._record_turn(state, customer_input, result, cache_key=cache_key)
+    
+    async def aprocess_input(self, customer_input: str, state: Optional[ConversationState] = None):
+        """Process customer input on DSPy's async LM path"""
+        state = state or self.state
+        logger.info("Processing input (async): %s", customer_input)
+        
+        self._prefetch(state, customer_input)
+        with self._measure(state):
+            scripted = self._verification_reply(state, customer_input)
+            if scripted is not None:
+                return scripted
+            
+            if self.orchestrator is not None:
+                reply = await self.orchestrator.arespond(state, customer_input)
+                if reply is not None:
+                    self._append_turn(state, customer_input, reply, source="scenario")
+                    return reply
+            
+            cache_key = self.response_cache.key(state, customer_input) if self.response_cache is not None else None
+            cached = self._cached_reply(state, customer_input, cache_key)
+            if cached is not None:
+                return cached
+            
+            history = await self.history_policy.abuild(state)
+            if self.direct is not None:
+                prediction = await self.direct.acall(customer_input=customer_input, history=history)
+                result = self._direct_result(prediction)
+                if result is None:
+                    trajectory = self._direct_lookup(prediction, await self.lookup_tool.acall(**self._lookup_args(prediction)))
+                    answer = await self.direct_answer.acall(customer_input=customer_input, history=history, lookup_result=trajectory["observation_0"])
+                    result = dspy.Prediction(response=answer.response, trajectory=trajectory)
+                return self._record_turn(state, customer_input, result, source="direct", cache_key=cache_key)
 
-        logger.info(f"Generated Result: {result}")
+            result = await self.agent.acall(customer_input=customer_input, history=history)
+            return self._record_turn(state, customer_input, result, cache_key=cache_key)
+    
+    async def stream_input(self, customer_input: str, state: Optional[ConversationState] = None) -> AsyncIterator[str]:
+        """Process customer input, yielding sentence-sized chunks of the response as the LM produces them"""
+        state = state or self.state
+        logger.info("Processing input (streaming): %s", customer_input)
+        started = time.perf_counter()
+        state.last_time_to_first_chunk = None
+        
+        self._prefetch(state, customer_input)
+        with self._measure(state):
+            scripted = self._verification_reply(state, customer_input)
+            if scripted is None and self.orchestrator is not None:
+                scripted = await self.orchestrator.arespond(state, customer_input)
+                if scripted is not None:
+                    self._append_turn(state, customer_input, scripted, source="scenario")
+            cache_key = None
+            if scripted is None and self.response_cache is not None:
+                cache_key = self.response_cache.key(state, customer_input)
+                scripted = self._cached_reply(state, customer_input, cache_key)
+            if scripted is not None:
+                for chunk in SentenceChunker().split(scripted):
+                    self._mark_first_chunk(state, started)
+                    yield chunk
+                return
+            
+            history = await self.history_policy.abuild(state)
+            program, inputs, trajectory = self.agent, dict(customer_input=customer_input, history=history), None
+            if self.direct is not None:
+                # The action is only known once the direct call completes, so its answer is
+                # chunked after the fact; only the answer after a lookup is streamed
+                prediction = await self.direct.acall(**inputs)
+                result = self._direct_result(prediction)
+                if result is not None:
+                    for chunk in SentenceChunker().split(result.response):
+                        self._mark_first_chunk(state, started)
+                        yield chunk
+                    self._record_turn(state, customer_input, result, source="direct", cache_key=cache_key)
+                    return
+                trajectory = self._direct_lookup(prediction, await self.lookup_tool.acall(**self._lookup_args(prediction)))
+                program, inputs["lookup_result"] = self.direct_answer, trajectory["observation_0"]
+            
+            # Only the final response field is listened to, so thoughts, tool calls and
+            # reasoning never reach the caller. Listeners keep per-stream state, hence one per turn.
+            streaming_agent = dspy.streamify(
+                program,
+                stream_listeners=[dspy.streaming.StreamListener(signature_field_name="response")],
+                is_async_program=True
+            )
+            chunker = SentenceChunker()
+            streamed = False
+            result = None
+            async for item in streaming_agent(**inputs):
+                if isinstance(item, dspy.streaming.StreamResponse):
+                    streamed = True
+                    for chunk in chunker.feed(item.chunk):
+                        self._mark_first_chunk(state, started)
+                        yield chunk
+                elif isinstance(item, dspy.Prediction):
+                    result = item
+            if result is None:
+                raise RuntimeError(f"Streaming {type(program).__name__} ended without a final prediction; the turn was not recorded")
+            
+            # Cache hits and non-streaming LMs only deliver the final prediction
+            remaining = chunker.flush() if streamed else chunker.split(result.response)
+            for chunk in remaining:
+                self._mark_first_chunk(state, started)
+                yield chunk
+            
+            if trajectory is not None:
+                result = dspy.Prediction(response=result.response, trajectory=trajectory)
+            self._record_turn(state, customer_input, result, source="direct" if trajectory is not None else None, cache_key=cache_key)
+    
+    def _cached_reply(self, state: ConversationState, customer_input: str, cache_key: Optional[tuple]) -> Optional[str]:
+        """A cached model reply for this state, recorded like a model turn, or None"""
+        if self.response_cache is None:
+            return None
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            return None
+        logger.info("Response cache hit for %s phase", cache_key[0])
+        return self._record_turn(state, customer_input, dspy.Prediction(response=response, trajectory={}), source="cache")
+    
+    def _direct_result(self, prediction: dspy.Prediction) -> Optional[dspy.Prediction]:
+        """The turn's result when the direct call answered it, or None when it chose the lookup"""
+        if prediction.action == "lookup_customer":
+            logger.info("Direct call chose lookup_customer, calling the tool")
+            return None
+        return dspy.Prediction(response=prediction.response, trajectory={})
+    
+    def _lookup_args(self, prediction: dspy.Prediction) -> Dict[str, str]:
+        return {name: (getattr(prediction, name, None) or "").strip() for name in LOOKUP_ARGS}
+    
+    def _direct_lookup(self, prediction: dspy.Prediction, observation: str) -> dict:
+        """The direct call's lookup as a one-step ReAct trajectory, so it is pinned and
+        counted like a lookup made by the ReAct loop"""
+        return {"tool_name_0": "lookup_customer", "tool_args_0": self._lookup_args(prediction), "observation_0": observation}
+    
+    def _verification_reply(self, state: ConversationState, customer_input: str) -> Optional[str]:
+        """Answer a verification turn with a scripted question, or None to run the agent"""
+        if self.verification is None or state.verified_customer_ref:
+            return None
+        
+        reply = self.verification.respond(state.verification, customer_input)
+        summary = verification_summary(state.verification)
+        if summary:
+            state.pinned_facts["verification"] = summary
+        if reply is None:
+            return None
+        
+        logger.info("Verification fast path reply (no LM call), next slot: %s", state.verification.pending)
+        self._append_turn(state, customer_input, reply, source="verification")
+        return reply
+    
+    def _measure(self, state: ConversationState):
+        """Log and metrics context for one turn; metrics are skipped when no collector is attached"""
+        turn = len(state.history.messages) + 1
+        stack = ExitStack()
+        stack.enter_context(log_context(state.session_id, turn))
+        if self.metrics is not None:
+            stack.enter_context(self.metrics.turn(state.session_id, turn))
+        if self.transcripts is not None:
+            stack.enter_context(self.transcripts.session(state.session_id))
+        if self.prefetcher is not None:
+            stack.enter_context(self.prefetcher.scope(_prefetch_session(state)))
+        return stack
+    
+    def _prefetch(self, state: ConversationState, customer_input: str):
+        """Start fetching any customer the caller identified before the agent asks for the lookup"""
+        if self.prefetcher is not None and not state.verified_customer_ref:
+            self.prefetcher.observe(_prefetch_session(state), customer_input)
+    
+    def _mark_first_chunk(self, state: ConversationState, started: float):
+        if state.last_time_to_first_chunk is None:
+            state.last_time_to_first_chunk = time.perf_counter() - started
+            turn_metrics = current_turn()
+            if turn_metrics is not None:
+                turn_metrics.time_to_first_chunk = state.last_time_to_first_chunk
+            logger.info("Time to first chunk: %.0fms", state.last_time_to_first_chunk * 1000)
+    
+    def _record_turn(self, state: ConversationState, customer_input: str, result: dspy.Prediction,
+                     source: Optional[str] = None, cache_key: Optional[tuple] = None) -> str:
+        """Log the generated result and append the interaction to the conversation history"""
+        # Whole predictions are large, so they log at DEBUG where sampling applies, and are
+        # cut short before the message is merged on this thread
+        logger.debug("Generated Result: %s", Truncated(result))
         
         # Log if tools were used
         if hasattr(result, 'tool_outputs') and result.tool_outputs:
-            logger.info(f"🔧 DSPy Tool Used: {len(result.tool_outputs)} tool calls made")
+            logger.info("🔧 DSPy Tool Used: %d tool calls made", len(result.tool_outputs))
             for i, output in enumerate(result.tool_outputs):
-                logger.info(f"   Tool {i+1} output: {output[:100]}..." if len(output) > 100 else f"   Tool {i+1} output: {output}")
+                logger.info("   Tool %d output: %.100s", i + 1, output)
         
+        self._pin_verified_facts(state, result)
+        turn_metrics = current_turn()
+        if turn_metrics is not None:
+            turn_metrics.react_iterations = sum(1 for key in getattr(result, "trajectory", {}) if key.startswith("tool_name_"))
         response = result.response
+        if self.verification is not None and not state.verification.done:
+            self.verification.observe_response(state.verification, response, verified=state.verified_customer_ref is not None)
+        
+        trajectory = getattr(result, "trajectory", None) or {}
+        if self.response_cache is not None and cache_key is not None:
+            used_tools = any(value != "finish" for key, value in trajectory.items() if key.startswith("tool_name_"))
+            self.response_cache.store(cache_key, state, response, used_tools=used_tools)
         
-        # Add interaction to history
-        self.state.history.messages.append({
+        source = source or "react"
+        self._append_turn(state, customer_input, response, source=source)
+        return response
+    
+    def _append_turn(self, state: ConversationState, customer_input: str, response: str, source: str = "agent"):
+        """Add an interaction to the conversation history"""
+        state.history.messages.append({
             "customer_input": customer_input,
             "response": response
         })
+        if self.transcripts is not None:
+            self.transcripts.record_turn(state.session_id, len(state.history.messages), customer_input, response, source)
+        turn_metrics = current_turn()
+        if turn_metrics is not None:
+            turn_metrics.path = source
         
-        logger.info(f"DSPy History now has {len(self.state.history.messages)} messages")
-        
-        return response
+        logger.debug("DSPy History now has %d messages", len(state.history.messages))
     
-    def get_history(self):
-        """Get DSPy history as string by capturing inspect_history output"""
-        import io
-        import sys
-        from contextlib import redirect_stdout
-        
-        # Capture the printed output from dspy.inspect_history()
-        captured_output = io.StringIO()
-        with redirect_stdout(captured_output):
-            dspy.inspect_history(n=100)
-        return captured_output.getvalue()
+    def _pin_verified_facts(self, state: ConversationState, result: dspy.Prediction):
+        """Pin successful customer lookups so they survive history summarization"""
+        trajectory = getattr(result, "trajectory", None) or {}
+        for key, observation in trajectory.items():
+            if not key.startswith("observation_") or not str(observation).startswith("Customer found:"):
+                continue
+            state.pinned_facts["customer_lookup"] = str(observation)
+            state.pinned_facts.pop("verification", None)
+            match = re.search(r"\(reference (\w+)\)", str(observation))
+            if match:
+                state.verified_customer_ref = match.group(1)
+                logger.info("Verified customer %s pinned to history", state.verified_customer_ref)
+    
+    def get_history(self, state: Optional[ConversationState] = None) -> str:
+        """Recent turns and LM calls of one session as text"""
+        state = state or self.state
+        if self.transcripts is not None:
+            return format_entries(self.transcripts.recent(state.session_id))
+        return format_entries(
+            {"type": "turn", "turn": i, "customer_input": message["customer_input"], "response": message["response"]}
+            for i, message in enumerate(state.history.messages, start=1)
+        )
+    
+    def end_session(self, state: Optional[ConversationState] = None) -> None:
+        """Drop what the agent keeps for a finished call, such as its prefetched customers"""
+        state = state or self.state
+        if self.prefetcher is not None:
+            self.prefetcher.end_session(_prefetch_session(state))
+    
+    def close(self) -> None:
+        """Stop the agent's background threads; the agent takes no more turns afterwards"""
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+    
+    def __enter__(self) -> "MainAgent":
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,324 @@
+"""
+Per-turn metrics for Sky Credit Voice Assistant
+MetricsCollector is a DSPy callback that records LM calls, token usage, tool latency and
+ReAct iterations for every turn, and hands each finished TurnMetrics to registered hooks.
+JsonlExporter, PrometheusExporter and BargeInStats are ready-made hooks.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+_current_turn: contextvars.ContextVar[Optional["TurnMetrics"]] = contextvars.ContextVar("current_turn", default=None)
+
+@dataclass
+class LMCallMetrics:
+    model: str
+    latency: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    error: Optional[str] = None
+
+@dataclass
+class ToolCallMetrics:
+    name: str
+    latency: float
+    error: Optional[str] = None
+
+@dataclass
+class TurnMetrics:
+    session_id: Optional[str]
+    turn: int
+    started_at: float = field(default_factory=time.time)
+    latency: float = 0.0
+    # How the turn was answered: verification, scenario, cache, direct or react
+    path: Optional[str] = None
+    react_iterations: int = 0
+    # Cancelled because the caller spoke again before the reply was ready
+    interrupted: bool = False
+    # Seconds to the first chunk of a streamed reply, None when the turn was not streamed
+    time_to_first_chunk: Optional[float] = None
+    lm_calls: List[LMCallMetrics] = field(default_factory=list)
+    tool_calls: List[ToolCallMetrics] = field(default_factory=list)
+
+    @property
+    def lm_call_count(self) -> int:
+        return len(self.lm_calls)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call.prompt_tokens for call in self.lm_calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(call.completion_tokens for call in self.lm_calls)
+
+    @property
+    def lm_latency(self) -> float:
+        return sum(call.latency for call in self.lm_calls)
+
+    @property
+    def tool_latency(self) -> float:
+        return sum(call.latency for call in self.tool_calls)
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        record.update(
+            lm_call_count=self.lm_call_count,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            lm_latency=self.lm_latency,
+            tool_latency=self.tool_latency,
+        )
+        return record
+
+def current_turn() -> Optional[TurnMetrics]:
+    """The turn being measured in the current context, if any"""
+    return _current_turn.get()
+
+class MetricsCollector(BaseCallback):
+    """Collects TurnMetrics through DSPy callbacks and publishes them to hooks"""
+
+    def __init__(self):
+        self.hooks: List[Callable[[TurnMetrics], None]] = []
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[TurnMetrics], None]) -> None:
+        """Register a function called with every finished TurnMetrics"""
+        self.hooks.append(hook)
+
+    @contextmanager
+    def turn(self, session_id: Optional[str], turn: int):
+        """Measure one agent turn. Callbacks and usage tracking are scoped to this context."""
+        metrics = TurnMetrics(session_id=session_id, turn=turn)
+        token = _current_turn.set(metrics)
+        started = time.perf_counter()
+        try:
+            with dspy.track_usage(), dspy.context(callbacks=[*dspy.settings.callbacks, self]):
+                yield metrics
+        except asyncio.CancelledError:
+            metrics.interrupted = True
+            raise
+        finally:
+            metrics.latency = time.perf_counter() - started
+            _current_turn.reset(token)
+            for hook in self.hooks:
+                hook(metrics)
+
+    def on_lm_start(self, call_id, instance, inputs):
+        usage = dspy.settings.usage_tracker
+        before = _token_totals(usage) if usage else (0, 0)
+        with self._lock:
+            self._pending[call_id] = (time.perf_counter(), getattr(instance, "model", "unknown"), before, current_turn())
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        with self._lock:
+            pending = self._pending.pop(call_id, None)
+        if pending is None:
+            return
+        started, model, before, turn = pending
+        if turn is None:
+            return
+        # Calls inside a turn run one after another, so the tracker delta is this call's usage
+        usage = dspy.settings.usage_tracker
+        after = _token_totals(usage) if usage else before
+        turn.lm_calls.append(LMCallMetrics(
+            model=model,
+            latency=time.perf_counter() - started,
+            prompt_tokens=after[0] - before[0],
+            completion_tokens=after[1] - before[1],
+            error=str(exception) if exception else None,
+        ))
+
+    def on_tool_start(self, call_id, instance, inputs):
+        with self._lock:
+            self._pending[call_id] = (time.perf_counter(), getattr(instance, "name", "unknown"), None, current_turn())
+
+    def on_tool_end(self, call_id, outputs, exception=None):
+        with self._lock:
+            pending = self._pending.pop(call_id, None)
+        if pending is None or pending[3] is None:
+            return
+        started, name, _, turn = pending
+        turn.tool_calls.append(ToolCallMetrics(
+            name=name,
+            latency=time.perf_counter() - started,
+            error=str(exception) if exception else None,
+        ))
+
+def _token_totals(tracker) -> tuple:
+    prompt = completion = 0
+    for usage in tracker.get_total_tokens().values():
+        prompt += usage.get("prompt_tokens") or 0
+        completion += usage.get("completion_tokens") or 0
+    return prompt, completion
+
+class JsonlExporter:
+    """Hook appending one JSON line per turn"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, metrics: TurnMetrics) -> None:
+        line = json.dumps(metrics.to_dict())
+        with self.lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+# Histogram bucket upper bounds; an observation above the last lands in the +Inf bucket
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+class PrometheusExporter:
+    """Hook aggregating turns into Prometheus histograms.
+
+    Bucket counts are cumulative since start, so the server computes quantiles with
+    histogram_quantile() over any time range and can aggregate them across processes.
+    """
+
+    METRICS = {
+        "turn_latency_seconds": ("Wall time of an agent turn", LATENCY_BUCKETS),
+        "turn_time_to_first_chunk_seconds": ("Time to the first streamed chunk of a reply", LATENCY_BUCKETS),
+        "turn_lm_calls": ("LM calls per turn", COUNT_BUCKETS),
+        "turn_react_iterations": ("ReAct iterations per turn", COUNT_BUCKETS),
+        "turn_prompt_tokens": ("Prompt tokens per turn", TOKEN_BUCKETS),
+        "turn_completion_tokens": ("Completion tokens per turn", TOKEN_BUCKETS),
+        "lm_call_latency_seconds": ("Latency of a single LM call", LATENCY_BUCKETS),
+        "tool_latency_seconds": ("Latency of a single tool call", LATENCY_BUCKETS),
+    }
+
+    def __init__(self, prefix: str = "sky_agent", buckets: Optional[Dict[str, tuple]] = None):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.buckets = {name: bounds for name, (_, bounds) in self.METRICS.items()}
+        self.buckets.update(buckets or {})
+        # Per series, observations per bucket (not cumulative), the last one being +Inf
+        self.bucket_counts: Dict[tuple, List[int]] = {}
+        self.counts: Dict[tuple, int] = {}
+        self.sums: Dict[tuple, float] = {}
+
+    def _observe(self, name: str, value: float, labels: tuple = ()):
+        key = (name, labels)
+        bounds = self.buckets[name]
+        if key not in self.bucket_counts:
+            self.bucket_counts[key] = [0] * (len(bounds) + 1)
+            self.counts[key] = 0
+            self.sums[key] = 0.0
+        self.bucket_counts[key][bisect.bisect_left(bounds, value)] += 1
+        self.counts[key] += 1
+        self.sums[key] += value
+
+    def __call__(self, metrics: TurnMetrics) -> None:
+        with self.lock:
+            # Split by answer path so direct and ReAct turns can be compared
+            path = (("path", "interrupted" if metrics.interrupted else metrics.path),) if metrics.path or metrics.interrupted else ()
+            self._observe("turn_latency_seconds", metrics.latency, path)
+            if metrics.time_to_first_chunk is not None:
+                self._observe("turn_time_to_first_chunk_seconds", metrics.time_to_first_chunk, path)
+            self._observe("turn_lm_calls", metrics.lm_call_count, path)
+            self._observe("turn_react_iterations", metrics.react_iterations)
+            self._observe("turn_prompt_tokens", metrics.prompt_tokens)
+            self._observe("turn_completion_tokens", metrics.completion_tokens)
+            for call in metrics.lm_calls:
+                self._observe("lm_call_latency_seconds", call.latency, (("model", call.model),))
+            for call in metrics.tool_calls:
+                self._observe("tool_latency_seconds", call.latency, (("tool", call.name),))
+
+    def render(self) -> str:
+        """Render all series in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, (help_text, _) in self.METRICS.items():
+                keys = [key for key in self.bucket_counts if key[0] == name]
+                if not keys:
+                    continue
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for key in keys:
+                    labels = key[1]
+                    cumulative = 0
+                    for bound, count in zip(self.buckets[name], self.bucket_counts[key]):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {self.counts[key]}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {self.sums[key]}")
+                    lines.append(f"{metric}_count{_labels(labels)} {self.counts[key]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Serve /metrics from a background thread"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+class BargeInStats:
+    """Hook accounting for turns cancelled by barge-in. Tokens of LM calls that finished before
+    the cancellation are wasted; the tokens saved are estimated as the mean of finished agent
+    turns minus what the cancelled turn had already spent."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interrupted_turns = 0
+        self.wasted_tokens = 0
+        self.saved_tokens = 0.0
+        self.wasted_seconds = 0.0
+        self._finished_turns = 0
+        self._finished_tokens = 0
+
+    def __call__(self, metrics: TurnMetrics) -> None:
+        tokens = metrics.prompt_tokens + metrics.completion_tokens
+        with self.lock:
+            if metrics.interrupted:
+                self.interrupted_turns += 1
+                self.wasted_tokens += tokens
+                self.wasted_seconds += metrics.latency
+                if self._finished_turns:
+                    self.saved_tokens += max(0.0, self._finished_tokens / self._finished_turns - tokens)
+            elif metrics.lm_calls:
+                self._finished_turns += 1
+                self._finished_tokens += tokens
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "interrupted_turns": self.interrupted_turns,
+                "wasted_tokens": self.wasted_tokens,
+                "saved_tokens": round(self.saved_tokens),
+                "wasted_seconds": self.wasted_seconds,
+            }
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
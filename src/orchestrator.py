@@ -0,0 +1,202 @@
+"""
+Scenario orchestrator for Sky Credit Voice Assistant
+Holds per-session scenario state and routes each turn of a verified call to the active
+step-based module in scenarios.py, which has a much smaller prompt than the monolithic
+SkyCreditVoiceAssistant signature. The main agent is only used for routing and closing.
+A module asking for a transfer ends its scenario: the customer is told they are being put
+through to the hardship team, and the rest of the call goes to the main agent.
+
+Run `python -m src.orchestrator` for a prompt-size comparison.
+"""
+
+import asyncio
+import dspy
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger_config import get_logger
+logger = get_logger("orchestrator")
+
+from .db import get_customer_store
+from .history_policy import format_turns
+from .scenarios import (
+    AccountBalanceModule,
+    ArrearsManagementModule,
+    BankingUpdateModule,
+    HardshipAssistanceModule,
+    PaymentDeferralModule,
+)
+
+TRANSFER_REPLY = "I'll now transfer you to our hardship team, who can go through the support options with you."
+TRANSFER_FACT = "The customer is being transferred to the hardship team"
+
+# Checked in order, so the more specific scenarios win over a plain balance check
+SCENARIO_KEYWORDS = {
+    "hardship": ("hardship", "lost my job", "can't afford", "cannot afford", "struggling", "unemployed", "illness", "sick"),
+    "deferral": ("defer", "push back", "push my payment", "move my payment", "delay my payment", "extension", "later date", "change my payment date"),
+    "banking": ("bank details", "bank account", "direct debit", "changed banks", "new bank", "switch banks"),
+    "arrears": ("arrears", "behind on", "overdue", "catch up", "missed payment", "missed a payment"),
+    "balance": ("balance", "how much do i owe", "what do i owe", "next payment"),
+}
+
+@dataclass
+class ScenarioState:
+    """Scenario progress for one call"""
+    active: Optional[str] = None
+    step: int = 1
+    completed: List[str] = field(default_factory=list)
+    intent_routed: bool = False
+    needs_transfer: bool = False
+
+def route_scenario(text: Optional[str]) -> Optional[str]:
+    """Pick the scenario a customer utterance asks for, if any"""
+    if not text:
+        return None
+    lowered = text.lower()
+    for name, keywords in SCENARIO_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            return name
+    return None
+
+class ScenarioOrchestrator:
+    """Runs verified turns through the step-based scenario modules"""
+
+    def __init__(self):
+        self.modules = {
+            "balance": AccountBalanceModule(),
+            "arrears": ArrearsManagementModule(),
+            "deferral": PaymentDeferralModule(),
+            "hardship": HardshipAssistanceModule(),
+            "banking": BankingUpdateModule(),
+        }
+
+    def select(self, state, customer_input: str) -> Optional[str]:
+        """Activate a scenario for this turn if one applies, returning its name"""
+        if not state.verified_customer_ref or state.scenario.needs_transfer:
+            return None
+        scenario = state.scenario
+        if scenario.active is None:
+            name = route_scenario(customer_input)
+            # The reason for calling was heard during verification, use it once
+            if name is None and not scenario.intent_routed:
+                name = route_scenario(state.verification.intent)
+            scenario.intent_routed = True
+            if name is None or name in scenario.completed:
+                return None
+            scenario.active = name
+            scenario.step = 1
+            logger.info("Routing session %s to scenario %s", state.session_id, name)
+        return scenario.active
+
+    def respond(self, state, customer_input: str) -> Optional[str]:
+        """Run the active scenario module, or return None to use the main agent"""
+        name = self.select(state, customer_input)
+        if name is None:
+            return None
+        module = self.modules[name]
+        result = module(**self._module_inputs(state, name, customer_input))
+        return self._advance(state, name, result)
+
+    async def arespond(self, state, customer_input: str) -> Optional[str]:
+        """Async variant of respond"""
+        name = self.select(state, customer_input)
+        if name is None:
+            return None
+        # The scenario modules are synchronous; contextvars (DSPy settings, metrics) follow into the thread
+        module = self.modules[name]
+        result = await asyncio.to_thread(module, **self._module_inputs(state, name, customer_input))
+        return self._advance(state, name, result)
+
+    def _module_inputs(self, state, name: str, customer_input: str) -> Dict:
+        customer = get_customer_store().get_by_reference(state.verified_customer_ref)
+        customer_data = customer.model_dump() if customer else {}
+        if name == "balance":
+            recent = state.history.messages[-4:]
+            return {
+                "customer_data": customer_data,
+                "customer_input": customer_input,
+                "conversation_history": format_turns(recent),
+            }
+        return {"customer_data": customer_data, "step": state.scenario.step, "customer_response": customer_input}
+
+    def _advance(self, state, name: str, result: Dict) -> str:
+        scenario = state.scenario
+        if result.get("needs_transfer"):
+            return self._transfer(state, name, result["response"])
+
+        if result.get("scenario_complete"):
+            scenario.completed.append(name)
+            scenario.active = None
+            logger.info("Scenario %s complete for session %s", name, state.session_id)
+            # A balance check can reveal that the customer needs to move the payment
+            if result.get("needs_deferral") and "deferral" not in scenario.completed:
+                scenario.active = "deferral"
+                scenario.step = 1
+        elif "next_step" in result:
+            try:
+                scenario.step = int(result["next_step"])
+            except (TypeError, ValueError):
+                scenario.step += 1
+        return result["response"]
+
+    def _transfer(self, state, name: str, response: str) -> str:
+        """End the scenario for a transfer to the hardship team, making sure the reply says so"""
+        scenario = state.scenario
+        scenario.needs_transfer = True
+        scenario.completed.append(name)
+        scenario.active = None
+        state.pinned_facts["transfer"] = TRANSFER_FACT
+        logger.info("Scenario %s asked for a transfer to the hardship team for session %s", name, state.session_id)
+        if "transfer" in response.lower():
+            return response
+        return f"{response} {TRANSFER_REPLY}"
+
+def _count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except Exception:
+        from .history_policy import estimate_tokens
+        return estimate_tokens(text)
+
+def _prompt_tokens(predictor, inputs: Dict) -> int:
+    messages = dspy.ChatAdapter().format(predictor.signature, demos=predictor.demos, inputs=inputs)
+    return _count_tokens("\n".join(message["content"] for message in messages))
+
+def prompt_token_report(history_turns: int = 6) -> Dict[str, int]:
+    """Prompt tokens of one LM call for the main ReAct agent versus each scenario module"""
+    from .main_agent import MainAgent
+    from .db import CUSTOMER_DATABASE
+
+    customer_data = CUSTOMER_DATABASE["XT59591"].model_dump()
+    turns = [
+        {"customer_input": "I'd like to split the arrears over my next few payments.", "response": "Certainly, I can help with that. Let me go through the options with you."}
+    ] * history_turns
+    main_agent = MainAgent(fast_verification=False, prefetch=False)
+    report = {
+        "main_agent_react_step": _prompt_tokens(main_agent.agent.react, {
+            "customer_input": "Yes, please split it.",
+            "history": dspy.History(messages=turns),
+            "trajectory": "",
+        }),
+        "main_agent_extract_step": _prompt_tokens(main_agent.agent.extract.predict, {
+            "customer_input": "Yes, please split it.",
+            "history": dspy.History(messages=turns),
+            "trajectory": "",
+        }),
+    }
+    orchestrator = ScenarioOrchestrator()
+    for name, module in orchestrator.modules.items():
+        predictor = module.predictors()[0]
+        if name == "balance":
+            inputs = {"customer_data": str(customer_data), "customer_input": "What is my balance?", "conversation_history": format_turns(turns[-4:])}
+        else:
+            inputs = {"customer_data": str(customer_data), "step_number": 3, "customer_response": "Yes, please split it."}
+        report[f"scenario_{name}"] = _prompt_tokens(predictor, inputs)
+    return report
+
+if __name__ == "__main__":
+    for name, tokens in prompt_token_report().items():
+        print(f"{name:<28} {tokens:>6} prompt tokens")
@@ -0,0 +1,119 @@
+"""
+Speculative customer prefetch for Sky Credit Voice Assistant
+As soon as a reference number or mobile is heard, the candidate records are fetched from
+the customer store on a background thread. When the agent later calls lookup_customer,
+the tool only checks the names against the prefetched candidates instead of making a
+second backend round trip on the most latency-sensitive turn.
+
+Prefetches belong to a session and are cancelled and evicted when the call ends. The
+prefetcher's threads are stopped by shutdown(), which MainAgent.close() calls.
+"""
+
+import contextvars
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger_config import get_logger
+logger = get_logger("prefetch")
+
+from .db import Customer, lookup_candidates, normalize_mobile, normalize_reference
+from .verification import parse_mobile, parse_reference
+
+# Longest the tool waits for a prefetch still in flight before doing its own lookup
+PREFETCH_WAIT = 2.0
+
+REFERENCE_FORM = re.compile(r"[A-Z]{2}\d{5}")
+
+_active: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("prefetch_scope", default=None)
+
+def prefetch_key(reference_or_mobile: str) -> Optional[str]:
+    """Normalized key shared by the prefetch and the tool's reference_or_mobile argument"""
+    reference = normalize_reference(reference_or_mobile)
+    if REFERENCE_FORM.fullmatch(reference):
+        return reference
+    return normalize_mobile(reference_or_mobile)
+
+class CustomerPrefetcher:
+    """Per-session background lookups of customers mentioned in the caller's words"""
+
+    def __init__(self, max_workers: int = 4):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.sessions: Dict[str, Dict[str, Future]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def observe(self, session_id: str, customer_input: str) -> List[str]:
+        """Start prefetches for any reference or mobile in the input, returning their keys"""
+        keys = []
+        for parser in (parse_reference, parse_mobile):
+            parsed = parser(customer_input)
+            if parsed:
+                keys.append(prefetch_key(parsed[0]))
+
+        started = []
+        with self._lock:
+            futures = self.sessions.setdefault(session_id, {})
+            for key in keys:
+                if key and key not in futures:
+                    # Materialize the lazy candidates so the backend work happens now
+                    futures[key] = self.pool.submit(lambda k=key: list(lookup_candidates(k)))
+                    started.append(key)
+        for key in started:
+            logger.info("Prefetching customer %s for session %s", key, session_id)
+        return started
+
+    def candidates(self, session_id: str, reference_or_mobile: str, timeout: float = PREFETCH_WAIT) -> Optional[List[Customer]]:
+        """Prefetched candidates for the lookup, or None when nothing usable was prefetched"""
+        key = prefetch_key(reference_or_mobile)
+        with self._lock:
+            future = self.sessions.get(session_id, {}).get(key)
+        if future is None:
+            self.misses += 1
+            return None
+        try:
+            result = future.result(timeout=timeout)
+        except Exception as e:
+            logger.warning("Prefetch of %s unusable, looking up directly: %s", key, e)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    @contextmanager
+    def scope(self, session_id: str):
+        """Make this session's prefetches visible to lookup_customer_tool"""
+        token = _active.set((self, session_id))
+        try:
+            yield
+        finally:
+            _active.reset(token)
+
+    def end_session(self, session_id: str) -> int:
+        """Cancel pending prefetches of a finished call and evict its records, returning the number cancelled"""
+        with self._lock:
+            futures = self.sessions.pop(session_id, {})
+        cancelled = sum(1 for future in futures.values() if future.cancel())
+        if futures:
+            logger.info("Evicted %d prefetches for session %s (%d cancelled)", len(futures), session_id, cancelled)
+        return cancelled
+
+    def shutdown(self) -> None:
+        with self._lock:
+            sessions = list(self.sessions)
+        for session_id in sessions:
+            self.end_session(session_id)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def prefetched_candidates(reference_or_mobile: str) -> Optional[List[Customer]]:
+    """Candidates prefetched for the session of the current turn, if any"""
+    active = _active.get()
+    if active is None:
+        return None
+    prefetcher, session_id = active
+    return prefetcher.candidates(session_id, reference_or_mobile)
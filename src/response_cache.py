@@ -0,0 +1,136 @@
+"""
+State-keyed response cache for Sky Credit Voice Assistant
+Much of what the assistant says is fixed by the protocol: the greeting, the verification
+questions, the closing lines. The cache remembers the model's reply for a conversation state
+(phase, verification slots still missing, the assistant's previous line and the caller's
+words, both with the caller's details masked) and serves it the next time that state comes
+up, without an LM call.
+
+Caching is opt-in per phase. Lookups and scenario turns always go to the model, and replies
+that mention the caller's details or any figure are never stored.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+GREETING = "greeting"
+VERIFICATION = "verification"
+LOOKUP = "lookup"
+CLOSING = "closing"
+SCENARIO = "scenario"
+CACHEABLE_PHASES = (GREETING, VERIFICATION, CLOSING)
+
+CLOSING_QUESTION = "anything else"
+CUSTOMER_FOUND = re.compile(r"Customer found: (\S+) (\S+)")
+WORD = re.compile(r"[a-z']+|\d")
+
+def conversation_phase(state) -> str:
+    """Phase of the call the next reply belongs to"""
+    messages = state.history.messages
+    if not messages:
+        return GREETING
+    if state.verified_customer_ref is None:
+        return LOOKUP if state.verification.complete else VERIFICATION
+    if CLOSING_QUESTION in messages[-1]["response"].lower():
+        return CLOSING
+    return SCENARIO
+
+def _personal_values(state) -> list:
+    values = [value for value in state.verification.collected().values() if value]
+    match = CUSTOMER_FOUND.search(state.pinned_facts.get("customer_lookup", ""))
+    if match:
+        values.extend(match.groups())
+    return [value.lower() for value in values]
+
+def normalize_input(text: str, personal_values: Iterable[str] = ()) -> str:
+    """Lowercased words with the caller's details masked and digits collapsed"""
+    lowered = text.lower()
+    for value in sorted(personal_values, key=len, reverse=True):
+        lowered = lowered.replace(value, " <detail> ")
+    words = WORD.findall(lowered.replace("<detail>", " detail "))
+    normalized = []
+    for word in words:
+        token = "#" if word.isdigit() else word
+        if not (token == "#" and normalized and normalized[-1] == "#"):
+            normalized.append(token)
+    return " ".join(normalized)
+
+def cache_key(state, customer_input: str) -> Tuple[str, tuple, str, str]:
+    # The previous line tells what a bare "yes" or "no" answers
+    messages = state.history.messages
+    personal = _personal_values(state)
+    return (
+        conversation_phase(state),
+        tuple(state.verification.missing()),
+        normalize_input(messages[-1]["response"], personal) if messages else "",
+        normalize_input(customer_input, personal),
+    )
+
+class ResponseCache:
+    """LRU cache of replies by conversation state, with a time to live and hit-rate counters"""
+
+    def __init__(self, phases: Iterable[str] = CACHEABLE_PHASES, max_entries: int = 1024, ttl: float = 3600.0):
+        self.phases = frozenset(phases)
+        unsupported = self.phases - set(CACHEABLE_PHASES)
+        if unsupported:
+            raise ValueError(f"Phases {sorted(unsupported)} always need the model; cacheable phases are {CACHEABLE_PHASES}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[tuple, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, state, customer_input: str) -> Optional[tuple]:
+        """The cache key of this turn, or None when its phase is not cached"""
+        key = cache_key(state, customer_input)
+        return key if key[0] in self.phases else None
+
+    def get(self, key: Optional[tuple]) -> Optional[str]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def store(self, key: Optional[tuple], state, response: str, used_tools: bool = False) -> bool:
+        """Remember a model reply for the state it answered, unless it is specific to this caller"""
+        if key is None or used_tools or not response or any(char.isdigit() for char in response):
+            return False
+        lowered = response.lower()
+        if any(value in lowered for value in _personal_values(state)):
+            return False
+        with self._lock:
+            self.entries[key] = (response, time.monotonic())
+            self.entries.move_to_end(key)
+            self.stores += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate, "stores": self.stores, "evictions": self.evictions,
+            }
@@ -0,0 +1,224 @@
+"""
+Session manager for Sky Credit Voice Assistant
+Serves many concurrent calls from one process by keeping a ConversationState per session id
+and running every turn on DSPy's async LM path. With a session store, every turn starts from
+the stored state and saves its changes, so turns of one call can go to any process.
+
+Callers talk over the assistant. When a new input arrives for a session whose previous turn
+is still running, that turn is cancelled, aborting its in-flight LM call, and its changes to
+the session are rolled back. The interrupted words are then merged into the new input or
+discarded, per the barge-in policy.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger_config import get_logger, log_context
+logger = get_logger("session_manager")
+
+from .main_agent import MainAgent, ConversationState
+from .metrics import BargeInStats
+from .session_store import SessionStore, get_session_store
+
+# What happens to the words of an interrupted turn
+MERGE = "merge"
+DISCARD = "discard"
+BARGE_IN_POLICIES = (MERGE, DISCARD)
+
+class TurnInterrupted(Exception):
+    """Raised to the caller of a turn cancelled because a newer input arrived for its session"""
+
+@dataclass
+class InflightTurn:
+    task: asyncio.Task
+    customer_input: str
+    interrupted: bool = False
+
+class SessionManager:
+    """Routes turns from many live calls to one shared MainAgent program"""
+
+    def __init__(self, agent: Optional[MainAgent] = None, max_inflight_lm: int = 64, store: Optional[SessionStore] = None,
+                 barge_in: str = MERGE):
+        if barge_in not in BARGE_IN_POLICIES:
+            raise ValueError(f"barge_in must be one of {BARGE_IN_POLICIES}, got {barge_in!r}")
+        # The ReAct program holds no per-call state, so every session shares it
+        self.agent = agent or MainAgent()
+        self.max_inflight_lm = max_inflight_lm
+        self.store = store if store is not None else get_session_store()
+        self.barge_in = barge_in
+        # Token accounting needs the agent's per-turn metrics
+        self.barge_in_stats = BargeInStats()
+        if self.agent.metrics is not None:
+            self.agent.metrics.add_hook(self.barge_in_stats)
+        self.sessions: Dict[str, ConversationState] = {}
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._inflight: Dict[str, InflightTurn] = {}
+        self._interrupt_locks: Dict[str, asyncio.Lock] = {}
+        # A turn issues its LM calls one after another, so one slot per running
+        # turn bounds the number of in-flight LM requests for the process
+        self._lm_slots = asyncio.Semaphore(max_inflight_lm)
+        logger.info("SessionManager initialized (max_inflight_lm=%d)", max_inflight_lm)
+
+    def get_state(self, session_id: str) -> ConversationState:
+        """Get the conversation state for a session, creating it on first use"""
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = self._open(session_id, self.store.load(session_id) if self.store is not None else None)
+        return state
+
+    def _open(self, session_id: str, stored: Optional[ConversationState]) -> ConversationState:
+        """Start serving a session in this process, resumed from the store's copy if there is one"""
+        if stored is None:
+            state = ConversationState(session_id=session_id)
+            logger.info("Session %s started (%d active)", session_id, len(self.sessions) + 1)
+        else:
+            state = stored
+            logger.info("Session %s resumed from the session store (%d turns)", session_id, len(state.history.messages))
+        self.sessions[session_id] = state
+        self._session_locks.setdefault(session_id, asyncio.Lock())
+        return state
+
+    async def process_input(self, session_id: str, customer_input: str) -> str:
+        """Process one customer turn for the given session. A still running earlier turn of
+        the session is cancelled first, and its caller gets TurnInterrupted."""
+        with log_context(session_id):
+            inflight = await self._begin(session_id, customer_input, lambda words: self._answer(session_id, words))
+            try:
+                return await self._outcome(inflight)
+            finally:
+                self._finish(session_id, inflight)
+
+    async def _answer(self, session_id: str, customer_input: str) -> str:
+        async with self._turn(session_id) as state:
+            return await self.agent.aprocess_input(customer_input, state=state)
+
+    async def stream_input(self, session_id: str, customer_input: str) -> AsyncIterator[str]:
+        """Process one customer turn, yielding sentence-sized response chunks for TTS.
+        Barge-in applies as in process_input; closing the stream early also cancels the turn."""
+        with log_context(session_id):
+            chunks: asyncio.Queue = asyncio.Queue()
+
+            async def produce(words: str):
+                try:
+                    async with self._turn(session_id) as state:
+                        async for chunk in self.agent.stream_input(words, state=state):
+                            chunks.put_nowait(chunk)
+                finally:
+                    chunks.put_nowait(None)
+
+            inflight = await self._begin(session_id, customer_input, produce)
+            try:
+                while (chunk := await chunks.get()) is not None:
+                    yield chunk
+                await self._outcome(inflight)
+            finally:
+                if not inflight.task.done():
+                    inflight.task.cancel()
+                self._finish(session_id, inflight)
+
+    async def _begin(self, session_id: str, customer_input: str, turn: Callable[[str], Awaitable]) -> InflightTurn:
+        """Interrupt the session's running turn, then start `turn` on the input it should answer.
+
+        One input at a time per session: a third input arriving while the second still waits
+        for the first to roll back must find the second in flight, or both would run."""
+        async with self._interrupt_locks.setdefault(session_id, asyncio.Lock()):
+            customer_input = await self._interrupt(session_id, customer_input)
+            return self._start(session_id, customer_input, turn(customer_input))
+
+    def _start(self, session_id: str, customer_input: str, turn) -> InflightTurn:
+        # The turn runs in its own task so a barge-in can cancel it without cancelling the caller
+        inflight = InflightTurn(asyncio.ensure_future(turn), customer_input)
+        self._inflight[session_id] = inflight
+        return inflight
+
+    def _finish(self, session_id: str, inflight: InflightTurn) -> None:
+        if self._inflight.get(session_id) is inflight:
+            del self._inflight[session_id]
+
+    async def _outcome(self, inflight: InflightTurn):
+        try:
+            return await inflight.task
+        except asyncio.CancelledError:
+            if inflight.interrupted:
+                raise TurnInterrupted(f"Interrupted by a newer input: {inflight.customer_input!r}") from None
+            raise
+
+    async def _interrupt(self, session_id: str, customer_input: str) -> str:
+        """Cancel the session's running turn, returning the input the new turn should answer"""
+        inflight = self._inflight.get(session_id)
+        if inflight is None or inflight.task.done():
+            return customer_input
+        inflight.interrupted = True
+        inflight.task.cancel()
+        # Wait for the rollback without taking on the cancelled turn's outcome
+        await asyncio.wait([inflight.task])
+        if not inflight.task.cancelled():
+            # It finished before the cancellation reached it, so its reply stands
+            return customer_input
+        logger.info("Barge-in on session %s: cancelled the turn for %r, input %sd", session_id, inflight.customer_input, self.barge_in)
+        if self.agent.transcripts is not None:
+            self.agent.transcripts.append(session_id, {
+                "type": "interrupted", "customer_input": inflight.customer_input, "policy": self.barge_in,
+            })
+        if self.barge_in == MERGE:
+            return f"{inflight.customer_input} {customer_input}"
+        return customer_input
+
+    @asynccontextmanager
+    async def _turn(self, session_id: str):
+        """The session's state for one turn, current with the session store and saved after it.
+        Store reads and writes run in a worker thread, off the event loop serving other calls."""
+        # Turns of the same call must apply to the history in order
+        async with self._session_locks.setdefault(session_id, asyncio.Lock()):
+            state = self.sessions.get(session_id)
+            if self.store is not None:
+                # Another process may have served the previous turn
+                stored = await asyncio.to_thread(self.store.load, session_id, cached=state)
+                if state is None:
+                    state = self._open(session_id, stored)
+                elif stored is not None:
+                    state = self.sessions[session_id] = stored
+            elif state is None:
+                state = self._open(session_id, None)
+            snapshot = state.to_dict()
+            try:
+                async with self._lm_slot(state):
+                    yield state
+            except asyncio.CancelledError:
+                # Nothing of a cancelled turn is kept: its words go to the next turn or are dropped
+                state.restore(snapshot)
+                raise
+            finally:
+                if self.store is not None:
+                    await asyncio.to_thread(self.store.save, state)
+
+    @asynccontextmanager
+    async def _lm_slot(self, state: ConversationState):
+        """Hold one of the process's LM slots, recording the wait on the state"""
+        waited = time.perf_counter()
+        async with self._lm_slots:
+            state.last_lm_queue_wait = time.perf_counter() - waited
+            yield
+
+    def end_session(self, session_id: str) -> Optional[ConversationState]:
+        """Drop a finished call and return its final state"""
+        self._session_locks.pop(session_id, None)
+        self._interrupt_locks.pop(session_id, None)
+        state = self.sessions.pop(session_id, None)
+        if self.store is not None:
+            self.store.delete(session_id)
+        if state is not None:
+            if self.agent.transcripts is not None:
+                self.agent.transcripts.close(session_id)
+            self.agent.end_session(state)
+            logger.info("Session %s ended (%d active)", session_id, len(self.sessions))
+        return state
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self.sessions)
@@ -0,0 +1,267 @@
+"""
+Session stores for Sky Credit Voice Assistant
+Keep ConversationState outside the worker process, so any worker can serve any turn of a call
+and a restarted worker does not drop live calls. A session is stored as a small state record
+(verification slots, scenario step, verified customer, summary) plus its history messages,
+one row or key per message. History only grows, so a save appends the new messages and
+rewrites the state record only when it changed, and a load of a session this process already
+holds reads only what another process added since.
+
+SKY_SESSION_STORE selects the backend for SessionManager: a path ending in .db for SQLite,
+which any number of processes can share, or any other path for a local dbm file, which
+survives restarts but is opened by one process at a time.
+"""
+
+import dbm
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger_config import get_logger
+logger = get_logger("session_store")
+
+from .main_agent import ConversationState
+
+SQLITE_SUFFIX = ".db"
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+class SessionStore(ABC):
+    """Interface for session persistence. Backends implement _read, _write and delete."""
+
+    # Whether processes sharing the store see each other's writes, so any of them can serve a session
+    shareable = True
+
+    def __init__(self):
+        # Per session: the state record and message count last read or written here, and the
+        # state object they belong to
+        self._saved: Dict[str, Tuple[str, int, weakref.ref]] = {}
+        self.bytes_written = 0
+
+    @abstractmethod
+    def _read(self, session_id: str, start: int) -> Optional[Tuple[str, int, List[dict]]]:
+        """(state record, message count, messages from index `start`), or None for an unknown session"""
+
+    @abstractmethod
+    def _write(self, session_id: str, record: Optional[str], start: int, messages: List[str]) -> None:
+        """Store the record (None leaves it as is) and the messages from index `start`,
+        dropping any stored messages after them"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    def load(self, session_id: str, cached: Optional[ConversationState] = None) -> Optional[ConversationState]:
+        """Current state of a session, or None if it is not stored.
+
+        `cached` is this process's copy from an earlier load or save; only what was stored
+        after it is read, and it is returned as is when nothing changed.
+        """
+        known = self._saved.get(session_id)
+        if known is not None and (cached is None or known[2]() is not cached):
+            known = None
+        start = known[1] if known else 0
+        loaded = self._read(session_id, start)
+        if loaded is None:
+            self._saved.pop(session_id, None)
+            return None
+        record, count, messages = loaded
+        if known and count < start:
+            # The stored history was rewritten elsewhere, so the cached prefix is stale
+            return self.load(session_id)
+        if known and record == known[0] and count == start:
+            return cached
+        data = json.loads(record)
+        data["history"] = (cached.history.messages[:start] if known else []) + messages
+        state = ConversationState.from_dict(data)
+        self._saved[session_id] = (record, count, weakref.ref(state))
+        return state
+
+    def save(self, state: ConversationState) -> None:
+        """Write what changed in the session since it was last loaded or saved here"""
+        data = state.to_dict()
+        messages = data.pop("history")
+        record = _dumps(data)
+        saved_record, saved_count, saved_state = self._saved.get(state.session_id, (None, 0, None))
+        if saved_state is None or saved_state() is not state:
+            # Not the copy this store last wrote or read, so rewrite the whole session
+            saved_record, saved_count = None, 0
+        start = saved_count if len(messages) >= saved_count else 0
+        if record == saved_record and start == len(messages):
+            return
+        new_messages = [_dumps(message) for message in messages[start:]]
+        changed_record = record if record != saved_record else None
+        self._write(state.session_id, changed_record, start, new_messages)
+        self._saved[state.session_id] = (record, len(messages), weakref.ref(state))
+        self.bytes_written += len(changed_record or "") + sum(len(message) for message in new_messages)
+
+    def forget(self, session_id: str) -> None:
+        """Drop this process's bookkeeping for a session without deleting it from the store"""
+        self._saved.pop(session_id, None)
+
+    def close(self) -> None:
+        pass
+
+# As with the SQLite customer store, forked children must not reuse the parent's connection
+_sqlite_stores: "weakref.WeakSet[SQLiteSessionStore]" = weakref.WeakSet()
+
+def _reset_sqlite_connections() -> None:
+    for store in list(_sqlite_stores):
+        store._local = threading.local()
+
+os.register_at_fork(after_in_child=_reset_sqlite_connections)
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite database in WAL mode, shareable by worker processes on one host"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, record TEXT NOT NULL, message_count INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS session_messages ("
+        "session_id TEXT NOT NULL, idx INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (session_id, idx)) WITHOUT ROWID",
+    )
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        _sqlite_stores.add(self)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            # A crash can lose the last turns written, but never corrupts the database
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, session_id: str, start: int) -> Optional[Tuple[str, int, List[dict]]]:
+        conn = self._connection()
+        row = conn.execute("SELECT record, message_count FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        record, count = row
+        messages = [json.loads(message) for (message,) in conn.execute(
+            "SELECT message FROM session_messages WHERE session_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+            (session_id, start, count),
+        )]
+        return record, count, messages
+
+    def _write(self, session_id: str, record: Optional[str], start: int, messages: List[str]) -> None:
+        count = start + len(messages)
+        with self._connection() as conn:
+            if record is not None:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, record, message_count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET record = excluded.record, message_count = excluded.message_count",
+                    (session_id, record, count),
+                )
+            else:
+                conn.execute("UPDATE sessions SET message_count = ? WHERE session_id = ?", (count, session_id))
+            conn.execute("DELETE FROM session_messages WHERE session_id = ? AND idx >= ?", (session_id, start))
+            conn.executemany(
+                "INSERT INTO session_messages (session_id, idx, message) VALUES (?, ?, ?)",
+                [(session_id, start + i, message) for i, message in enumerate(messages)],
+            )
+
+    def delete(self, session_id: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+        self.forget(session_id)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class DbmSessionStore(SessionStore):
+    """Sessions in a local dbm key-value file: `<id>` holds the state record and message count,
+    `<id>:<index>` each history message. The file is reopened after a fork.
+
+    Not shareable: a dbm handle does not see what another process's handle wrote (dbm.dumb
+    keeps its index in memory), and concurrent writers overwrite each other's index."""
+
+    shareable = False
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def _handle(self):
+        if self._db is None or self._pid != os.getpid():
+            self._db = dbm.open(self.path, "c")
+            self._pid = os.getpid()
+        return self._db
+
+    def _read(self, session_id: str, start: int) -> Optional[Tuple[str, int, List[dict]]]:
+        with self._lock:
+            db = self._handle()
+            head = db.get(session_id)
+            if head is None:
+                return None
+            count, record = head.decode().split(" ", 1)
+            count = int(count)
+            messages = [json.loads(db[f"{session_id}:{i}"]) for i in range(start, count)]
+        return record, count, messages
+
+    def _write(self, session_id: str, record: Optional[str], start: int, messages: List[str]) -> None:
+        with self._lock:
+            db = self._handle()
+            head = db.get(session_id)
+            old_count, old_record = head.decode().split(" ", 1) if head is not None else (0, "")
+            for i, message in enumerate(messages):
+                db[f"{session_id}:{start + i}"] = message
+            count = start + len(messages)
+            for i in range(count, int(old_count)):
+                del db[f"{session_id}:{i}"]
+            # Written last, so a reader never sees a count covering messages not yet stored
+            db[session_id] = f"{count} {record if record is not None else old_record}"
+            if hasattr(db, "sync"):
+                db.sync()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            db = self._handle()
+            head = db.get(session_id)
+            if head is not None:
+                count = int(head.decode().split(" ", 1)[0])
+                del db[session_id]
+                for i in range(count):
+                    del db[f"{session_id}:{i}"]
+        self.forget(session_id)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+def open_session_store(path: str) -> SessionStore:
+    """SQLite store for a .db path, dbm store for any other path"""
+    if path.endswith(SQLITE_SUFFIX):
+        return SQLiteSessionStore(path)
+    return DbmSessionStore(path)
+
+def get_session_store() -> Optional[SessionStore]:
+    """Session store configured by SKY_SESSION_STORE, or None to keep sessions in process memory"""
+    path = os.getenv("SKY_SESSION_STORE")
+    if not path:
+        return None
+    logger.info("Using session store %s", path)
+    return open_session_store(path)
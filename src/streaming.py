@@ -0,0 +1,46 @@
+"""
+Streaming helpers for Sky Credit Voice Assistant
+Turns the token stream of the response field into sentence-sized chunks for TTS.
+"""
+
+import re
+from typing import List
+
+# A sentence ends at . ! or ? followed by whitespace, so amounts like $1491.06 stay whole
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+class SentenceChunker:
+    """Buffers streamed text and releases it one sentence at a time"""
+
+    def __init__(self, min_chars: int = 20):
+        # Very short sentences ("Sure.") are merged with the next one to avoid choppy audio
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text and return any sentences that are now complete"""
+        self.buffer += text
+        parts = SENTENCE_END.split(self.buffer)
+        # The last part has no terminating whitespace yet, keep it buffered
+        self.buffer = parts.pop()
+
+        chunks = []
+        pending = ""
+        for part in parts:
+            pending = f"{pending} {part}" if pending else part
+            if len(pending) >= self.min_chars:
+                chunks.append(pending)
+                pending = ""
+        if pending:
+            self.buffer = f"{pending} {self.buffer}"
+        return chunks
+
+    def flush(self) -> List[str]:
+        """Return whatever is left once the field has finished streaming"""
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        return [remainder] if remainder else []
+
+    def split(self, text: str) -> List[str]:
+        """Chunk a complete response, used when the LM answered without streaming"""
+        return self.feed(text) + self.flush()
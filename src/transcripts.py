@@ -0,0 +1,164 @@
+"""
+Per-session transcript store for Sky Credit Voice Assistant
+Every session keeps a bounded ring buffer of its turns and LM calls in memory and appends
+each entry to logs/transcripts/<session_id>.jsonl as it happens. LM calls are captured
+through a DSPy callback scoped to the session's turn, so concurrent sessions never mix.
+
+Readers stream the JSONL files line by line; iter_transcript(path, follow=True) tails a
+live call until its session_end entry is written.
+"""
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, IO, Iterator, List, Optional
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+DEFAULT_SESSION = "default"
+
+_current_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("transcript_session", default=None)
+
+def _file_name(session_id: str) -> str:
+    return re.sub(r"[^\w.\-]", "_", session_id) + ".jsonl"
+
+def iter_transcript(path: str, follow: bool = False, poll_interval: float = 0.25) -> Iterator[dict]:
+    """Yield the entries of a transcript file.
+
+    With follow=True keep waiting for new lines, like `tail -f`, until the session_end entry.
+    """
+    while follow and not os.path.exists(path):
+        time.sleep(poll_interval)
+    with open(path) as f:
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                if not follow:
+                    return
+                time.sleep(poll_interval)
+                continue
+            # A writer may be half way through a line
+            if not line.endswith("\n"):
+                partial += line
+                continue
+            entry = json.loads(partial + line)
+            partial = ""
+            yield entry
+            if entry.get("type") == "session_end":
+                return
+
+def format_entries(entries) -> str:
+    """Render transcript entries as readable text"""
+    lines = []
+    for entry in entries:
+        kind = entry.get("type")
+        if kind == "turn":
+            lines.append(f"--- Turn {entry['turn']} ({entry.get('source', 'agent')}) ---")
+            lines.append(f"Customer: {entry['customer_input']}")
+            lines.append(f"Assistant: {entry['response']}")
+        elif kind == "lm_call":
+            lines.append(f"--- LM call {entry['model']} ({entry['latency'] * 1000:.0f}ms) ---")
+            for message in entry.get("messages") or []:
+                lines.append(f"[{message.get('role')}]\n{message.get('content')}")
+            for output in entry.get("outputs") or []:
+                lines.append(f"[response]\n{output}")
+            if entry.get("error"):
+                lines.append(f"[error] {entry['error']}")
+        elif kind == "interrupted":
+            lines.append(f"--- Turn interrupted, input {entry.get('policy', 'discard')}d ---")
+            lines.append(f"Customer: {entry['customer_input']}")
+        elif kind == "session_end":
+            lines.append("--- Session ended ---")
+    return "\n".join(lines)
+
+class TranscriptStore(BaseCallback):
+    """Ring-buffered per-session transcripts, appended to disk as JSONL"""
+
+    def __init__(self, directory: str = "logs/transcripts", max_entries: int = 200):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.buffers: Dict[str, Deque[dict]] = {}
+        self._files: Dict[str, IO] = {}
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, session_id: Optional[str]) -> str:
+        return os.path.join(self.directory, _file_name(session_id or DEFAULT_SESSION))
+
+    @contextmanager
+    def session(self, session_id: Optional[str]):
+        """Record the LM calls made in this context against the session"""
+        token = _current_session.set(session_id or DEFAULT_SESSION)
+        try:
+            with dspy.context(callbacks=[*dspy.settings.callbacks, self]):
+                yield
+        finally:
+            _current_session.reset(token)
+
+    def append(self, session_id: Optional[str], entry: dict) -> None:
+        """Add an entry to the session's ring buffer and its JSONL file"""
+        session_id = session_id or DEFAULT_SESSION
+        entry = {"ts": time.time(), **entry}
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            buffer = self.buffers.get(session_id)
+            if buffer is None:
+                buffer = self.buffers[session_id] = deque(maxlen=self.max_entries)
+                self._files[session_id] = open(self.path(session_id), "a")
+            buffer.append(entry)
+            f = self._files[session_id]
+            f.write(line)
+            f.flush()
+
+    def record_turn(self, session_id: Optional[str], turn: int, customer_input: str, response: str, source: str) -> None:
+        self.append(session_id, {"type": "turn", "turn": turn, "source": source, "customer_input": customer_input, "response": response})
+
+    def recent(self, session_id: Optional[str], n: Optional[int] = None) -> List[dict]:
+        """The newest buffered entries of a live session"""
+        with self._lock:
+            entries = list(self.buffers.get(session_id or DEFAULT_SESSION, ()))
+        return entries[-n:] if n else entries
+
+    def read(self, session_id: Optional[str], follow: bool = False) -> Iterator[dict]:
+        """Stream the full transcript of a session from disk"""
+        return iter_transcript(self.path(session_id), follow=follow)
+
+    def close(self, session_id: Optional[str]) -> None:
+        """Mark the session ended and release its buffer and file"""
+        session_id = session_id or DEFAULT_SESSION
+        if session_id not in self.buffers:
+            return
+        self.append(session_id, {"type": "session_end"})
+        with self._lock:
+            self.buffers.pop(session_id, None)
+            self._files.pop(session_id).close()
+
+    def on_lm_start(self, call_id, instance, inputs):
+        session_id = _current_session.get()
+        if session_id is None:
+            return
+        with self._lock:
+            self._pending[call_id] = (time.perf_counter(), session_id, getattr(instance, "model", "unknown"), inputs.get("messages"), inputs.get("prompt"))
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        with self._lock:
+            pending = self._pending.pop(call_id, None)
+        if pending is None:
+            return
+        started, session_id, model, messages, prompt = pending
+        self.append(session_id, {
+            "type": "lm_call",
+            "model": model,
+            "latency": time.perf_counter() - started,
+            "messages": messages or ([{"role": "user", "content": prompt}] if prompt else []),
+            "outputs": outputs,
+            "error": str(exception) if exception else None,
+        })
@@ -0,0 +1,267 @@
+"""
+Identity verification fast path for Sky Credit Voice Assistant
+Rule-based slot filling for the MANDATORY VERIFICATION step of SkyCreditVoiceAssistant.
+Scripted questions are asked without an LM call; the turn is handed to the ReAct agent
+when the input is ambiguous or once every slot has been collected.
+"""
+
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from .db import normalize_mobile, normalize_reference
+from .fuzzy_match import parse_spoken_reference
+
+GREETING = (
+    "Thank you for calling the Sky Credit Group. My name is Jess, an automated AI voice assistant. "
+    "Can I please have your name, and find out how I can assist you today?"
+)
+
+SLOT_ORDER = ["reference_or_mobile", "first_name", "last_name", "date_of_birth"]
+
+QUESTIONS = {
+    "reference_or_mobile": "To verify your identity, can I please have your customer reference number? If you don't have it, your mobile number is fine.",
+    "first_name": "Can I please have your first name?",
+    "last_name": "And can I please have your last name?",
+    "date_of_birth": "And can I please have your date of birth?",
+}
+
+INTENT_KEYWORDS = (
+    "balance", "payment", "pay", "arrears", "behind", "owe", "overdue", "defer", "extension", "hardship",
+    "lost my job", "struggling", "bank", "direct debit", "account", "portal", "login", "log in", "password",
+    "letter", "update",
+)
+
+GREETING_WORDS = {"hello", "hi", "hey", "hiya", "morning", "afternoon", "evening", "good", "there", "g'day", "gday"}
+
+FILLER_WORDS = {
+    "it's", "its", "it", "is", "my", "name", "names", "first", "last", "surname", "the", "sure", "yes", "yeah",
+    "yep", "ok", "okay", "um", "uh", "umm", "thanks", "thank", "you", "i'm", "im", "i", "am", "called", "please",
+    "so", "well", "and", "that's", "thats", "hi", "hello", "of", "course", "no", "problem", "sorry", "oh", "right",
+    "this", "here", "speaking",
+}
+
+NAME_SLOTS = ("first_name", "last_name")
+
+MONTHS = {
+    name: index
+    for index, names in enumerate(
+        [("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+         ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+         ("november", "nov"), ("december", "dec")],
+        start=1,
+    )
+    for name in names
+}
+
+REFERENCE_PATTERN = re.compile(r"(?<![A-Za-z])([A-Za-z])[\s\-]?([A-Za-z])[\s\-]?(\d(?:[\s\-]?\d){4})(?!\d)")
+MOBILE_PATTERN = re.compile(r"(?<!\d)(\+?\d[\d\s\-]{7,16}\d)(?!\d)")
+DATE_PATTERNS = [
+    (re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?([A-Za-z]+),?\s+(\d{4})\b"), ("day", "month", "year")),
+    (re.compile(r"\b([A-Za-z]+)\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b"), ("month", "day", "year")),
+    (re.compile(r"\b(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})\b"), ("year", "month", "day")),
+    (re.compile(r"\b(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4})\b"), ("day", "month", "year")),
+]
+MY_NAME_PATTERN = re.compile(r"\b(?:my name is|my name's)\s+([A-Za-z'\-]+)(?:\s+([A-Za-z'\-]+))?", re.IGNORECASE)
+FIRST_NAME_PATTERN = re.compile(r"\bfirst name(?: is|'s)?\s+([A-Za-z'\-]+)", re.IGNORECASE)
+LAST_NAME_PATTERN = re.compile(r"\b(?:last name|surname)(?: is|'s)?\s+([A-Za-z'\-]+)", re.IGNORECASE)
+
+@dataclass
+class VerificationSlots:
+    """Verification progress for one call"""
+    reference_or_mobile: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    date_of_birth: Optional[str] = None
+    intent: Optional[str] = None
+    pending: Optional[str] = None
+    greeted: bool = False
+    done: bool = False
+
+    def missing(self) -> List[str]:
+        return [slot for slot in SLOT_ORDER if getattr(self, slot) is None]
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing()
+
+    def collected(self) -> Dict[str, str]:
+        return {slot: getattr(self, slot) for slot in SLOT_ORDER if getattr(self, slot) is not None}
+
+def parse_reference(text: str) -> Optional[tuple]:
+    """Find a reference number like XT59591, also when spelled out as "X T 5 9 5 9 1" or read
+    in words as "x-ray tango five nine five nine one". Returns (value, span)."""
+    match = REFERENCE_PATTERN.search(text)
+    if not match:
+        return parse_spoken_reference(text)
+    return normalize_reference("".join(match.groups())), match.span()
+
+def parse_mobile(text: str) -> Optional[tuple]:
+    """Find a mobile number and return it in E.164 form with its span"""
+    for match in MOBILE_PATTERN.finditer(text):
+        digits = re.sub(r"\D", "", match.group(1))
+        if 9 <= len(digits) <= 12 and (match.group(1).startswith(("+", "0")) or digits.startswith("61")):
+            return normalize_mobile(match.group(1)), match.span()
+    return None
+
+def parse_date_of_birth(text: str) -> Optional[tuple]:
+    """Find a date of birth and return it as an ISO date with its span"""
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(order, match.groups()))
+            month = parts["month"]
+            month = MONTHS.get(month.lower()) if month.isalpha() else int(month)
+            if not month:
+                continue
+            try:
+                date = datetime.date(int(parts["year"]), month, int(parts["day"]))
+            except ValueError:
+                continue
+            return date.isoformat(), match.span()
+    return None
+
+def _remove_span(text: str, span: tuple) -> str:
+    return text[:span[0]] + " " + text[span[1]:]
+
+def _name_tokens(text: str) -> List[str]:
+    return [word for word in re.findall(r"[A-Za-z][A-Za-z'\-]*", text) if word.lower() not in FILLER_WORDS]
+
+class VerificationStage:
+    """Collects verification slots with rule-based parsers in front of the ReAct agent"""
+
+    def respond(self, slots: VerificationSlots, customer_input: str) -> Optional[str]:
+        """Return a scripted reply, or None to hand the turn to the ReAct agent"""
+        if slots.done:
+            return None
+
+        filled = self.extract(slots, customer_input)
+
+        # A question from the caller needs the model
+        if "?" in customer_input:
+            return self._hand_off(slots)
+
+        if not slots.greeted:
+            slots.greeted = True
+            has_intent = self._capture_intent(slots, customer_input)
+            if not filled and not has_intent:
+                if self._is_greeting(customer_input):
+                    slots.pending = "intent"
+                    return GREETING
+                return self._hand_off(slots)
+            return self._ask_next(slots, prefix=GREETING.split(" Can I")[0] + " ")
+
+        if slots.pending == "intent" and not filled:
+            if not self._capture_intent(slots, customer_input):
+                return self._hand_off(slots)
+        elif slots.pending not in filled and not (slots.pending == "intent" or filled):
+            # We asked for something (or the agent did) and could not parse the answer
+            return self._hand_off(slots)
+
+        return self._ask_next(slots)
+
+    def extract(self, slots: VerificationSlots, customer_input: str) -> List[str]:
+        """Fill any slots found in the input, returning the names of the slots filled"""
+        filled = []
+        text = customer_input
+
+        for slot, parser in (("date_of_birth", parse_date_of_birth), ("reference_or_mobile", parse_reference), ("reference_or_mobile", parse_mobile)):
+            if slot in filled:
+                continue
+            parsed = parser(text)
+            if parsed:
+                setattr(slots, slot, parsed[0])
+                filled.append(slot)
+                text = _remove_span(text, parsed[1])
+
+        match = MY_NAME_PATTERN.search(text)
+        if match:
+            names = [name for name in match.groups() if name and name.lower() not in FILLER_WORDS]
+            filled.extend(self._fill_names(slots, names))
+            return filled
+        for pattern, slot in ((FIRST_NAME_PATTERN, "first_name"), (LAST_NAME_PATTERN, "last_name")):
+            match = pattern.search(text)
+            if match:
+                setattr(slots, slot, match.group(1))
+                filled.append(slot)
+        if "first_name" in filled or "last_name" in filled:
+            return filled
+
+        # Bare answers to a name question, e.g. "It's Paul" or "Paul Walshe"
+        if slots.pending in NAME_SLOTS and not filled:
+            tokens = _name_tokens(text)
+            if slots.pending == "first_name" and len(tokens) in (1, 2):
+                slots.first_name = tokens[0]
+                filled.append("first_name")
+                if len(tokens) == 2:
+                    slots.last_name = tokens[1]
+                    filled.append("last_name")
+            elif slots.pending == "last_name" and len(tokens) == 1:
+                slots.last_name = tokens[0]
+                filled.append("last_name")
+        return filled
+
+    def _fill_names(self, slots: VerificationSlots, names: List[str]) -> List[str]:
+        """Fill name slots from "my name is ..." answers. A full name fills both; a single name
+        goes to the name slot that was asked for, or to the first name before any was asked."""
+        if len(names) >= 2:
+            slots.first_name, slots.last_name = names[0], names[1]
+            return list(NAME_SLOTS)
+        if not names:
+            return []
+        if slots.pending in NAME_SLOTS:
+            slot = slots.pending
+        elif slots.first_name is None:
+            slot = "first_name"
+        else:
+            return []
+        setattr(slots, slot, names[0])
+        return [slot]
+
+    def _capture_intent(self, slots: VerificationSlots, customer_input: str) -> bool:
+        lowered = customer_input.lower()
+        if any(keyword in lowered for keyword in INTENT_KEYWORDS):
+            slots.intent = customer_input
+            return True
+        return False
+
+    def _is_greeting(self, customer_input: str) -> bool:
+        words = re.findall(r"[a-z']+", customer_input.lower())
+        return 0 < len(words) <= 4 and all(word in GREETING_WORDS for word in words)
+
+    def _ask_next(self, slots: VerificationSlots, prefix: str = "Thank you. ") -> Optional[str]:
+        missing = slots.missing()
+        if not missing:
+            # Verification is complete, the agent looks the customer up
+            slots.done = True
+            return self._hand_off(slots)
+        slots.pending = missing[0]
+        return prefix + QUESTIONS[missing[0]]
+
+    def _hand_off(self, slots: VerificationSlots) -> None:
+        slots.pending = None
+        return None
+
+    def observe_response(self, slots: VerificationSlots, response: str, verified: bool = False) -> None:
+        """Track what the agent asked after a handed-off turn so the fast path can resume"""
+        if verified or slots.complete:
+            slots.done = True
+            return
+        lowered = response.lower()
+        for slot, keywords in (
+            ("date_of_birth", ("date of birth", "birthday")),
+            ("last_name", ("last name", "surname")),
+            ("first_name", ("first name",)),
+            ("reference_or_mobile", ("reference number", "mobile number")),
+        ):
+            if any(keyword in lowered for keyword in keywords):
+                slots.pending = slot
+                return
+
+def verification_summary(slots: VerificationSlots) -> Optional[str]:
+    """Pinned fact telling the agent which details were collected by the fast path"""
+    collected = slots.collected()
+    if not collected:
+        return None
+    details = ", ".join(f"{slot.replace('_', ' ')}: {value}" for slot, value in collected.items())
+    return f"Verification details collected from the customer: {details}"
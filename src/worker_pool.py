@@ -0,0 +1,326 @@
+"""
+Pre-warmed MainAgent worker pool for Sky Credit Voice Assistant
+The parent process imports dspy, builds the MainAgent program, opens the customer store and
+primes the prompt formatting caches once, then freezes the GC and forks workers that share
+all of it copy-on-write. A new call is assigned to the least busy worker and stays there, so
+its first turn runs on an agent that is already initialized. With a session store, sessions
+are not pinned: each turn goes to the worker with the fewest turns in flight, which loads the
+session from the store and saves it back. The store must be shareable between processes,
+so SQLite, not dbm. A worker that dies is replaced: the turns it had in flight fail, and the
+calls pinned to it start again on the new worker. Each worker logs to its own file, e.g.
+logs/app.<pid>.log.
+
+Run `python -m src.worker_pool` for a startup-time report with the import cost per module.
+"""
+
+import gc
+import itertools
+import multiprocessing
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import dspy
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger_config import get_logger, stop_logging
+logger = get_logger("worker_pool")
+
+from .db import get_customer_store
+from .main_agent import ConversationState, MainAgent
+from .prefetch import CustomerPrefetcher
+from .session_store import SessionStore
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def warm_agent(agent_factory: Callable[[], MainAgent] = MainAgent) -> MainAgent:
+    """Build an agent and touch everything its first turn would otherwise initialize"""
+    agent = agent_factory()
+    get_customer_store()
+    adapter = dspy.ChatAdapter()
+    history = dspy.History(messages=[{"customer_input": "Hello", "response": "Hi, how can I help?"}])
+    for predictor in agent.agent.predictors():
+        adapter.format(predictor.signature, demos=predictor.demos, inputs={
+            "customer_input": "Hello", "history": history, "trajectory": "",
+        })
+    return agent
+
+def _worker_main(index: int, agent: MainAgent, requests, results, store: Optional[SessionStore] = None) -> None:
+    # Thread pools do not survive fork, so the prefetcher's pool is rebuilt in the child
+    if agent.prefetcher is not None:
+        agent.prefetcher = CustomerPrefetcher()
+    states: Dict[str, ConversationState] = {}
+    results.put(("ready", index, os.getpid()))
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, command, session_id, text = message
+        try:
+            if command == "turn":
+                if store is not None:
+                    states[session_id] = store.load(session_id, cached=states.get(session_id)) or ConversationState(session_id=session_id)
+                state = states.setdefault(session_id, ConversationState(session_id=session_id))
+                try:
+                    response = agent.process_input(text, state=state)
+                finally:
+                    if store is not None:
+                        store.save(state)
+                results.put((request_id, "ok", response))
+            elif command == "end":
+                states.pop(session_id, None)
+                if store is not None:
+                    store.forget(session_id)
+                if agent.prefetcher is not None:
+                    agent.prefetcher.end_session(session_id)
+                results.put((request_id, "ok", None))
+        except Exception as e:
+            logger.error("Worker %d failed on session %s: %s", index, session_id, e)
+            results.put((request_id, "error", repr(e)))
+    agent.close()
+    stop_logging()
+
+class WorkerPool:
+    """Forked workers sharing one pre-built MainAgent, with sessions pinned to a worker"""
+
+    def __init__(self, workers: int = 4, agent_factory: Callable[[], MainAgent] = MainAgent, store: Optional[SessionStore] = None,
+                 ready_timeout: float = 60.0, check_interval: float = 1.0):
+        if store is not None and not store.shareable:
+            raise ValueError(f"{type(store).__name__} cannot be shared by worker processes; use a SQLite session store")
+        self.workers = workers
+        self.agent_factory = agent_factory
+        self.store = store
+        # Seconds the workers have to report ready, and between liveness checks once they have
+        self.ready_timeout = ready_timeout
+        self.check_interval = check_interval
+        self.respawns = 0
+        self.processes: List[multiprocessing.Process] = []
+        self.startup: Dict[str, float] = {}
+        self._context = multiprocessing.get_context("fork")
+        self._requests = []
+        self._results = None
+        self._futures: Dict[int, tuple] = {}
+        self._ready: Dict[int, int] = {}
+        self._all_ready = threading.Event()
+        self._assignments: Dict[str, int] = {}
+        self._load = [0] * workers
+        self._inflight = [0] * workers
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader: Optional[threading.Thread] = None
+        self._agent: Optional[MainAgent] = None
+        self._stopping = False
+
+    def start(self) -> "WorkerPool":
+        started = time.perf_counter()
+        self._agent = warm_agent(self.agent_factory)
+        self.startup["warm_parent_s"] = time.perf_counter() - started
+
+        # Objects that exist now are never collected, so GC passes in the workers do not
+        # touch (and copy) the pages they live on
+        gc.collect()
+        gc.freeze()
+
+        self._results = self._context.Queue()
+        forked = time.perf_counter()
+        for index in range(self.workers):
+            requests, process = self._spawn(index)
+            self._requests.append(requests)
+            self.processes.append(process)
+        gc.unfreeze()
+
+        self._reader = threading.Thread(target=self._read_results, name="worker-pool-results", daemon=True)
+        self._reader.start()
+        while not self._all_ready.wait(timeout=min(self.check_interval, 0.1)):
+            dead = [process for process in self.processes if not process.is_alive()]
+            if dead or time.perf_counter() - forked > self.ready_timeout:
+                self.stop()
+                if dead:
+                    raise RuntimeError(f"Worker {dead[0].name} exited with code {dead[0].exitcode} before it was ready")
+                raise TimeoutError(f"Workers not ready after {self.ready_timeout:.0f}s: {len(self._ready)} of {self.workers}")
+        self.startup["fork_to_ready_s"] = time.perf_counter() - forked
+        logger.info("WorkerPool ready: %d workers, parent warm-up %.2fs, fork to ready %.3fs",
+                    self.workers, self.startup["warm_parent_s"], self.startup["fork_to_ready_s"])
+        return self
+
+    def _spawn(self, index: int) -> tuple:
+        requests = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main, args=(index, self._agent, requests, self._results, self.store), name=f"agent-worker-{index}", daemon=True,
+        )
+        process.start()
+        return requests, process
+
+    def _check_workers(self) -> None:
+        """Replace workers that died, failing the turns they had in flight"""
+        if self._stopping or not self._all_ready.is_set():
+            return
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            logger.error("Worker %d (pid %s) exited with code %s, respawning it", index, process.pid, process.exitcode)
+            # Forked outside the lock: the child must not inherit it held
+            requests, replacement = self._spawn(index)
+            with self._lock:
+                self._requests[index], self.processes[index] = requests, replacement
+                lost = [request_id for request_id, (_, worker) in self._futures.items() if worker == index]
+                futures = [self._futures.pop(request_id)[0] for request_id in lost]
+                self._inflight[index] = 0
+                # Calls pinned to the dead worker lost their state with it
+                for session_id in [session_id for session_id, worker in self._assignments.items() if worker == index]:
+                    del self._assignments[session_id]
+                self._load[index] = 0
+                self.respawns += 1
+            for future in futures:
+                future.set_exception(RuntimeError(f"Worker {index} exited with code {process.exitcode}"))
+
+    def _read_results(self) -> None:
+        checked = time.perf_counter()
+        while True:
+            if time.perf_counter() - checked >= self.check_interval:
+                self._check_workers()
+                checked = time.perf_counter()
+            try:
+                message = self._results.get(timeout=self.check_interval)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            if message[0] == "ready":
+                self._ready[message[1]] = message[2]
+                if len(self._ready) == self.workers:
+                    self._all_ready.set()
+                continue
+            request_id, status, payload = message
+            with self._lock:
+                future, index = self._futures.pop(request_id, (None, None))
+                if index is not None:
+                    self._inflight[index] -= 1
+            if future is None:
+                continue
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _worker_for(self, session_id: str) -> int:
+        with self._lock:
+            if self.store is not None:
+                return min(range(self.workers), key=self._inflight.__getitem__)
+            index = self._assignments.get(session_id)
+            if index is None:
+                index = min(range(self.workers), key=self._load.__getitem__)
+                self._assignments[session_id] = index
+                self._load[index] += 1
+            return index
+
+    def _submit(self, index: int, command: str, session_id: str, text: Optional[str] = None) -> Future:
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._futures[request_id] = (future, index)
+            self._inflight[index] += 1
+            # Under the lock, so a turn never goes to the queue of a worker being replaced
+            self._requests[index].put((request_id, command, session_id, text))
+        return future
+
+    def submit(self, session_id: str, customer_input: str) -> Future:
+        """Queue one customer turn on the session's worker"""
+        return self._submit(self._worker_for(session_id), "turn", session_id, customer_input)
+
+    def process_input(self, session_id: str, customer_input: str, timeout: Optional[float] = None) -> str:
+        """Process one customer turn and wait for the response"""
+        return self.submit(session_id, customer_input).result(timeout=timeout)
+
+    def end_session(self, session_id: str) -> None:
+        """Drop a finished call from its worker, or from every worker and the store"""
+        if self.store is not None:
+            for index in range(self.workers):
+                self._submit(index, "end", session_id).result()
+            self.store.delete(session_id)
+            return
+        with self._lock:
+            index = self._assignments.pop(session_id, None)
+            if index is not None:
+                self._load[index] -= 1
+        if index is not None:
+            self._submit(index, "end", session_id).result()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._results is not None:
+            self._results.put(None)
+            self._reader.join(timeout)
+        if self._agent is not None:
+            self._agent.close()
+
+    def __enter__(self) -> "WorkerPool":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+def import_time_report(module: str = "src.main_agent", top: int = 15) -> Dict[str, list]:
+    """Import cost of `module` in a fresh interpreter, from `python -X importtime`.
+
+    Returns the slowest modules by cumulative time and the total self time per top-level package.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    packages: Dict[str, int] = {}
+    for name, self_us, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return {
+        "slowest_modules": sorted(((name, cumulative) for name, _, cumulative in modules), key=lambda item: -item[1])[:top],
+        "packages": sorted(packages.items(), key=lambda item: -item[1])[:top],
+        "total_us": sum(self_us for _, self_us, _ in modules),
+    }
+
+def cold_start_seconds() -> float:
+    """Seconds for a fresh interpreter to import and build a ready MainAgent"""
+    code = (
+        "import time; started = time.perf_counter(); "
+        "from src.worker_pool import warm_agent; warm_agent(); "
+        "print(time.perf_counter() - started)"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return float(completed.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    report = import_time_report()
+    print(f"Import of src.main_agent: {report['total_us'] / 1e6:.2f}s\n")
+    print("Self time by top-level package:")
+    for package, self_us in report["packages"]:
+        print(f"  {package:<32} {self_us / 1000:>9.1f}ms")
+    print("\nSlowest modules (cumulative):")
+    for name, cumulative_us in report["slowest_modules"]:
+        print(f"  {name:<48} {cumulative_us / 1000:>9.1f}ms")
+
+    print(f"\nCold start to a ready agent: {cold_start_seconds():.2f}s")
+    with WorkerPool(workers=2) as pool:
+        print(f"Pool parent agent build (imports already loaded): {pool.startup['warm_parent_s']:.2f}s")
+        print(f"Fork to {pool.workers} ready workers: {pool.startup['fork_to_ready_s'] * 1000:.0f}ms")
@@ -0,0 +1,348 @@
+"""
+Offline stub LM for benchmarks and load tests
+Answers any DSPy ChatAdapter prompt with well-formed placeholder values for the requested
+output fields, after an optional simulated latency. ReAct steps always choose `finish`, so
+a turn costs one ReAct step plus one extract call, the same as a direct answer in production.
+The direct-answer mode's `action` field likewise answers `respond`. The exception is the
+first step after the verification fast path has collected every slot: the stub then calls
+lookup_customer with the collected details (in direct mode, by filling the lookup fields),
+so simulated calls reach the scenario modules.
+
+StubLMServer serves the same completions over an OpenAI-compatible HTTP endpoint, with a
+latency distribution, an error rate and a concurrency limit, so the real dspy.LM client
+path can be load tested. With a batch size it instead serves requests in batches, like a
+self-hosted inference server.
+
+Usage:
+    dspy.configure(lm=StubLM(latency=0.05))
+    python stub_lm.py --port 8011 --latency lognormal:0.4:0.5 --error-rate 0.01
+    python stub_lm.py --port 8011 --latency fixed:0.3 --batch-size 16 --batch-cost 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import queue
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import dspy
+
+OUTPUT_SECTION = re.compile(r"Your output fields are:\n(.*?)(?:\n\n|\nAll interactions)", re.DOTALL)
+OUTPUT_FIELD = re.compile(r"^\d+\. `(\w+)` \(([^)]*)\)", re.MULTILINE)
+
+LITERAL_OPTION = re.compile(r"Literal\['([^']*)'")
+
+VERIFICATION_DETAILS = re.compile(
+    r"reference or mobile: ([^,]+), first name: ([^,]+), last name: ([^,]+), date of birth: [^\s,]+"
+)
+
+DEFAULT_RESPONSE = "Thank you. Is there anything else I can help you with today?"
+
+def output_fields(system_prompt: str) -> list:
+    """(name, type) pairs of the output fields a ChatAdapter system prompt asks for"""
+    section = OUTPUT_SECTION.search(system_prompt)
+    if not section:
+        return [("response", "str")]
+    return OUTPUT_FIELD.findall(section.group(1))
+
+def lookup_args(messages: list):
+    """Arguments for lookup_customer when a ReAct step or direct call starts with verification complete"""
+    if "lookup_customer" not in messages[0]["content"] or "observation_0" in str(messages[-1].get("content", "")):
+        return None
+    # The collected details are pinned as call context in the rendered history
+    match = VERIFICATION_DETAILS.search("\n".join(str(message.get("content", "")) for message in messages))
+    if not match:
+        return None
+    reference_or_mobile, first_name, last_name = (group.strip() for group in match.groups())
+    return {"reference_or_mobile": reference_or_mobile, "first_name": first_name, "last_name": last_name}
+
+def placeholder(name: str, type_name: str, response: str = DEFAULT_RESPONSE, tool_args=None) -> str:
+    if name == "next_tool_name":
+        return "lookup_customer" if tool_args else "finish"
+    if name == "next_tool_args":
+        return json.dumps(tool_args or {})
+    if name == "action":
+        return "lookup_customer" if tool_args else "respond"
+    if tool_args and name in tool_args:
+        return tool_args[name]
+    if type_name.startswith("Literal["):
+        return LITERAL_OPTION.search(type_name).group(1)
+    if type_name == "bool":
+        return "False"
+    if type_name == "int":
+        return "1"
+    if type_name == "float":
+        return "0.0"
+    if type_name.startswith("dict"):
+        return "{}"
+    if type_name.startswith("list"):
+        return "[]"
+    if name in ("response", "summary"):
+        return response
+    return "Okay."
+
+def stub_completion(messages: list, response: str = DEFAULT_RESPONSE) -> str:
+    """ChatAdapter-formatted completion for the prompt in `messages`"""
+    system = messages[0]["content"] if messages and messages[0].get("role") == "system" else ""
+    fields = output_fields(system)
+    tool_args = None
+    if any(name in ("next_tool_name", "action") for name, _ in fields):
+        tool_args = lookup_args(messages)
+    parts = [f"[[ ## {name} ## ]]\n{placeholder(name, type_name, response, tool_args)}" for name, type_name in fields]
+    return "\n\n".join(parts + ["[[ ## completed ## ]]"])
+
+def completion_response(model: str, messages: list, response: str = DEFAULT_RESPONSE) -> dict:
+    """OpenAI chat completion body answering `messages`, with token counts estimated at 4 chars per token"""
+    content = stub_completion(messages, response)
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return {
+        "id": "stub-completion",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_chars // 4 + 1, "completion_tokens": len(content) // 4 + 1, "total_tokens": (prompt_chars + len(content)) // 4 + 2},
+    }
+
+class StubLM(dspy.BaseLM):
+    """dspy LM that answers instantly (or after `latency` seconds) without network access"""
+
+    def __init__(self, latency: float = 0.0, model: str = "stub/offline", response: str = DEFAULT_RESPONSE):
+        super().__init__(model=model, cache=False)
+        self.latency = latency
+        self.response = response
+        self.calls = 0
+        self.busy_time = 0.0
+        self._lock = threading.Lock()
+
+    def _completion(self, messages, prompt):
+        messages = messages or [{"role": "user", "content": prompt or ""}]
+        return completion_response(self.model, messages, self.response)
+
+    def _count(self, started: float):
+        with self._lock:
+            self.calls += 1
+            self.busy_time += time.perf_counter() - started
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        response = self._completion(messages, prompt)
+        self._count(started)
+        return response
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        started = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = self._completion(messages, prompt)
+        self._count(started)
+        return response
+
+class LatencyModel:
+    """Simulated LM latency from a spec string:
+    "fixed:S", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA", all in seconds"""
+
+    KINDS = ("fixed", "uniform", "lognormal")
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, *params = spec.split(":")
+        if kind not in self.KINDS or len(params) != (1 if kind == "fixed" else 2):
+            raise ValueError(f"Unknown latency spec {spec!r}, expected one of fixed:S, uniform:LOW:HIGH, lognormal:MEDIAN:SIGMA")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(param) for param in params]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return median * rng.lognormvariate(0.0, sigma)
+
+class StubLMServer:
+    """OpenAI-compatible /v1/chat/completions endpoint answering with stub completions.
+
+    `max_concurrency` requests are served at once, like a provider's rate of parallel
+    generations; further requests wait for a slot and that wait is recorded in `queue_waits`.
+    A failed request returns HTTP 503 after its latency, like an overloaded provider.
+
+    With `batch_size`, requests are instead served by one simulated engine running a batch at
+    a time: a batch takes up to `batch_size` of the requests waiting or arriving within
+    `batch_gather` seconds, the engine's scheduling step, and lasts one latency sample
+    stretched by `batch_cost` per request beyond the first. Requests arriving while a batch
+    runs wait for the next one.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0", error_rate: float = 0.0,
+                 max_concurrency: Optional[int] = None, response: str = DEFAULT_RESPONSE, seed: Optional[int] = None,
+                 batch_size: Optional[int] = None, batch_cost: float = 0.1, batch_gather: float = 0.02):
+        if batch_size and max_concurrency:
+            raise ValueError("max_concurrency and batch_size are alternative serving models, set only one")
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.response = response
+        self.batch_size = batch_size
+        self.batch_cost = batch_cost
+        self.batch_gather = batch_gather
+        self.requests = 0
+        self.errors = 0
+        self.queue_waits = []
+        self.batch_sizes = []
+        self.busy_time = 0.0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._batches: Optional[queue.Queue] = None
+        if batch_size:
+            self._batches = queue.Queue()
+            threading.Thread(target=self._serve_batches, name="stub-lm-engine", daemon=True).start()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.queue_waits = []
+            self.batch_sizes = []
+            self.busy_time = 0.0
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+                    return
+                status, payload = server.complete(body)
+                self._send(status, payload)
+
+            def _send(self, status: int, payload: dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the request, e.g. a cancelled hedge
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def complete(self, body: dict) -> tuple:
+        """(HTTP status, response body) for one chat completion request"""
+        with self._lock:
+            self.requests += 1
+            # A batch's latency is sampled when the engine starts it
+            delay = self.latency.sample(self._rng) if self._batches is None else 0.0
+            failed = self._rng.random() < self.error_rate
+        if self._batches is not None:
+            served = threading.Event()
+            self._batches.put((time.perf_counter(), served))
+            served.wait()
+        else:
+            self._serve_alone(delay)
+        if failed:
+            with self._lock:
+                self.errors += 1
+            return 503, {"error": {"message": "Simulated provider overload", "type": "server_error"}}
+        return 200, completion_response(body.get("model", "stub/offline"), body.get("messages") or [], self.response)
+
+    def _serve_alone(self, delay: float) -> None:
+        waited = time.perf_counter()
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            with self._lock:
+                self.queue_waits.append(time.perf_counter() - waited)
+                self.busy_time += delay
+            time.sleep(delay)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def _serve_batches(self) -> None:
+        """Engine loop: run one batch of the requests waiting, then the next"""
+        while True:
+            batch = [self._batches.get()]
+            if batch[0] is None:
+                return
+            deadline = time.perf_counter() + self.batch_gather
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._batches.get(timeout=max(deadline - time.perf_counter(), 0.0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._batches.put(None)
+                    break
+                batch.append(item)
+            started = time.perf_counter()
+            with self._lock:
+                delay = self.latency.sample(self._rng) * (1 + self.batch_cost * (len(batch) - 1))
+                self.queue_waits.extend(started - queued for queued, _ in batch)
+                self.batch_sizes.append(len(batch))
+                self.busy_time += delay
+            time.sleep(delay)
+            for _, served in batch:
+                served.set()
+
+    def start(self) -> "StubLMServer":
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-lm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._batches is not None:
+            self._batches.put(None)
+
+    def __enter__(self) -> "StubLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--latency", default="fixed:0.2", help="fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Requests served at once (default unlimited)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Serve requests in batches of up to this many")
+    parser.add_argument("--batch-cost", type=float, default=0.1, help="Batch latency increase per request beyond the first")
+    args = parser.parse_args()
+
+    server = StubLMServer(args.host, args.port, args.latency, args.error_rate, args.max_concurrency,
+                          batch_size=args.batch_size, batch_cost=args.batch_cost)
+    print(f"Stub LM serving {server.url}/chat/completions (latency {args.latency}, error rate {args.error_rate})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -4,34 +4,24 @@ Simulates customer interactions using an LLM instead of hardcoded responses.
 """
 
 import dspy
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List
+import copy
+import datetime
+import hashlib
 import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel
 from logger_config import get_logger
+from src.db import Customer, get_customer_store
 
 # Use unified app logger
 logger = get_logger("testing_agent")
 
-class TestingAgentSignature(dspy.Signature):
-    """Testing agent that simulates a customer calling Sky Credit Group"""
-    scenario_context: str = dspy.InputField(desc="Customer details and scenario information")
-    conversation_history: str = dspy.InputField(desc="Previous conversation messages")
-    assistant_message: str = dspy.InputField(desc="Latest message from the assistant")
-    
-    customer_response: str = dspy.OutputField(desc="Natural customer response as Paul Walshe")
-    should_end_call: bool = dspy.OutputField(desc="True if conversation objective is complete and should end")
-
-class TestingAgent:
-    """Agent that simulates customer interactions for testing the voice assistant"""
-    
-    def __init__(self):
-        logger.debug("Initializing TestingAgent")
-        self.testing_agent = dspy.ChainOfThought(TestingAgentSignature)
-        self.conversation_history = []
-        self.conversation_ended = False
-        logger.debug("TestingAgent initialized successfully")
-        
-        # Customer scenario details
-        self.scenario_context = """
+# Default scenario used by run_test.py
+DEFAULT_SCENARIO_CONTEXT = """
 You are Paul Walshe, a customer calling Sky Credit Group to check your account balance.
 
 Your details:
@@ -55,6 +45,28 @@ Instructions:
 - Don't rush through all steps at once - let the conversation flow naturally
 - Stay in character as Paul Walshe throughout the conversation
 """
+
+class TestingAgentSignature(dspy.Signature):
+    """Testing agent that simulates a customer calling Sky Credit Group"""
+    scenario_context: str = dspy.InputField(desc="Customer details and scenario information")
+    conversation_history: str = dspy.InputField(desc="Previous conversation messages")
+    assistant_message: str = dspy.InputField(desc="Latest message from the assistant")
+    
+    customer_response: str = dspy.OutputField(desc="Natural customer response, staying in character as the customer in the scenario")
+    should_end_call: bool = dspy.OutputField(desc="True if conversation objective is complete and should end")
+
+class TestingAgent:
+    """Agent that simulates customer interactions for testing the voice assistant"""
+    
+    def __init__(self, scenario_context: Optional[str] = None):
+        logger.debug("Initializing TestingAgent")
+        self.testing_agent = dspy.ChainOfThought(TestingAgentSignature)
+        self.conversation_history = []
+        self.conversation_ended = False
+        logger.debug("TestingAgent initialized successfully")
+        
+        # Customer scenario details
+        self.scenario_context = scenario_context or DEFAULT_SCENARIO_CONTEXT
     
     def get_initial_message(self) -> str:
         """Get the initial customer message to start the conversation"""
@@ -91,7 +103,7 @@ Instructions:
             return customer_response
 
         except Exception as e:
-            logger.error(f"Testing Agent error: {str(e)}")
+            logger.error("Testing Agent error: %s", e)
             return "Could you please repeat that?"
     
     def is_conversation_ended(self) -> bool:
@@ -103,47 +115,207 @@ Instructions:
         self.conversation_history = []
         self.conversation_ended = False
 
+# An outcome matcher gets the assistant's lines and the caller's customer record (if known).
+# It returns True or False when the transcript settles the outcome, or None to defer to the LM.
+OutcomeMatcher = Callable[[List[str], Optional[Customer]], Optional[bool]]
+
+# Where the assistant's greeting ends: it asks for the caller's name, or is followed by the first question
+GREETING_ENDS = ("how i can assist you today?", "automated ai voice assistant.")
+CLOSING_QUESTION = re.compile(r"anything else\b[^?]*\b(?:help|assist)[^?]*\?")
+
+def _normalize(text: str) -> str:
+    text = text.lower().replace("$", "")
+    text = re.sub(r"(?<=\d),(?=\d{3})", "", text)
+    text = re.sub(r"\b(\d{1,2})(?:st|nd|rd|th)\b", r"\1", text)
+    return re.sub(r"\s+of\s+", " ", text)
+
+def _after_greeting(lines: List[str]) -> List[str]:
+    """The assistant's lines from the end of its greeting on"""
+    for i, line in enumerate(lines):
+        lowered = line.lower()
+        if "thank you for calling" in lowered:
+            cut = max((lowered.rfind(end) + len(end) for end in GREETING_ENDS if end in lowered), default=len(line))
+            return [line[cut:]] + lines[i + 1:]
+    return lines
+
+def _asks(*phrases: str) -> OutcomeMatcher:
+    """Matcher for the assistant asking a question mentioning any of the phrases, after the
+    greeting: its request for the caller's name does not count as asking for a first name"""
+    def matcher(lines: List[str], customer: Optional[Customer]) -> Optional[bool]:
+        if any("?" in line and any(phrase in line.lower() for phrase in phrases) for line in _after_greeting(lines)):
+            return True
+        return None
+    return matcher
+
+def _says(*phrases: str) -> OutcomeMatcher:
+    """Matcher for the assistant saying any of the phrases"""
+    def matcher(lines: List[str], customer: Optional[Customer]) -> Optional[bool]:
+        if any(phrase in line.lower() for line in lines for phrase in phrases):
+            return True
+        return None
+    return matcher
+
+def _amount_said(amount: float, text: str) -> bool:
+    forms = {f"{amount:.2f}"}
+    if amount == int(amount):
+        forms.add(str(int(amount)))
+    return any(re.search(rf"(?<![\d.]){re.escape(form)}(?![\d]|\.\d)", text) for form in forms)
+
+def _date_said(iso_date: str, text: str) -> bool:
+    date = datetime.date.fromisoformat(iso_date)
+    month = date.strftime("%B").lower()
+    forms = (
+        iso_date, f"{date.day} {month}", f"{month} {date.day}", f"{date.day} {month[:3]}",
+        f"{date.day}/{date.month}", f"{date.day:02d}/{date.month:02d}",
+    )
+    return any(re.search(rf"(?<!\d){re.escape(form)}(?!\d)", text) for form in forms)
+
+def _states_balance(lines: List[str], customer: Optional[Customer]) -> Optional[bool]:
+    if customer is None:
+        return None
+    return any(_amount_said(customer.accountBalance, _normalize(line)) for line in lines)
+
+def _states_next_payment(lines: List[str], customer: Optional[Customer]) -> Optional[bool]:
+    if customer is None:
+        return None
+    text = _normalize(" ".join(lines))
+    return _amount_said(customer.minimumAmountDue, text) and _date_said(customer.nextPaymentDate, text)
+
+def _closes_call(lines: List[str], customer: Optional[Customer]) -> Optional[bool]:
+    """The assistant asks the closing question, then thanks the caller in a later turn"""
+    for i, line in enumerate(lines):
+        if CLOSING_QUESTION.search(line.lower()) and any("thank" in later.lower() for later in lines[i + 1:]):
+            return True
+    return None
+
+# Expected outcomes of the balance enquiry call, with a matcher where one can decide it.
+# Outcomes without a matcher, or whose matcher is inconclusive, are judged by the LM.
+DEFAULT_OUTCOMES: List[tuple] = [
+    ("The main agent should ask for the customer's reference number", _asks("reference")),
+    ("The main agent should ask for the customer's first name", _asks("first name", "your name")),
+    ("The main agent should ask for the customer's last name", _asks("last name", "surname")),
+    ("The main agent should ask for the customer's date of birth", _asks("date of birth", "birthday")),
+    ("The main agent should state that they are looking up the account", _says("look up", "looking up", "locate your account", "checking your account", "bring up your account")),
+    ("The main agent should state that the account has been located and provide the current net balance", _states_balance),
+    ("The main agent should state the next payment amount and its due date", _states_next_payment),
+    ("The main agent should ask if the payment will be taken successfully on the due date", None),
+    ("The main agent should confirm that the payment will process automatically", None),
+    ("The main agent should ask if there is anything else and thank the caller", _closes_call),
+]
+
+class OutcomeJudgement(BaseModel):
+    outcome: str
+    achieved: bool
+    evidence: str
+
+class FuzzyOutcomeSignature(dspy.Signature):
+    """Judge whether the assistant achieved each expected outcome in a customer call.
+    Return exactly one judgement per expected outcome, in order, quoting the assistant as evidence."""
+    conversation_transcript: str = dspy.InputField(desc="Call transcript, one 'Speaker: message' line per turn")
+    expected_outcomes: List[str] = dspy.InputField(desc="Outcomes the assistant should have achieved")
+    judgements: List[OutcomeJudgement] = dspy.OutputField(desc="One judgement per expected outcome")
+
+def transcript_key(conversation_transcript: List[str], customer_reference: Optional[str], outcomes: List[str]) -> str:
+    """Cache key of one evaluation"""
+    payload = json.dumps([conversation_transcript, customer_reference, outcomes])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 class ConversationEvaluator:
-    """Evaluates conversation against expected outcomes"""
+    """Evaluates conversation against expected outcomes.
+
+    Outcomes that can be checked against the transcript and the customer record are decided by
+    rule; only the rest go to one typed LM call. Results are cached by transcript hash, in
+    memory and optionally in a JSONL file so re-scored regression transcripts are free.
+    """
     
-    def __init__(self):
+    def __init__(self, outcomes: Optional[List[tuple]] = None, cache_path: Optional[str] = None):
         logger.debug("Initializing ConversationEvaluator")
-        self.evaluation_agent = dspy.ChainOfThought(
-            "conversation_transcript, expected_outcomes -> evaluation_json: str"
-        )
+        self.evaluation_agent = dspy.Predict(FuzzyOutcomeSignature)
 
-        self.expected_outcomes = [
-            "The main agent should ask for the customer's reference number",
-            "The main agent should ask for the customer's first name",
-            "The main agent should ask for the customer's last name",
-            "The main agent should ask for the customer's date of birth",
-            "The main agent should state that they are looking up the account",
-            "The main agent should state that the account has been located and provide the current net balance",
-            "The main agent should state the next payment amount and its due date",
-            "The main agent should ask if the payment will be taken successfully on the due date",
-            "The main agent should confirm that the payment will process automatically",
-            "The main agent should ask if there is anything else and thank the caller"
-        ]
-        logger.debug(f"Initialized with {len(self.expected_outcomes)} expected outcomes")
+        self.outcomes = outcomes or DEFAULT_OUTCOMES
+        self.expected_outcomes = [outcome for outcome, _ in self.outcomes]
+        self.cache: Dict[str, dict] = {}
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.cache[entry["key"]] = entry["evaluation"]
+        logger.debug("Initialized with %d expected outcomes", len(self.expected_outcomes))
     
-    def evaluate_conversation(self, conversation_transcript: List[str]) -> dict:
-        """Evaluate the conversation against expected outcomes"""
-        logger.info(f"Evaluating conversation with {len(conversation_transcript)} messages")
+    def evaluate_conversation(self, conversation_transcript: List[str], customer_reference: Optional[str] = None) -> dict:
+        """Evaluate the conversation against expected outcomes. The result is the caller's own
+        copy, so changing it does not change the cached evaluation."""
+        key = transcript_key(conversation_transcript, customer_reference, self.expected_outcomes)
+        with self._lock:
+            cached = self.cache.get(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
 
-        transcript_str = "\n".join(conversation_transcript)
-        outcomes_str = "\n".join([f"{i+1}. {outcome}" for i, outcome in enumerate(self.expected_outcomes)])
+        logger.info("Evaluating conversation with %d messages", len(conversation_transcript))
+        customer = get_customer_store().get_by_reference(customer_reference) if customer_reference else None
+        assistant_lines = [line.split(":", 1)[1].strip() for line in conversation_transcript if line.startswith("Assistant:")]
 
-        try:
-            result = self.evaluation_agent(
-                conversation_transcript=transcript_str,
-                expected_outcomes=outcomes_str
-            )
+        results = []
+        fuzzy = []
+        for outcome, matcher in self.outcomes:
+            achieved = matcher(assistant_lines, customer) if matcher else None
+            if achieved is None:
+                fuzzy.append(len(results))
+                results.append({"outcome": outcome, "achieved": None, "evidence": "", "method": "lm"})
+            else:
+                results.append({"outcome": outcome, "achieved": achieved, "evidence": "", "method": "rule"})
 
-            # Try to parse the JSON response
-            evaluation = json.loads(result.evaluation_json)
-            logger.info(f"Evaluation completed")
-            return evaluation
+        evaluation = {"outcomes": results}
+        if fuzzy:
+            try:
+                self._judge(conversation_transcript, [results[i] for i in fuzzy])
+            except Exception as e:
+                logger.error("Evaluation error: %s", e)
+                evaluation["error"] = f"Failed to evaluate conversation: {str(e)}"
 
-        except Exception as e:
-            logger.error(f"Evaluation error: {str(e)}")
-            return {"error": f"Failed to evaluate conversation: {str(e)}"}
+        achieved = sum(1 for result in results if result["achieved"])
+        evaluation.update(
+            achieved=achieved,
+            total=len(results),
+            score=achieved / len(results) if results else 0.0,
+            lm_outcomes=len(fuzzy),
+        )
+        # Failed LM calls are retried on the next evaluation rather than cached
+        if "error" not in evaluation:
+            self._store(key, copy.deepcopy(evaluation))
+        logger.info("Evaluation completed: %d/%d outcomes, %d judged by LM", achieved, len(results), len(fuzzy))
+        return evaluation
+
+    def evaluate_many(
+        self,
+        transcripts: List[List[str]],
+        customer_references: Optional[List[Optional[str]]] = None,
+        max_workers: int = 8,
+    ) -> List[dict]:
+        """Evaluate many transcripts concurrently, returning evaluations in input order"""
+        references = customer_references or [None] * len(transcripts)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(self.evaluate_conversation, transcripts, references))
+
+    def _judge(self, conversation_transcript: List[str], pending: List[dict]) -> None:
+        """Fill in the LM's judgements for outcomes the rules left open"""
+        result = self.evaluation_agent(
+            conversation_transcript="\n".join(conversation_transcript),
+            expected_outcomes=[item["outcome"] for item in pending],
+        )
+        judgements = {judgement.outcome: judgement for judgement in result.judgements}
+        for i, item in enumerate(pending):
+            # Match by text, falling back to position when the model rewords an outcome
+            judgement = judgements.get(item["outcome"]) or (result.judgements[i] if i < len(result.judgements) else None)
+            if judgement is not None:
+                item["achieved"] = judgement.achieved
+                item["evidence"] = judgement.evidence
+
+    def _store(self, key: str, evaluation: dict) -> None:
+        with self._lock:
+            self.cache[key] = evaluation
+            if self.cache_path:
+                with open(self.cache_path, "a") as f:
+                    f.write(json.dumps({"key": key, "evaluation": evaluation}) + "\n")
@@ -0,0 +1,56 @@
+import multiprocessing
+
+import pytest
+
+from src.customer_store import ColumnarCustomerStore, InMemoryCustomerStore, SQLiteCustomerStore, build_columnar_store
+from src.db import CUSTOMER_DATABASE, lookup_customer, set_customer_store
+
+@pytest.fixture(params=["memory", "sqlite", "columnar"])
+def store(request, tmp_path):
+    customers = list(CUSTOMER_DATABASE.values())
+    if request.param == "memory":
+        store = InMemoryCustomerStore(customers)
+    elif request.param == "sqlite":
+        store = SQLiteCustomerStore(str(tmp_path / "customers.db"))
+        store.add_many(customers)
+    else:
+        path = str(tmp_path / "customers.col")
+        build_columnar_store((customer.model_dump() for customer in customers), path)
+        store = ColumnarCustomerStore(path)
+    set_customer_store(store)
+    yield store
+    set_customer_store(None)
+
+def test_lookup_by_reference(store):
+    assert lookup_customer("xt 59591", "Paul", "Walshe").clientReferenceNumber == "XT59591"
+
+def test_lookup_by_mobile(store):
+    assert lookup_customer("0402 017 491", "paul", "walshe").clientReferenceNumber == "XT59591"
+    assert [customer.clientReferenceNumber for customer in store.find_by_mobile("+61402017491")] == ["XT59591"]
+
+def test_lookup_missing_key(store):
+    assert lookup_customer("AB12345", "Paul", "Walshe") is None
+    assert store.get_by_reference("AB12345") is None
+    assert store.find_by_mobile("+61400000000") == []
+
+def test_lookup_wrong_name(store):
+    assert lookup_customer("XT59591", "Greg", "Haynes") is None
+
+def test_store_size(store):
+    assert len(store) == len(CUSTOMER_DATABASE)
+
+def look_up_in_child(store: SQLiteCustomerStore) -> None:
+    # Sharing the parent's open connection would corrupt it, so the child opens its own
+    assert getattr(store._local, "conn", None) is None
+    assert store.get_by_reference("PO18973").firstName == "Greg"
+
+def test_sqlite_store_reopens_after_fork(tmp_path):
+    store = SQLiteCustomerStore(str(tmp_path / "customers.db"))
+    store.add_many(CUSTOMER_DATABASE.values())
+    # The parent's connection is open when the child is forked
+    assert store.get_by_reference("XT59591") is not None
+    process = multiprocessing.get_context("fork").Process(target=look_up_in_child, args=(store,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert store.get_by_reference("XT59591").firstName == "Paul"
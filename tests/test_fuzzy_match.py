@@ -0,0 +1,33 @@
+from benchmarks.suite import synthetic_customers
+from src.customer_store import InMemoryCustomerStore
+from src.db import set_customer_store
+from src.fuzzy_match import SPOKEN_REFERENCE, match_customer, parse_spoken_reference, reference_neighbours
+
+def test_contraction_is_not_read_as_letters():
+    assert parse_spoken_reference("I'm a 12345 customer") is None
+
+def test_one_letter_words_are_not_letters():
+    assert parse_spoken_reference("it's i a 1 2 3 4 5") is None
+
+def test_nato_reference():
+    assert parse_spoken_reference("x-ray tango five nine five nine one")[0] == "XT59591"
+
+def test_spelled_one_letter_words_are_letters():
+    assert parse_spoken_reference("A for alpha, I for india, 1 2 3 4 5")[0] == "AI12345"
+
+def test_misheard_reference_recovered_from_neighbours():
+    customers = list(synthetic_customers(1_000))
+    customers[42] = customers[42].model_copy(update={"firstName": "Madisson", "lastName": "McCrystal"})
+    set_customer_store(InMemoryCustomerStore(customers))
+    try:
+        # AA00042 heard as AA00047, both names misspelled by the speech-to-text
+        match = match_customer("alpha alpha zero zero zero four seven", "Madison", "McCristal")
+    finally:
+        set_customer_store(None)
+    assert match.customer.clientReferenceNumber == "AA00042"
+    assert match.method == "reference_recovered"
+
+def test_reference_neighbours_keep_the_format():
+    neighbours = list(reference_neighbours("XT59591"))
+    assert len(neighbours) == len(set(neighbours)) == 2 * 25 + 5 * 9
+    assert all(SPOKEN_REFERENCE.fullmatch(neighbour) for neighbour in neighbours)
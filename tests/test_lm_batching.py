@@ -0,0 +1,57 @@
+import threading
+import time
+
+import dspy
+import pytest
+
+from lm_batching import BatchingLM
+
+class FakeLM(dspy.BaseLM):
+    """Answers every request after `delay` seconds, recording the prompts it was sent"""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(model="openai/fake", cache=False)
+        self.delay = delay
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with self.lock:
+            self.prompts.append(prompt)
+        time.sleep(self.delay)
+        return {"choices": [{"message": {"content": f"Answer to {prompt}"}}]}
+
+def test_concurrent_requests_sent_as_one_batch():
+    lm = BatchingLM(FakeLM(), max_batch=4, max_wait=5.0)
+    started = time.perf_counter()
+    futures = [lm._submit(f"p{i}", None, {}) for i in range(4)]
+    assert [future.result(timeout=2)["choices"][0]["message"]["content"] for future in futures] == [f"Answer to p{i}" for i in range(4)]
+    # A full batch goes out without waiting for the window
+    assert time.perf_counter() - started < 1.0
+    assert lm.stats()["batches"] == 1 and lm.stats()["max_batch_size"] == 4
+    lm.close()
+
+def test_partial_batch_sent_after_max_wait():
+    lm = BatchingLM(FakeLM(), max_batch=8, max_wait=0.05)
+    started = time.perf_counter()
+    lm.forward(prompt="only")
+    assert 0.04 <= time.perf_counter() - started < 1.0
+    assert lm.stats()["mean_batch_size"] == 1
+    lm.close()
+
+def test_cancelled_request_left_out_of_batch():
+    fake = FakeLM()
+    lm = BatchingLM(fake, max_batch=8, max_wait=0.2)
+    kept, cancelled = lm._submit("kept", None, {}), lm._submit("cancelled", None, {})
+    assert cancelled.cancel()
+    kept.result(timeout=2)
+    assert fake.prompts == ["kept"]
+    lm.close()
+
+def test_close_sends_queued_requests_then_refuses_new_ones():
+    lm = BatchingLM(FakeLM(delay=0.05), max_batch=8, max_wait=10.0)
+    futures = [lm._submit(f"p{i}", None, {}) for i in range(3)]
+    lm.close()
+    assert all(future.result(timeout=2) for future in futures)
+    with pytest.raises(RuntimeError):
+        lm.forward(prompt="late")
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import dspy
+import pytest
+
+from lm_hedging import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HedgedLM, LMBackend, LMUnavailable
+
+class FakeLM(dspy.BaseLM):
+    """Answers `content` after `delay` seconds, or raises `error`, counting the calls it got"""
+
+    def __init__(self, name: str, delay: float = 0.0, content: str = "ok", error: Exception = None):
+        super().__init__(model=f"openai/{name}", cache=False)
+        self.delay = delay
+        self.content = content
+        self.error = error
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _answer(self):
+        if self.error is not None:
+            raise self.error
+        return {"choices": [{"message": {"content": self.content}}]}
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self._answer()
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self._answer()
+
+def content(response) -> str:
+    return response["choices"][0]["message"]["content"]
+
+def test_hedge_sent_after_the_delay():
+    primary, secondary = FakeLM("primary", delay=1.0), FakeLM("secondary", content="hedge")
+    lm = HedgedLM([LMBackend(primary), LMBackend(secondary)], hedge_delay=0.05)
+    started = time.perf_counter()
+    assert content(lm.forward(prompt="hi")) == "hedge"
+    assert 0.05 <= time.perf_counter() - started < 0.5
+    assert lm.hedges == 1 and lm.hedged_requests == 1
+
+def test_async_hedge_sent_after_the_delay():
+    primary, secondary = FakeLM("primary", delay=1.0), FakeLM("secondary", content="hedge")
+    lm = HedgedLM([LMBackend(primary), LMBackend(secondary)], hedge_delay=0.05)
+    started = time.perf_counter()
+    assert content(asyncio.run(lm.aforward(prompt="hi"))) == "hedge"
+    assert time.perf_counter() - started < 0.5
+    assert lm.hedges == 1
+
+def test_no_hedge_when_the_primary_answers_in_time():
+    primary, secondary = FakeLM("primary"), FakeLM("secondary")
+    lm = HedgedLM([LMBackend(primary), LMBackend(secondary)], hedge_delay=0.5)
+    assert content(lm.forward(prompt="hi")) == "ok"
+    assert secondary.calls == 0 and lm.hedges == 0
+
+@pytest.mark.parametrize("primary", [
+    FakeLM("primary", error=ConnectionError("refused")),
+    FakeLM("primary", content=""),
+], ids=["error", "empty"])
+def test_failover_without_waiting_for_the_hedge(primary):
+    lm = HedgedLM([LMBackend(primary), LMBackend(FakeLM("secondary", content="backup"))], hedge_delay=5.0)
+    started = time.perf_counter()
+    assert content(lm.forward(prompt="hi")) == "backup"
+    assert time.perf_counter() - started < 1.0
+    assert lm.failovers == 1 and lm.backends[0].failures == 1
+
+def test_unavailable_when_every_backend_fails():
+    lm = HedgedLM([LMBackend(FakeLM("primary", error=ConnectionError("refused")))])
+    with pytest.raises(LMUnavailable):
+        lm.forward(prompt="hi")
+
+def test_breaker_opens_after_repeated_failures():
+    primary = FakeLM("primary", error=ConnectionError("refused"))
+    backend = LMBackend(primary, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60.0))
+    lm = HedgedLM([backend, LMBackend(FakeLM("secondary"))], hedge_delay=5.0)
+    lm.forward(prompt="1")
+    assert backend.breaker.state == CLOSED
+    lm.forward(prompt="2")
+    assert backend.breaker.state == OPEN
+    lm.forward(prompt="3")
+    # An open circuit sends nothing to the backend
+    assert primary.calls == 2
+
+def test_half_open_lets_exactly_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+def test_concurrent_requests_send_one_probe():
+    primary = FakeLM("primary", delay=0.2)
+    backend = LMBackend(primary, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    backend.breaker.record_failure()
+    time.sleep(0.06)
+    lm = HedgedLM([backend, LMBackend(FakeLM("secondary", delay=0.3))], hedge_delay=5.0)
+
+    async def burst():
+        return await asyncio.gather(*(lm.aforward(prompt=f"p{i}") for i in range(4)))
+
+    asyncio.run(burst())
+    assert primary.calls == 1
+    assert backend.breaker.state == CLOSED
+
+def test_abandoned_probe_releases_the_half_open_slot():
+    primary = FakeLM("primary", delay=1.0)
+    backend = LMBackend(primary, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    backend.breaker.record_failure()
+    time.sleep(0.06)
+    lm = HedgedLM([backend, LMBackend(FakeLM("secondary", content="hedge"))], hedge_delay=0.05)
+    # The probe is still running when the hedge wins, so it ends without an outcome
+    assert content(asyncio.run(lm.aforward(prompt="hi"))) == "hedge"
+    assert backend.breaker.state == HALF_OPEN
+    assert backend.breaker.allow()
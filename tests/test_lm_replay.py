@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from lm_replay import LMCacheMiss, RecordReplayLM
+from stub_lm import StubLM
+
+MESSAGES = [{"role": "user", "content": "What is my balance?"}]
+
+def test_replay_serves_recorded_completions(tmp_path):
+    path = str(tmp_path / "lm_cache.sqlite")
+    recorder = RecordReplayLM(StubLM(response="Recorded reply"), path, mode="record")
+    recorded = recorder.forward(messages=MESSAGES, temperature=0.0)
+    recorded_async = asyncio.run(recorder.aforward(messages=MESSAGES + MESSAGES, temperature=0.0))
+
+    upstream = StubLM(response="Live reply")
+    replayer = RecordReplayLM(upstream, path, mode="replay")
+    assert replayer.forward(messages=MESSAGES, temperature=0.0) == recorded
+    assert asyncio.run(replayer.aforward(messages=MESSAGES + MESSAGES, temperature=0.0)) == recorded_async
+    assert upstream.calls == 0
+    assert replayer.hits == 2 and replayer.misses == 0
+
+def test_replay_miss_raises(tmp_path):
+    path = str(tmp_path / "lm_cache.sqlite")
+    RecordReplayLM(StubLM(), path, mode="record").forward(messages=MESSAGES, temperature=0.0)
+
+    upstream = StubLM()
+    replayer = RecordReplayLM(upstream, path, mode="replay")
+    # Any change to the request is a different recording
+    with pytest.raises(LMCacheMiss):
+        replayer.forward(messages=MESSAGES, temperature=0.7)
+    with pytest.raises(LMCacheMiss):
+        asyncio.run(replayer.aforward(messages=[{"role": "user", "content": "Hello"}]))
+    assert upstream.calls == 0 and replayer.misses == 2
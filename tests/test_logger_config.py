@@ -0,0 +1,25 @@
+import logging
+
+from logger_config import ContextFilter, Truncated
+
+class Rendered:
+    """Counts how often it is rendered into a message"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.renders = 0
+
+    def __str__(self) -> str:
+        self.renders += 1
+        return self.text
+
+def test_truncated_argument_is_cut():
+    assert str(Truncated("x" * 10, limit=4)) == "xxxx... [truncated 6 chars]"
+    assert str(Truncated("short", limit=10)) == "short"
+
+def test_sampled_out_debug_record_is_never_rendered():
+    value = Rendered("a large prediction")
+    record = logging.LogRecord("app", logging.DEBUG, __file__, 1, "Generated Result: %s", (Truncated(value),), None)
+    assert not ContextFilter(debug_sample_rate=0.0).filter(record)
+    assert value.renders == 0
+    assert record.getMessage() == "Generated Result: a large prediction"
@@ -0,0 +1,20 @@
+import asyncio
+
+import dspy
+import pytest
+
+from src.main_agent import MainAgent
+
+def test_stream_without_final_prediction_raises(monkeypatch):
+    async def no_prediction(**inputs):
+        yield dspy.streaming.StreamResponse(predict_name="react", signature_field_name="response", chunk="Let me", is_last_chunk=False)
+
+    monkeypatch.setattr(dspy, "streamify", lambda program, **kwargs: no_prediction)
+
+    async def turn(agent):
+        return [chunk async for chunk in agent.stream_input("What is my balance?")]
+
+    agent = MainAgent(fast_verification=False, orchestrate_scenarios=False, prefetch=False)
+    with pytest.raises(RuntimeError, match="without a final prediction"):
+        asyncio.run(turn(agent))
+    assert agent.state.history.messages == []
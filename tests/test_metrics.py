@@ -0,0 +1,13 @@
+from src.metrics import PrometheusExporter, TurnMetrics
+
+def test_latency_rendered_as_cumulative_histogram():
+    exporter = PrometheusExporter(buckets={"turn_latency_seconds": (0.5, 1.0)})
+    for latency in (0.5, 0.7, 3.0):
+        exporter(TurnMetrics(session_id="s", turn=1, latency=latency, path="react", time_to_first_chunk=0.2))
+    text = exporter.render()
+    assert "# TYPE sky_agent_turn_latency_seconds histogram" in text
+    assert 'sky_agent_turn_latency_seconds_bucket{path="react",le="0.5"} 1' in text
+    assert 'sky_agent_turn_latency_seconds_bucket{path="react",le="1"} 2' in text
+    assert 'sky_agent_turn_latency_seconds_bucket{path="react",le="+Inf"} 3' in text
+    assert 'sky_agent_turn_time_to_first_chunk_seconds_count{path="react"} 3' in text
+    assert "quantile" not in text
@@ -0,0 +1,23 @@
+from src.main_agent import ConversationState
+from src.orchestrator import TRANSFER_REPLY, ScenarioOrchestrator
+
+def verified_state() -> ConversationState:
+    state = ConversationState(session_id="test", verified_customer_ref="XT59591")
+    state.scenario.active = "hardship"
+    state.scenario.step = 3
+    return state
+
+def test_transfer_ends_scenario_and_tells_customer():
+    orchestrator = ScenarioOrchestrator()
+    state = verified_state()
+    reply = orchestrator._advance(state, "hardship", {"response": "I'm sorry to hear that.", "next_step": 4, "needs_transfer": True})
+    assert reply.endswith(TRANSFER_REPLY)
+    assert state.scenario.active is None and "hardship" in state.scenario.completed
+    assert "transfer" in state.pinned_facts
+    # Later turns go to the main agent
+    assert orchestrator.select(state, "I'm struggling with my balance") is None
+
+def test_transfer_reply_not_repeated():
+    state = verified_state()
+    response = "Thank you, I'll transfer you to our hardship team now."
+    assert ScenarioOrchestrator()._advance(state, "hardship", {"response": response, "needs_transfer": True}) == response
@@ -0,0 +1,16 @@
+from src.main_agent import ConversationState, MainAgent, _prefetch_session
+
+def test_unnamed_sessions_keep_prefetches_apart():
+    with MainAgent(fast_verification=False, orchestrate_scenarios=False) as agent:
+        first, second = ConversationState(), ConversationState()
+        agent._prefetch(first, "My reference is XT59591")
+        assert agent.prefetcher.candidates(_prefetch_session(first), "XT59591")
+        assert agent.prefetcher.candidates(_prefetch_session(second), "XT59591") is None
+        agent.end_session(first)
+        assert _prefetch_session(first) not in agent.prefetcher.sessions
+
+def test_close_stops_prefetch_threads():
+    agent = MainAgent()
+    with agent:
+        agent._prefetch(agent.state, "My reference is XT59591")
+    assert agent.prefetcher.pool._shutdown
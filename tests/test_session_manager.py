@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import dspy
+
+from src.main_agent import MainAgent
+from src.session_manager import SessionManager, TurnInterrupted
+from src.session_store import SQLiteSessionStore
+from stub_lm import StubLM
+
+def make_manager(store=None, **kwargs) -> SessionManager:
+    agent = MainAgent(fast_verification=False, orchestrate_scenarios=False, prefetch=False)
+    return SessionManager(agent, store=store, **kwargs)
+
+def test_three_quick_inputs_leave_one_merged_turn():
+    async def call():
+        manager = make_manager()
+        first = asyncio.ensure_future(manager.process_input("call", "I want to"))
+        await asyncio.sleep(0.05)
+        # The third input arrives while the second still waits for the first to roll back
+        second = asyncio.ensure_future(manager.process_input("call", "pay my"))
+        third = asyncio.ensure_future(manager.process_input("call", "arrears"))
+        outcomes = await asyncio.gather(first, second, third, return_exceptions=True)
+        return manager, outcomes
+
+    with dspy.context(lm=StubLM(latency=0.2)):
+        manager, outcomes = asyncio.run(call())
+    assert isinstance(outcomes[0], TurnInterrupted)
+    assert isinstance(outcomes[1], TurnInterrupted)
+    assert isinstance(outcomes[2], str)
+    messages = manager.sessions["call"].history.messages
+    assert [message["customer_input"] for message in messages] == ["I want to pay my arrears"]
+
+def test_turns_of_one_session_run_one_at_a_time():
+    async def call():
+        manager = make_manager()
+        order = []
+
+        async def turn(name):
+            async with manager._turn("call"):
+                order.append(f"{name} in")
+                await asyncio.sleep(0.05)
+                order.append(f"{name} out")
+
+        await asyncio.gather(turn("first"), turn("second"))
+        return order
+
+    assert asyncio.run(call()) == ["first in", "first out", "second in", "second out"]
+
+def test_lm_slots_bound_concurrent_turns():
+    async def call(max_inflight_lm):
+        manager = make_manager(max_inflight_lm=max_inflight_lm)
+        started = time.perf_counter()
+        await asyncio.gather(*(manager.process_input(f"call-{i}", "What is my balance?") for i in range(2)))
+        waits = [manager.sessions[f"call-{i}"].last_lm_queue_wait for i in range(2)]
+        return time.perf_counter() - started, waits
+
+    with dspy.context(lm=StubLM(latency=0.1)):
+        parallel, parallel_waits = asyncio.run(call(2))
+        serial, serial_waits = asyncio.run(call(1))
+    # A turn is one ReAct step and one extract call, 0.2s of LM time
+    assert max(parallel_waits) < 0.05 and parallel < 0.35
+    assert max(serial_waits) >= 0.2 and serial >= 0.4
+
+def test_turns_resume_from_the_session_store(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def turn(customer_input):
+        manager = make_manager(store=SQLiteSessionStore(path))
+        await manager.process_input("call", customer_input)
+        return manager.sessions["call"]
+
+    with dspy.context(lm=StubLM()):
+        asyncio.run(turn("Hello"))
+        state = asyncio.run(turn("What is my balance?"))
+    assert [message["customer_input"] for message in state.history.messages] == ["Hello", "What is my balance?"]
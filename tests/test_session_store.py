@@ -0,0 +1,36 @@
+import multiprocessing
+
+import pytest
+
+from src.main_agent import ConversationState
+from src.session_store import DbmSessionStore, SQLiteSessionStore
+from src.worker_pool import WorkerPool
+
+def add_turn(state: ConversationState, text: str) -> None:
+    state.history.messages.append({"customer_input": text, "response": f"Reply to {text}"})
+
+def save_second_turn(path: str) -> None:
+    # Another process continues the call from what the first one stored
+    store = SQLiteSessionStore(path)
+    state = store.load("s1")
+    add_turn(state, "second")
+    store.save(state)
+
+def test_sqlite_store_shared_between_processes(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path)
+    state = ConversationState(session_id="s1")
+    add_turn(state, "first")
+    store.save(state)
+
+    process = multiprocessing.get_context("fork").Process(target=save_second_turn, args=(path,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+    loaded = store.load("s1", cached=state)
+    assert [message["customer_input"] for message in loaded.history.messages] == ["first", "second"]
+
+def test_worker_pool_rejects_dbm_store(tmp_path):
+    with pytest.raises(ValueError):
+        WorkerPool(workers=2, store=DbmSessionStore(str(tmp_path / "sessions")))
@@ -0,0 +1,23 @@
+from src.verification import GREETING, QUESTIONS
+from testing_agent import ConversationEvaluator, _asks, _closes_call
+
+GREETING_PREFIX = GREETING.split(" Can I")[0] + " "
+
+def test_greeting_is_not_a_first_name_question():
+    assert _asks("first name", "your name")([GREETING, QUESTIONS["reference_or_mobile"]], None) is None
+    assert _asks("first name", "your name")([GREETING, QUESTIONS["first_name"]], None)
+
+def test_question_asked_with_the_greeting_counts():
+    assert _asks("reference")([GREETING_PREFIX + QUESTIONS["reference_or_mobile"]], None)
+
+def test_closing_needs_the_question_then_thanks():
+    assert _closes_call(["Thank you, I have updated anything else on file."], None) is None
+    assert _closes_call(["Is there anything else I can help you with today?"], None) is None
+    assert _closes_call(["Is there anything else I can help you with today?", "Thank you for calling, goodbye."], None)
+
+def test_cached_evaluations_are_copies():
+    evaluator = ConversationEvaluator(outcomes=[("The main agent should ask for the customer's reference number", _asks("reference"))])
+    transcript = ["Customer: Hi", "Assistant: " + QUESTIONS["reference_or_mobile"]]
+    first = evaluator.evaluate_conversation(transcript)
+    first["outcomes"][0]["achieved"] = False
+    assert evaluator.evaluate_conversation(transcript)["outcomes"][0]["achieved"] is True
@@ -0,0 +1,37 @@
+from src.verification import GREETING, VerificationSlots, VerificationStage
+
+def run_turns(*inputs):
+    stage, slots = VerificationStage(), VerificationSlots()
+    replies = [stage.respond(slots, text) for text in inputs]
+    return slots, replies
+
+def test_this_is_does_not_fill_a_name():
+    slots, replies = run_turns("Hi", "this is urgent please")
+    assert replies[0] == GREETING
+    assert slots.first_name is None and slots.last_name is None
+
+def test_urgent_call_does_not_shift_later_names():
+    slots, _ = run_turns("Hi", "this is urgent please", "My reference is XT59591", "Paul", "Walshe", "15th March 1985")
+    assert slots.first_name != "urgent"
+    assert slots.last_name != "Paul"
+
+def test_full_flow_fills_each_slot_asked_for():
+    slots, replies = run_turns("Hi", "I'd like my balance", "XT59591", "It's Paul", "Walshe", "15th March 1985")
+    assert slots.collected() == {
+        "reference_or_mobile": "XT59591", "first_name": "Paul", "last_name": "Walshe", "date_of_birth": "1985-03-15",
+    }
+    assert replies[-1] is None and slots.done
+
+def test_my_name_is_with_full_name_fills_both():
+    slots, _ = run_turns("Hi, my name is Paul Walshe and I want my balance")
+    assert (slots.first_name, slots.last_name) == ("Paul", "Walshe")
+
+def test_my_name_is_single_name_fills_the_slot_asked_for():
+    stage, slots = VerificationStage(), VerificationSlots(reference_or_mobile="XT59591", first_name="Paul", greeted=True, pending="last_name")
+    stage.respond(slots, "my name is Walshe")
+    assert (slots.first_name, slots.last_name) == ("Paul", "Walshe")
+
+def test_labelled_last_name():
+    stage, slots = VerificationStage(), VerificationSlots(greeted=True, pending="first_name")
+    stage.respond(slots, "first name is Paul, last name is Walshe")
+    assert (slots.first_name, slots.last_name) == ("Paul", "Walshe")